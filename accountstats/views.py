@@ -1,10 +1,8 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from django.conf import settings
 from datetime import timedelta
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
-from userportal.common import account_or_staff, Prometheus, parse_start_end
+from userportal.common import account_or_staff, get_prometheus, parse_start_end, GraphResponse
 from userportal.common import compute_allocations_by_user, compute_allocations_by_slurm_account
 from userportal.common import anonymize as a
 from notes.models import Note
@@ -13,7 +11,7 @@ from notes.models import Note
 LONG_PERIOD = timedelta(days=60)
 SHORT_PERIOD = timedelta(days=14)
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 @login_required
@@ -65,7 +63,7 @@ def graph_application(request, account):
         })
     layout = {'showlegend': True}
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 def graph(request, query, stacked=True, unit=None):
@@ -93,7 +91,7 @@ def graph(request, query, stacked=True, unit=None):
     if unit is not None:
         layout['yaxis'] = {'ticksuffix': ' ' + unit}
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -187,7 +185,7 @@ def graph_lustre_ost(request, account):
         },
         'showlegend': True
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -348,4 +346,4 @@ def graph_cpu_or_gpu_priority(request, account, gpu_or_cpu):
         'showlegend': True,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
@@ -1,14 +1,12 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from userportal.common import openstackproject_or_staff, cloud_projects_by_user, request_to_username, staff, Prometheus, parse_start_end
+from userportal.common import openstackproject_or_staff, cloud_projects_by_user, request_to_username, staff, get_prometheus, parse_start_end, GraphResponse
 from userportal.common import anonymize as a
-from django.conf import settings
 from datetime import datetime, timedelta
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
 from collections import Counter
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 @login_required
@@ -123,7 +121,7 @@ def project_graph_cpu(request, project):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -169,7 +167,7 @@ def projects_graph_cpu(request):
             'title': _('Cores'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -226,7 +224,7 @@ def instance_graph_cpu(request, project, uuid):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -291,7 +289,7 @@ def project_graph_memory(request, project):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -347,7 +345,7 @@ def instance_graph_memory(request, project, uuid):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -395,7 +393,7 @@ def projects_graph_mem(request):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -446,7 +444,7 @@ def project_graph_disk_bandwidth(request, project):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -489,7 +487,7 @@ def instance_graph_disk_bandwidth(request, project, uuid):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -539,7 +537,7 @@ def project_graph_disk_iops(request, project):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -580,7 +578,7 @@ def instance_graph_disk_iops(request, project, uuid):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -631,7 +629,7 @@ def project_graph_network_bandwidth(request, project):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -674,4 +672,4 @@ def instance_graph_network_bandwidth(request, project, uuid):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
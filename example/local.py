@@ -46,3 +46,14 @@ def username_to_uid(username):
 def uid_to_username(uid):
     """return the username of a uid"""
     return pwd.getpwuid(uid).pw_name
+
+
+def uids_to_usernames(uids):
+    """return a dict of uid: username for multiple uids, unknown uids are not returned"""
+    usernames = {}
+    for uid in set(uids):
+        try:
+            usernames[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            pass
+    return usernames
@@ -3,7 +3,8 @@ from jobstats.models import JobScript
 
 
 class JobScriptAdmin(admin.ModelAdmin):
-    pass
+    list_display = ['id_job', 'last_modified', 'content']
+    readonly_fields = ['content', 'submit_script']
 
 
 admin.site.register(JobScript, JobScriptAdmin)
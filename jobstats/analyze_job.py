@@ -1,5 +1,5 @@
 import re
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext_lazy
 
 
 class Comment(object):
@@ -14,6 +14,20 @@ class Comment(object):
     def __repr__(self):
         return self.comment
 
+    def to_dict(self):
+        # for the comments stored in JobSummary
+        return {
+            'comment': self.comment,
+            'severity': self.severity,
+            'url': self.url,
+            'line_number': self.line_number,
+            'graph_ids': list(self.graph_ids),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['comment'], data['severity'], data['url'], data['line_number'], data['graph_ids'])
+
     def display_severity(self):
         # For display with Bootstrap alert classes
         if self.severity == 'info':
@@ -48,142 +62,223 @@ class Module(object):
         return hash((self.name, self.version))
 
 
-def find_loaded_modules(jobscript):
-    try:
+SCRIPT = 'script'
+SUBMIT_LINE = 'submit_line'
+
+RE_MODULE_LOAD = r'^\s*module load\s+(.*)$'
+
+
+class Rule(object):
+    """
+    A rule of the job analysis, searched in each line of the job script or in the submit line
+
+    The rule applies only when one of its modules is loaded by the script and when(job) is true.
+    check(match, job) can return None to ignore a match, or a tuple of values to format the comment.
+    literals are strings of which one is in any line matched by the pattern, the regex is only
+    searched in these lines. Without literals, the regex is searched in every line.
+    """
+    def __init__(self, name, pattern, comment, severity='info', url=None, target=SCRIPT, modules=None, when=None, check=None, literals=None):
+        self.name = name
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.comment = comment
+        self.severity = severity
+        self.url = url
+        self.target = target
+        self.modules = modules
+        self.when = when
+        self.check = check
+        self.literals = literals
+
+    def __repr__(self):
+        return self.name
+
+    def may_match(self, text):
+        return self.literals is None or any(literal in text for literal in self.literals)
+
+    def applies(self, job, module_names):
+        if self.modules is not None and not any(module in module_names for module in self.modules):
+            return False
+        return self.when is None or self.when(job)
+
+    def make_comment(self, match, job, line_number=0):
+        values = () if self.check is None else self.check(match, job)
+        if values is None:
+            return None
+        return Comment(str(self.comment).format(*values), self.severity, self.url, line_number=line_number)
+
+
+class RuleSet(object):
+    """
+    Rules searched in a text with a prefilter on their literals
+
+    The rules whose literals are not in the text are dropped before reading the lines, the others
+    are searched only in the lines containing one of their literals. Most lines of a script contain
+    no literal at all and are skipped with a substring test per rule, without running any regex.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+    def register(self, rule):
+        self.rules.append(rule)
+
+    def scan(self, text, target):
+        """return the loaded modules and the (line number, line, rule) found in a text"""
+        rules = [rule for rule in self.rules if rule.target == target and rule.may_match(text)]
+        modules_str = []
+        hits = []
+        for line_number, line in enumerate(text.split('\n'), start=1):
+            if target == SCRIPT and 'module load' in line:
+                match = re.match(RE_MODULE_LOAD, line)
+                if match:
+                    for module_str in match.group(1).split():
+                        if module_str not in modules_str:
+                            # only add unique modules, in order they are loaded
+                            modules_str.append(module_str)
+            for rule in rules:
+                if rule.may_match(line) and rule.regex.search(line):
+                    hits.append((line_number, line, rule))
+        return modules_str, hits
+
+    def comments(self, hits, job, modules, with_line_number=True):
+        module_names = set(module.name for module in modules)
+        applies = {}
+        comments = []
+        for line_number, line, rule in hits:
+            if rule not in applies:
+                applies[rule] = rule.applies(job, module_names)
+            if applies[rule]:
+                comment = rule.make_comment(rule.regex.search(line), job, line_number if with_line_number else 0)
+                if comment is not None:
+                    comments.append(comment)
+        return comments
+
+    def analyze(self, jobscript, job):
+        """return the comments and the loaded modules of a job script, raise ValueError if a module can't be parsed"""
+        modules_str, hits = self.scan(jobscript, SCRIPT)
+        try:
+            modules = [Module(module_str) for module_str in modules_str]
+        except ValueError:
+            raise ValueError('Could not parse jobscript to find loaded modules')
+        return self.comments(hits, job, modules), modules
+
+    def analyze_submit_line(self, job):
+        _modules_str, hits = self.scan(job.submit_line or '', SUBMIT_LINE)
+        return self.comments(hits, job, [], with_line_number=False)
+
+    def analyze_per_rule(self, jobscript, job):
+        """Same result as analyze() with one search per rule and per line, used to check and benchmark the prefilter"""
         modules_str = []
         for line in jobscript.split('\n'):
-            match = re.search(r'^\s*module load\s+(.*)$', line)
+            match = re.search(RE_MODULE_LOAD, line)
             if match:
                 for module_str in match.group(1).split():
                     if module_str not in modules_str:
-                        # only add unique modules, in order they are loaded
                         modules_str.append(module_str)
-        modules = []
-        for module_str in modules_str:
-            modules.append(Module(module_str))
-        return modules
-    except: # noqa
-        raise ValueError('Could not parse jobscript to find loaded modules')
+        modules = [Module(module_str) for module_str in modules_str]
+        hits = []
+        for line_number, line in enumerate(jobscript.split('\n'), start=1):
+            for rule in self.rules:
+                if rule.target == SCRIPT and rule.regex.search(line):
+                    hits.append((line_number, line, rule))
+        return self.comments(hits, job, modules), modules
 
 
-def analyze_with_module_gromacs(jobscript, modules, job):
-    comments = []
-    tres = job.parse_tres_req()
-    line_number = 0
-    nodes_count = len(job.nodes())
-    for line in jobscript.split('\n'):
-        line_number += 1
-        if tres['total_cores'] > 1:
-            # handle binary names for both 4.x and 5.x
-            match = re.search(r'^(.*)(gmx|gmx_mpi|gmx_d|gmx_d_mpi|mdrun_mpi|mdrun_mpi_d)\s+mdrun\s+(.*)$', line)
-            if match:
-                if 'srun' in match.group(1) or 'mpirun' in match.group(1) or 'mpiexec' in match.group(1):
-                    # srun, mpirun, or mpiexec is used
-                    pass
-                else:
-                    comments.append(Comment(
-                        _('GROMACS is used without srun or mpirun/mpiexec'),
-                        'warning',
-                        'https://docs.alliancecan.ca/wiki/GROMACS#Whole_nodes',
-                        line_number=line_number))
-                nt_match = re.search(r'-nt\s+(\d+)', match.group(3))
-                if nt_match:
-                    if int(nt_match.group(1)) != tres['total_cores']:
-                        comments.append(Comment(
-                            _('GROMACS is used with -nt {} instead of -nt {}').format(nt_match.group(1), tres['total_cores']),
-                            'critical',
-                            'https://manual.gromacs.org/documentation/5.1/onlinehelp/gmx-mdrun.html#options',
-                            line_number=line_number))
-        if nodes_count > 1:
-            match = re.search(r'^(.*)(gmx|gmx_d)\s+mdrun\s+(.*)$', line)
-            if match:
-                comments.append(Comment(
-                    _('Multiple nodes are used without the MPI binary'),
-                    'critical',
-                    'https://docs.alliancecan.ca/wiki/GROMACS',
-                    line_number=line_number))
-        match_grompp = re.search(r'^(.*)(gmx|gmx_mpi|gmx_d|gmx_d_mpi|mdrun_mpi|mdrun_mpi_d)\s+grompp\s+(.*)$', line)
-        if match_grompp:
-            comments.append(Comment(
-                _('GROMACS preprocessor should be used on a login node'),
-                'warning',
-                line_number=line_number))
-    return comments
-
-
-def analyze_with_module_amber(jobscript, modules, job):
-    comments = []
-    line_number = 0
-    gpu_count = job.gpu_count()
-    nodes_count = len(job.nodes())
-    for line in jobscript.split('\n'):
-        line_number += 1
-        if gpu_count > 0:
-            if 'pmemd.MPI' in line:
-                comments.append(Comment(
-                    _('CPU version of Amber is used on a GPU node'),
-                    'critical',
-                    'https://docs.alliancecan.ca/wiki/AMBER#Single_GPU_job',
-                    line_number=line_number))
-        else:
-            if 'pmemd.cuda' in line:
-                comments.append(Comment(
-                    _('GPU version of Amber is used on a CPU node'),
-                    'critical',
-                    'https://docs.alliancecan.ca/wiki/AMBER#Single_CPU_job',
-                    line_number=line_number))
-        if nodes_count > 1:
-            if 'pmemd' in line and 'srun' not in line:
-                comments.append(Comment(
-                    _('Multiple nodes are used in this job but AMBER is not started with srun'),
-                    'critical',
-                    'https://docs.alliancecan.ca/wiki/AMBER',
-                    line_number=line_number))
-
-    return comments
-
-
-def analyze_with_module_lammps(jobscript, modules, job):
-    comments = []
-    line_number = 0
-    tres = job.parse_tres_req()
-    for line in jobscript.split('\n'):
-        line_number += 1
-        if tres['total_cores'] > 1:
-            if 'lmp' in line and 'srun' not in line:
-                comments.append(Comment(
-                    _('LAMMPS is used without srun'),
-                    'critical',
-                    'https://docs.alliancecan.ca/wiki/LAMMPS#Example_of_input_file',
-                    line_number=line_number))
-    return comments
-
-
-def analyze_bash(jobscript):
-    comments = []
-    line_number = 0
-    for line in jobscript.split('\n'):
-        line_number += 1
-        if 'sleep' in line:
-            comments.append(Comment(
-                _('sleep command is used'), 'critical', None, line_number=line_number))
-        if 'conda activate' in line:
-            comments.append(Comment(
-                _('conda environment is used'),
-                'critical',
-                'https://docs.alliancecan.ca/wiki/Anaconda',
-                line_number=line_number))
-    return comments
+def cores(job):
+    return job.parse_tres_req()['total_cores']
+
+
+def gromacs_without_mpi(match, job):
+    # srun, mpirun, or mpiexec is used
+    if 'srun' in match.group(1) or 'mpirun' in match.group(1) or 'mpiexec' in match.group(1):
+        return None
+    return ()
+
+
+def gromacs_nt(match, job):
+    nt_match = re.search(r'-nt\s+(\d+)', match.group(3))
+    if nt_match is None or int(nt_match.group(1)) == cores(job):
+        return None
+    return (nt_match.group(1), cores(job))
+
+
+# handle binary names for both 4.x and 5.x
+RE_GROMACS_BINARY = r'(gmx|gmx_mpi|gmx_d|gmx_d_mpi|mdrun_mpi|mdrun_mpi_d)'
+
+RULES = RuleSet([
+    # bash
+    Rule('sleep', r'sleep', gettext_lazy('sleep command is used'), 'critical', literals=['sleep']),
+    Rule('conda', r'conda activate', gettext_lazy('conda environment is used'), 'critical',
+         'https://docs.alliancecan.ca/wiki/Anaconda', literals=['conda activate']),
+
+    # GROMACS
+    Rule('gromacs_without_mpi', r'^(.*)' + RE_GROMACS_BINARY + r'\s+mdrun\s+(.*)$',
+         gettext_lazy('GROMACS is used without srun or mpirun/mpiexec'), 'warning',
+         'https://docs.alliancecan.ca/wiki/GROMACS#Whole_nodes',
+         modules=['gromacs'], when=lambda job: cores(job) > 1, check=gromacs_without_mpi, literals=['mdrun']),
+    Rule('gromacs_nt', r'^(.*)' + RE_GROMACS_BINARY + r'\s+mdrun\s+(.*)$',
+         gettext_lazy('GROMACS is used with -nt {} instead of -nt {}'), 'critical',
+         'https://manual.gromacs.org/documentation/5.1/onlinehelp/gmx-mdrun.html#options',
+         modules=['gromacs'], when=lambda job: cores(job) > 1, check=gromacs_nt, literals=['mdrun']),
+    Rule('gromacs_multinode', r'^(.*)(gmx|gmx_d)\s+mdrun\s+(.*)$',
+         gettext_lazy('Multiple nodes are used without the MPI binary'), 'critical',
+         'https://docs.alliancecan.ca/wiki/GROMACS',
+         modules=['gromacs'], when=lambda job: len(job.nodes()) > 1, literals=['mdrun']),
+    Rule('gromacs_grompp', r'^(.*)' + RE_GROMACS_BINARY + r'\s+grompp\s+(.*)$',
+         gettext_lazy('GROMACS preprocessor should be used on a login node'), 'warning',
+         modules=['gromacs'], literals=['grompp']),
+
+    # Amber
+    Rule('amber_cpu_on_gpu', r'pmemd\.MPI',
+         gettext_lazy('CPU version of Amber is used on a GPU node'), 'critical',
+         'https://docs.alliancecan.ca/wiki/AMBER#Single_GPU_job',
+         modules=['amber'], when=lambda job: job.gpu_count() > 0, literals=['pmemd.MPI']),
+    Rule('amber_gpu_on_cpu', r'pmemd\.cuda',
+         gettext_lazy('GPU version of Amber is used on a CPU node'), 'critical',
+         'https://docs.alliancecan.ca/wiki/AMBER#Single_CPU_job',
+         modules=['amber'], when=lambda job: job.gpu_count() == 0, literals=['pmemd.cuda']),
+    Rule('amber_without_srun', r'^(?!.*srun).*pmemd',
+         gettext_lazy('Multiple nodes are used in this job but AMBER is not started with srun'), 'critical',
+         'https://docs.alliancecan.ca/wiki/AMBER',
+         modules=['amber'], when=lambda job: len(job.nodes()) > 1, literals=['pmemd']),
+
+    # LAMMPS
+    Rule('lammps_without_srun', r'^(?!.*srun).*lmp',
+         gettext_lazy('LAMMPS is used without srun'), 'critical',
+         'https://docs.alliancecan.ca/wiki/LAMMPS#Example_of_input_file',
+         modules=['lammps-omp'], when=lambda job: cores(job) > 1, literals=['lmp']),
+
+    # options of the submit line
+    Rule('singleton', r'--depend(ency)?=singleton|-d singleton', gettext_lazy('This job is using a singleton dependency'), target=SUBMIT_LINE),
+    Rule('exclusive', r'--exclusive', gettext_lazy('This job is using exclusive mode'), target=SUBMIT_LINE),
+    Rule('licenses', r'--licenses=|-L ', gettext_lazy('This job is using licenses'), target=SUBMIT_LINE),
+    Rule('nodelist', r'--nodelist=|-w ', gettext_lazy('This job is using a specific nodelist'), target=SUBMIT_LINE),
+    Rule('exclude', r'--exclude=|-x ', gettext_lazy('This job is excluding nodes'), 'warning', target=SUBMIT_LINE),
+    Rule('requeue', r'--requeue', gettext_lazy('This job can be requeued'), target=SUBMIT_LINE),
+    Rule('no_requeue', r'--no-requeue', gettext_lazy('This job cannot be requeued'), target=SUBMIT_LINE),
+    Rule('reservation', r'--reservation=', gettext_lazy('This job is using a reservation'), target=SUBMIT_LINE),
+    Rule('switches', r'--switches=', gettext_lazy('This job is using a maximum quantity of switches'), target=SUBMIT_LINE),
+])
+
+
+def analyze_job(jobscript, job):
+    """return the comments on a job script and the modules it loads"""
+    return RULES.analyze(jobscript, job)
+
+
+def analyze_submit_line(job):
+    """return the comments on the options of the submit line of a job"""
+    return RULES.analyze_submit_line(job)
+
+
+def find_loaded_modules(jobscript):
+    modules_str, _hits = RULES.scan(jobscript, SCRIPT)
+    try:
+        return [Module(module_str) for module_str in modules_str]
+    except ValueError:
+        raise ValueError('Could not parse jobscript to find loaded modules')
 
 
 def analyze_jobscript(jobscript, modules, job):
-    comments = []
-    comments += analyze_bash(jobscript)
-    for module in modules:
-        if module.name == 'gromacs':
-            comments += analyze_with_module_gromacs(jobscript, modules, job)
-        if module.name == 'amber':
-            comments += analyze_with_module_amber(jobscript, modules, job)
-        if module.name == 'lammps-omp':
-            comments += analyze_with_module_lammps(jobscript, modules, job)
-    return comments
+    _modules_str, hits = RULES.scan(jobscript, SCRIPT)
+    return RULES.comments(hits, job, modules)
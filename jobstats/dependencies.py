@@ -0,0 +1,152 @@
+"""
+Index of the dependencies between jobs
+
+Slurm only keeps the dependencies in the submit line of the dependent job, finding the jobs depending
+on a job requires a scan of the whole history of the user. The edges are parsed once in JobDependency
+by sync_dependencies(), called periodically by the sync_dependencies command. The job page reads the
+index and falls back to the scan of JobTable when the index is not built.
+"""
+import re
+from django.db import transaction
+from django.db.models import Q
+from slurm.models import JobTable, RE_DEPS
+from jobstats.models import JobDependency, JobDependencySync
+
+# maximum number of jobs in the dependency graph of a job
+DAG_MAX_JOBS = 200
+
+
+def parse_submit_line(submit_line):
+    """return the (type, job id) dependencies in a submit line"""
+    deps = []
+    for match in re.findall(RE_DEPS, submit_line or ''):
+        for job_id in match[2].split(':'):
+            if job_id:
+                deps.append((match[1], int(job_id)))
+    return deps
+
+
+def dependent_jobs(first, last, batch_size):
+    """return the jobs after first and up to last with a dependency in their submit line, in batches"""
+    while True:
+        jobs = list(JobTable.objects
+                    .filter(job_db_inx__gt=first, job_db_inx__lte=last)
+                    .filter(Q(submit_line__contains='--depend') | Q(submit_line__contains='-d '))
+                    .order_by('job_db_inx')
+                    .values_list('job_db_inx', 'id_job', 'id_user', 'submit_line')[:batch_size])
+        if len(jobs) == 0:
+            return
+        yield jobs
+        first = jobs[-1][0]
+
+
+def job_edges(jobs):
+    edges = []
+    for job_db_inx, id_job, id_user, submit_line in jobs:
+        for dep_type, parent in parse_submit_line(submit_line):
+            edges.append(JobDependency(id_user=id_user, parent_job=parent, child_job=id_job, type=dep_type))
+    return edges
+
+
+def sync_dependencies(batch_size=10000):
+    """
+    Add the dependencies of the jobs submitted since the last sync, scanning only the jobs with a dependency
+
+    return the number of edges created, or None if the index was never built with the sync_dependencies command
+    """
+    state = JobDependencySync.objects.first()
+    if state is None:
+        return None
+
+    # the jobs submitted during the sync will be added by the next one
+    latest = JobTable.objects.order_by('-job_db_inx').values_list('job_db_inx', flat=True).first() or 0
+    created = 0
+    for jobs in dependent_jobs(state.last_job_db_inx, latest, batch_size):
+        edges = job_edges(jobs)
+        with transaction.atomic():
+            JobDependency.objects.bulk_create(edges, ignore_conflicts=True)
+            state.last_job_db_inx = jobs[-1][0]
+            state.save()
+        created += len(edges)
+
+    state.last_job_db_inx = max(state.last_job_db_inx, latest)
+    state.save()
+    return created
+
+
+def rebuild_dependencies(batch_size=10000):
+    """Rebuild the whole index, scanning only the jobs with a dependency in their submit line"""
+    JobDependency.objects.all().delete()
+    JobDependencySync.objects.all().delete()
+    state = JobDependencySync.objects.create(last_job_db_inx=0)
+
+    # the jobs submitted during the rebuild will be added by the next sync
+    latest = JobTable.objects.order_by('-job_db_inx').values_list('job_db_inx', flat=True).first() or 0
+    for jobs in dependent_jobs(0, latest, batch_size):
+        JobDependency.objects.bulk_create(job_edges(jobs), ignore_conflicts=True)
+
+    state.last_job_db_inx = latest
+    state.save()
+
+
+def index_built():
+    return JobDependencySync.objects.exists()
+
+
+def dependencies_of(job):
+    """return the jobs this job depends on as a list of {'type', 'job'}, None if the job is not indexed yet"""
+    state = JobDependencySync.objects.first()
+    if state is None or job.job_db_inx > state.last_job_db_inx:
+        return None
+    edges = JobDependency.objects.filter(child_job=job.id_job, id_user=job.id_user)
+    types = {}
+    for edge in edges:
+        types.setdefault(edge.parent_job, []).append(edge.type)
+    jobs = JobTable.objects.filter(id_user=job.id_user, id_job__in=list(types))
+    return [{'type': dep_type, 'job': parent} for parent in jobs for dep_type in types[parent.id_job]]
+
+
+def depends_on(job):
+    """return the jobs depending on this job as a list of {'type', 'job'}, None if the index is not built"""
+    if not JobDependencySync.objects.exists():
+        return None
+    edges = JobDependency.objects.filter(parent_job=job.id_job, id_user=job.id_user)
+    types = {}
+    for edge in edges:
+        types.setdefault(edge.child_job, []).append(edge.type)
+    jobs = JobTable.objects.filter(id_user=job.id_user, id_job__in=list(types))
+    return [{'type': dep_type, 'job': child} for child in jobs for dep_type in types[child.id_job]]
+
+
+def job_dependencies(job):
+    """return (dependencies of the job, jobs depending on it), from the index or from the scan of JobTable"""
+    dependencies = dependencies_of(job)
+    if dependencies is None:
+        dependencies = job.dependencies()
+    dependents = depends_on(job)
+    if dependents is None:
+        dependents = job.depends_on_this()
+    return dependencies, dependents
+
+
+def dependency_dag(job):
+    """
+    return all the edges connected to a job, upstream and downstream, as (parent, child, type) tuples
+
+    The graph is explored one level at a time with one query per level, up to DAG_MAX_JOBS jobs
+    """
+    seen = {job.id_job}
+    frontier = {job.id_job}
+    edges = set()
+    while frontier and len(seen) < DAG_MAX_JOBS:
+        level = JobDependency.objects.filter(id_user=job.id_user)\
+            .filter(Q(parent_job__in=frontier) | Q(child_job__in=frontier))\
+            .values_list('parent_job', 'child_job', 'type')
+        frontier = set()
+        for parent, child, dep_type in level:
+            edges.add((parent, child, dep_type))
+            for job_id in (parent, child):
+                if job_id not in seen:
+                    seen.add(job_id)
+                    frontier.add(job_id)
+    return sorted(edges)
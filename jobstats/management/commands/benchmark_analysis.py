@@ -0,0 +1,48 @@
+import timeit
+from django.core.management.base import BaseCommand
+from slurm.models import JobTable
+from jobstats.models import JobScript
+from jobstats.analyze_job import RULES
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the analysis of the job scripts stored in the database, with the literal prefilter and with one search per rule'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='Number of the most recent job scripts')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        scripts = {jobscript.id_job: jobscript.submit_script for jobscript in JobScript.objects.select_related('content').order_by('-id_job')[:options['count']]}
+        jobs = {job.id_job: job for job in JobTable.objects.filter(id_job__in=list(scripts))}
+        corpus = [(scripts[id_job], job) for id_job, job in jobs.items()]
+        self.stdout.write('{} job scripts, {} lines, {} rules'.format(
+            len(corpus),
+            sum(script.count('\n') + 1 for script, job in corpus),
+            len(RULES.rules)))
+
+        def analyze(func):
+            results = []
+            for script, job in corpus:
+                try:
+                    comments, modules = func(script, job)
+                    results.append([(comment.line_number, comment.comment) for comment in comments])
+                except ValueError:
+                    results.append(None)
+            return results
+
+        if analyze(RULES.analyze) != analyze(RULES.analyze_per_rule):
+            self.stderr.write('The outputs are different')
+            return
+
+        timings = [
+            ('one search per rule and per line', lambda: analyze(RULES.analyze_per_rule)),
+            ('literal prefilter', lambda: analyze(RULES.analyze)),
+        ]
+        baseline = None
+        for name, func in timings:
+            duration = min(timeit.repeat(func, number=1, repeat=options['repeat']))
+            if baseline is None:
+                baseline = duration
+            self.stdout.write('{:<40} {:8.2f} ms  {:6.1f} us/script  x{:.1f}'.format(
+                name, duration * 1000, duration * 1e6 / max(len(corpus), 1), baseline / duration))
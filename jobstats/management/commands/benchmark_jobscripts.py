@@ -0,0 +1,52 @@
+import json
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+from jobstats.views import JobScriptViewSet
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the upload of synthetic job scripts through the API, one per request and with the bulk endpoint. Nothing is kept in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Number of scripts sent to the bulk endpoint')
+        parser.add_argument('--sample', type=int, default=200, help='Number of scripts sent one per request')
+        parser.add_argument('--distinct', type=int, default=100, help='Number of different scripts, like the tasks of job arrays')
+        parser.add_argument('--first-id', type=int, default=4000000000, help='First job id, the ids must not exist')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        admin = User(username='benchmark', is_staff=True)
+        create = JobScriptViewSet.as_view({'post': 'create'})
+        bulk = JobScriptViewSet.as_view({'post': 'bulk'})
+
+        def script(i):
+            return '#!/bin/bash\n#SBATCH --array=1-1000\n# script {}\n'.format(i % options['distinct']) + 'srun ./task $SLURM_ARRAY_TASK_ID\n' * 50
+
+        def post(view, data):
+            request = factory.post('/api/jobscripts/', json.dumps(data), content_type='application/json')
+            force_authenticate(request, user=admin)
+            return view(request)
+
+        with transaction.atomic():
+            first = options['first_id']
+            start = time.monotonic()
+            for i in range(options['sample']):
+                post(create, {'id_job': first + i, 'submit_script': script(i)})
+            single = (time.monotonic() - start) / max(options['sample'], 1)
+
+            first += options['sample']
+            scripts = [{'id_job': first + i, 'submit_script': script(i)} for i in range(options['count'])]
+            start = time.monotonic()
+            response = post(bulk, scripts)
+            duration = time.monotonic() - start
+
+            # nothing is kept
+            transaction.set_rollback(True)
+
+        self.stdout.write('one per request: {:8.2f} ms per script, {:8.1f} s for {} scripts (estimated)'.format(
+            single * 1000, single * options['count'], options['count']))
+        self.stdout.write('bulk endpoint:   {:8.2f} ms per script, {:8.1f} s for {} scripts, {}'.format(
+            duration * 1000 / max(options['count'], 1), duration, options['count'], response.data['counts']))
@@ -0,0 +1,54 @@
+import json
+import timeit
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from userportal.common import json_dumps, plotly_timestamps
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the serialization of a synthetic graph, like a CPU graph of a job with many cores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=64)
+        parser.add_argument('--points', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        epochs = 1700000000 + np.arange(options['points'], dtype=np.int64) * 60
+        x = plotly_timestamps(epochs)
+        values = [rng.random(options['points']) for _ in range(options['series'])]
+
+        def payload(columnar):
+            data = []
+            for i, y in enumerate(values):
+                data.append({
+                    'x': x,
+                    'y': y if columnar else y.tolist(),
+                    'type': 'scatter',
+                    'stackgroup': 'one',
+                    'name': 'Core {}'.format(i),
+                    'hovertemplate': '%{y:.1f}',
+                })
+            return {'data': data, 'layout': {'yaxis': {'title': 'Cores'}}}
+
+        lists = payload(False)
+        arrays = payload(True)
+
+        # same content as the JsonResponse used before
+        if json.loads(json_dumps(arrays)) != json.loads(json.dumps(lists, cls=DjangoJSONEncoder)):
+            self.stderr.write('The outputs are different')
+            return
+
+        timings = [
+            ('JsonResponse (stdlib json, lists)', lambda: json.dumps(lists, cls=DjangoJSONEncoder).encode()),
+            ('json_dumps (lists)', lambda: json_dumps(lists)),
+            ('json_dumps (numpy arrays)', lambda: json_dumps(arrays)),
+        ]
+        baseline = None
+        for name, func in timings:
+            duration = min(timeit.repeat(func, number=1, repeat=options['repeat']))
+            if baseline is None:
+                baseline = duration
+            self.stdout.write('{:<40} {:8.2f} ms  x{:.1f}'.format(name, duration * 1000, baseline / duration))
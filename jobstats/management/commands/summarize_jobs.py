@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from jobstats.summary import summarize_completed_jobs, SUMMARY_DELAY
+
+
+class Command(BaseCommand):
+    help = 'Store the stats and the analysis of the completed jobs, read by the job page instead of querying Prometheus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=int, default=24, help='Summarize the jobs ended in the last hours')
+        parser.add_argument('--delay', type=int, default=SUMMARY_DELAY, help='Seconds to wait after the end of a job')
+        parser.add_argument('--loop', type=int, default=0, help='Run every this number of seconds instead of once')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                count = summarize_completed_jobs(time.time() - options['since'] * 3600, delay=options['delay'])
+                self.stdout.write('{} jobs summarized'.format(count))
+            except Exception as e:
+                if not options['loop']:
+                    raise
+                # Prometheus or a database might be temporarily unavailable, retry on the next run
+                self.stderr.write('Error while summarizing jobs: {}'.format(e))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from jobstats.dependencies import sync_dependencies, rebuild_dependencies
+
+
+class Command(BaseCommand):
+    help = 'Index the dependencies between jobs from the submit line of the jobs in the Slurm database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the whole index, needed the first time')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild_dependencies(batch_size=options['batch_size'])
+            self.stdout.write('Index rebuilt')
+            return
+
+        created = sync_dependencies(batch_size=options['batch_size'])
+        if created is None:
+            self.stderr.write('The index was never built, run with --rebuild first')
+        else:
+            self.stdout.write('{} dependencies added'.format(created))
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from jobstats.mirror import sync_job_mirror, rebuild_job_mirror, MIRROR_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Copy the active and recent jobs of the Slurm database in an indexed table of the portal, by modification time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the whole mirror, needed the first time')
+        parser.add_argument('--days', type=int, default=MIRROR_DAYS, help='Keep the jobs finished in the last days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', type=int, default=0, help='Run every this number of seconds instead of once')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild_job_mirror(batch_size=options['batch_size'], days=options['days'])
+            self.stdout.write('Mirror rebuilt')
+
+        while True:
+            try:
+                synced = sync_job_mirror(batch_size=options['batch_size'], days=options['days'])
+                if synced is None:
+                    self.stderr.write('The mirror was never built, run with --rebuild first')
+                    return
+                self.stdout.write('{} jobs synced'.format(synced))
+            except Exception as e:
+                if not options['loop']:
+                    raise
+                # a database might be temporarily unavailable, retry on the next run
+                self.stderr.write('Error while syncing the jobs: {}'.format(e))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobstats', '0002_utf8'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobDependency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_user', models.PositiveIntegerField()),
+                ('parent_job', models.PositiveIntegerField(db_index=True)),
+                ('child_job', models.PositiveIntegerField(db_index=True)),
+                ('type', models.CharField(max_length=32)),
+            ],
+            options={
+                'unique_together': {('parent_job', 'child_job', 'type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='JobDependencySync',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_job_db_inx', models.PositiveBigIntegerField(default=0)),
+                ('last_sync', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
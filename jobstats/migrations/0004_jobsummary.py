@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobstats', '0003_jobdependency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSummary',
+            fields=[
+                ('id_job', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('time_end', models.PositiveBigIntegerField()),
+                ('stats', models.JSONField()),
+                ('comments', models.JSONField()),
+                ('loaded_modules', models.JSONField(null=True)),
+                ('language', models.CharField(max_length=16)),
+                ('created', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
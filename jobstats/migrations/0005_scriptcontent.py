@@ -0,0 +1,75 @@
+import hashlib
+import zlib
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def scripts_to_contents(apps, schema_editor):
+    # the scripts are converted in batches, so the whole table is never loaded in memory
+    JobScript = apps.get_model('jobstats', 'JobScript')
+    ScriptContent = apps.get_model('jobstats', 'ScriptContent')
+    last = -1
+    while True:
+        batch = list(JobScript.objects.filter(id_job__gt=last).order_by('id_job').only('id_job', 'submit_script')[:BATCH_SIZE])
+        if len(batch) == 0:
+            break
+        contents = {}
+        for jobscript in batch:
+            sha256 = hashlib.sha256(jobscript.submit_script.encode()).hexdigest()
+            if sha256 not in contents:
+                contents[sha256] = ScriptContent(
+                    sha256=sha256,
+                    compressed=zlib.compress(jobscript.submit_script.encode(), 6),
+                    size=len(jobscript.submit_script))
+            jobscript.content_id = sha256
+        ScriptContent.objects.bulk_create(contents.values(), ignore_conflicts=True)
+        JobScript.objects.bulk_update(batch, ['content'])
+        last = batch[-1].id_job
+
+
+def contents_to_scripts(apps, schema_editor):
+    JobScript = apps.get_model('jobstats', 'JobScript')
+    last = -1
+    while True:
+        batch = list(JobScript.objects.filter(id_job__gt=last).order_by('id_job').select_related('content')[:BATCH_SIZE])
+        if len(batch) == 0:
+            break
+        for jobscript in batch:
+            jobscript.submit_script = zlib.decompress(bytes(jobscript.content.compressed)).decode()
+        JobScript.objects.bulk_update(batch, ['submit_script'])
+        last = batch[-1].id_job
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobstats', '0004_jobsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptContent',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('compressed', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='jobscript',
+            name='content',
+            field=models.ForeignKey(db_column='content_sha256', null=True, on_delete=django.db.models.deletion.PROTECT, to='jobstats.scriptcontent'),
+        ),
+        migrations.RunPython(scripts_to_contents, contents_to_scripts),
+        migrations.RemoveField(
+            model_name='jobscript',
+            name='submit_script',
+        ),
+        migrations.AlterField(
+            model_name='jobscript',
+            name='content',
+            field=models.ForeignKey(db_column='content_sha256', on_delete=django.db.models.deletion.PROTECT, to='jobstats.scriptcontent'),
+        ),
+    ]
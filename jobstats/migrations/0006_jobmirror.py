@@ -0,0 +1,53 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobstats', '0005_scriptcontent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobMirror',
+            fields=[
+                ('job_db_inx', models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                ('mod_time', models.PositiveBigIntegerField()),
+                ('id_job', models.PositiveIntegerField(db_index=True)),
+                ('id_user', models.PositiveIntegerField(db_index=True)),
+                ('account', models.CharField(db_index=True, max_length=255, null=True)),
+                ('partition', models.CharField(db_index=True, max_length=255)),
+                ('state', models.PositiveIntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Suspended'), (3, 'Complete'), (4, 'Canceled'), (5, 'Failed'), (6, 'Timeout'), (7, 'Node Fail'), (8, 'Preempted'), (9, 'Boot Fail'), (10, 'End'), (11, 'Oom')], db_index=True)),
+                ('nodelist', models.TextField(null=True)),
+                ('nodes_alloc', models.PositiveIntegerField()),
+                ('cpus_req', models.PositiveIntegerField()),
+                ('mem_req', models.PositiveBigIntegerField()),
+                ('tres_req', models.TextField()),
+                ('tres_alloc', models.TextField()),
+                ('time_submit', models.PositiveBigIntegerField()),
+                ('time_start', models.PositiveBigIntegerField(db_index=True)),
+                ('time_end', models.PositiveBigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobMirrorSync',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_mod_time', models.PositiveBigIntegerField(default=0)),
+                ('last_job_db_inx', models.PositiveBigIntegerField(default=0)),
+                ('last_sync', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobMirrorNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.CharField(db_index=True, max_length=255)),
+                ('job', models.ForeignKey(db_column='job_db_inx', on_delete=django.db.models.deletion.CASCADE, related_name='node_set', to='jobstats.jobmirror')),
+            ],
+            options={
+                'unique_together': {('job', 'node')},
+            },
+        ),
+    ]
@@ -0,0 +1,122 @@
+"""
+Mirror of the active and recent jobs
+
+The job table of Slurm is large and only indexed for sacct, finding the running jobs of a partition
+or of a node is a scan of the whole table. JobMirror keeps the pending, running and recently finished
+jobs in the database of the portal, indexed by partition, account, user, state and node. It is updated
+by sync_job_mirror() with the jobs modified since the last sync, called by the sync_job_mirror command.
+"""
+import time
+from django.db import connections, transaction
+from django.db.models import Q
+from slurm.models import JobTable, expand_nodelist
+from jobstats.models import JobMirror, JobMirrorNode, JobMirrorSync
+
+# the finished jobs are kept this number of days
+MIRROR_DAYS = 7
+# the mirror is not used when the last sync is older than this number of seconds
+MIRROR_MAX_AGE = 600
+
+ACTIVE_STATES = [JobTable.StatesJob.PENDING, JobTable.StatesJob.RUNNING, JobTable.StatesJob.SUSPENDED]
+
+# columns copied from the job table of Slurm, with deleted that is not kept
+MIRROR_FIELDS = [
+    'job_db_inx', 'mod_time', 'id_job', 'id_user', 'account', 'partition', 'state', 'nodelist', 'nodes_alloc',
+    'cpus_req', 'mem_req', 'tres_req', 'tres_alloc', 'time_submit', 'time_start', 'time_end',
+]
+
+
+def job_nodes(nodelist):
+    if not nodelist or nodelist == 'None assigned':
+        return []
+    return expand_nodelist(nodelist, as_list=True)
+
+
+def mirror_jobs(rows, since):
+    """copy a batch of (MIRROR_FIELDS + deleted) rows, the deleted jobs and the jobs finished before since are removed"""
+    jobs = []
+    removed = []
+    for row in rows:
+        fields = dict(zip(MIRROR_FIELDS, row[:-1]))
+        if row[-1] or (fields['time_end'] != 0 and fields['time_end'] < since):
+            removed.append(fields['job_db_inx'])
+        else:
+            jobs.append(JobMirror(**fields))
+
+    with transaction.atomic():
+        JobMirror.objects.filter(job_db_inx__in=removed).delete()
+        # MySQL upserts on any unique key and does not take the fields of the conflict
+        features = connections[JobMirror.objects.db].features
+        JobMirror.objects.bulk_create(
+            jobs,
+            update_conflicts=True,
+            unique_fields=['job_db_inx'] if features.supports_update_conflicts_with_target else None,
+            update_fields=MIRROR_FIELDS[1:])
+        # the nodes are known once a job starts, they are replaced with the job
+        JobMirrorNode.objects.filter(job_id__in=[job.job_db_inx for job in jobs]).delete()
+        JobMirrorNode.objects.bulk_create([
+            JobMirrorNode(job_id=job.job_db_inx, node=node) for job in jobs for node in job_nodes(job.nodelist)
+        ], ignore_conflicts=True)
+
+
+def sync_job_mirror(batch_size=5000, days=MIRROR_DAYS):
+    """
+    Copy the jobs modified since the last sync and remove the old finished jobs
+
+    return the number of jobs copied, or None if the mirror was never built with the sync_job_mirror command
+    """
+    state = JobMirrorSync.objects.first()
+    if state is None:
+        return None
+
+    since = time.time() - days * 24 * 3600
+    synced = 0
+    while True:
+        # (mod_time, job_db_inx) is unique, the jobs modified in the same second are not skipped or read twice
+        rows = list(JobTable.objects
+                    .filter(Q(mod_time__gt=state.last_mod_time) | Q(mod_time=state.last_mod_time, job_db_inx__gt=state.last_job_db_inx))
+                    .order_by('mod_time', 'job_db_inx')
+                    .values_list(*MIRROR_FIELDS, 'deleted')[:batch_size])
+        if len(rows) == 0:
+            break
+        mirror_jobs(rows, since)
+        state.last_mod_time = rows[-1][1]
+        state.last_job_db_inx = rows[-1][0]
+        state.save()
+        synced += len(rows)
+
+    JobMirror.objects.filter(time_end__gt=0, time_end__lt=since).delete()
+    # the sync time is updated even when no job changed
+    state.save()
+    return synced
+
+
+def rebuild_job_mirror(batch_size=5000, days=MIRROR_DAYS):
+    """Rebuild the whole mirror with the active jobs and the jobs finished in the last days"""
+    JobMirror.objects.all().delete()
+    JobMirrorSync.objects.all().delete()
+
+    # the jobs modified during the rebuild will be copied again by the next sync
+    start = JobTable.objects.order_by('-mod_time').values_list('mod_time', flat=True).first() or 0
+    since = time.time() - days * 24 * 3600
+    last = 0
+    while True:
+        rows = list(JobTable.objects
+                    .filter(job_db_inx__gt=last)
+                    .filter(Q(state__in=ACTIVE_STATES) | Q(time_end__gte=since))
+                    .order_by('job_db_inx')
+                    .values_list(*MIRROR_FIELDS, 'deleted')[:batch_size])
+        if len(rows) == 0:
+            break
+        mirror_jobs(rows, since)
+        last = rows[-1][0]
+
+    JobMirrorSync.objects.create(last_mod_time=start, last_job_db_inx=0)
+
+
+def job_mirror():
+    """return the JobMirror queryset, None if it was never built or is not synced anymore"""
+    state = JobMirrorSync.objects.first()
+    if state is None or time.time() - state.last_sync.timestamp() > MIRROR_MAX_AGE:
+        return None
+    return JobMirror.objects.all()
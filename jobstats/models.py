@@ -1,7 +1,167 @@
+import hashlib
+import zlib
+from datetime import datetime
 from django.db import models
+from slurm.models import JobTable
+
+
+class ScriptContent(models.Model):
+    """Content of a job script, stored once, compressed, for all the jobs submitted with the same script"""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    compressed = models.BinaryField()
+    size = models.PositiveIntegerField()
+
+    def __str__(self):
+        return self.sha256
+
+    @staticmethod
+    def hash(script):
+        return hashlib.sha256(script.encode()).hexdigest()
+
+    @staticmethod
+    def compress(script):
+        return zlib.compress(script.encode(), 6)
+
+    def decompress(self):
+        return zlib.decompress(bytes(self.compressed)).decode()
+
+    @classmethod
+    def store(cls, script):
+        """return the ScriptContent of a script, created if this content was never stored"""
+        content, _created = cls.objects.get_or_create(
+            sha256=cls.hash(script),
+            defaults={'compressed': cls.compress(script), 'size': len(script)})
+        return content
 
 
 class JobScript(models.Model):
+    """
+    Script of a job, the content is shared by the jobs with the same script, like the tasks of an array
+
+    submit_script reads and writes the content like a text field, JobScript(id_job=1, submit_script='...')
+    """
     id_job = models.PositiveIntegerField(primary_key=True)
     last_modified = models.DateTimeField(auto_now=True)
-    submit_script = models.TextField()
+    content = models.ForeignKey(ScriptContent, on_delete=models.PROTECT, db_column='content_sha256')
+
+    @property
+    def submit_script(self):
+        if not hasattr(self, '_submit_script'):
+            self._submit_script = self.content.decompress()
+        return self._submit_script
+
+    @submit_script.setter
+    def submit_script(self, script):
+        self._submit_script = script
+        self._submit_script_changed = True
+
+    def save(self, *args, **kwargs):
+        if getattr(self, '_submit_script_changed', False):
+            self.content = ScriptContent.store(self._submit_script)
+            self._submit_script_changed = False
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bulk_store(cls, scripts, batch_size=1000):
+        """
+        Store many scripts at once, scripts is a dict of id_job: script
+
+        The contents and the jobs are inserted with INSERT IGNORE, an existing job is not modified.
+        return a dict of id_job: 'created' or 'exists'
+        """
+        status = {}
+        for id_job in cls.objects.filter(id_job__in=list(scripts)).values_list('id_job', flat=True):
+            status[id_job] = 'exists'
+
+        contents = {}
+        jobscripts = []
+        for id_job, script in scripts.items():
+            if id_job in status:
+                continue
+            sha256 = ScriptContent.hash(script)
+            if sha256 not in contents:
+                contents[sha256] = ScriptContent(sha256=sha256, compressed=ScriptContent.compress(script), size=len(script))
+            jobscripts.append(cls(id_job=id_job, content_id=sha256))
+            status[id_job] = 'created'
+
+        ScriptContent.objects.bulk_create(contents.values(), batch_size=batch_size, ignore_conflicts=True)
+        cls.objects.bulk_create(jobscripts, batch_size=batch_size, ignore_conflicts=True)
+        return status
+
+
+class JobDependency(models.Model):
+    """Dependency between 2 jobs of the same user, parsed from the submit line of the child job"""
+    id_user = models.PositiveIntegerField()
+    parent_job = models.PositiveIntegerField(db_index=True)
+    child_job = models.PositiveIntegerField(db_index=True)
+    type = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = (('parent_job', 'child_job', 'type'),)
+
+
+class JobDependencySync(models.Model):
+    """Position of the incremental sync of JobDependency in the job table of Slurm"""
+    last_job_db_inx = models.PositiveBigIntegerField(default=0)
+    last_sync = models.DateTimeField(auto_now=True)
+
+
+class JobSummary(models.Model):
+    """Stats and comments of a completed job, computed once by the summarize_jobs command"""
+    id_job = models.PositiveIntegerField(primary_key=True)
+    # a requeued job gets a new end, its summary is then outdated
+    time_end = models.PositiveBigIntegerField()
+    stats = models.JSONField()
+    comments = models.JSONField()
+    loaded_modules = models.JSONField(null=True)
+    # language of the comments
+    language = models.CharField(max_length=16)
+    created = models.DateTimeField(auto_now=True)
+
+
+class JobMirror(models.Model):
+    """
+    Copy of the active and recently finished jobs of the job table of Slurm, synced by sync_job_mirror()
+
+    The job table of Slurm is only indexed for sacct, this one is small and indexed for the portal.
+    """
+    job_db_inx = models.PositiveBigIntegerField(primary_key=True)
+    mod_time = models.PositiveBigIntegerField()
+    id_job = models.PositiveIntegerField(db_index=True)
+    id_user = models.PositiveIntegerField(db_index=True)
+    account = models.CharField(max_length=255, null=True, db_index=True)
+    partition = models.CharField(max_length=255, db_index=True)
+    state = models.PositiveIntegerField(choices=JobTable.StatesJob.choices, db_index=True)
+    nodelist = models.TextField(null=True)
+    nodes_alloc = models.PositiveIntegerField()
+    cpus_req = models.PositiveIntegerField()
+    mem_req = models.PositiveBigIntegerField()
+    tres_req = models.TextField()
+    tres_alloc = models.TextField()
+    time_submit = models.PositiveBigIntegerField()
+    time_start = models.PositiveBigIntegerField(db_index=True)
+    time_end = models.PositiveBigIntegerField(db_index=True)
+
+    def time_start_dt(self):
+        if self.time_start == 0:
+            return None
+        return datetime.fromtimestamp(self.time_start)
+
+    def nodes(self):
+        return [node.node for node in self.node_set.all()]
+
+
+class JobMirrorNode(models.Model):
+    """Node allocated to a job of JobMirror, to find the jobs of a node"""
+    job = models.ForeignKey(JobMirror, on_delete=models.CASCADE, related_name='node_set', db_column='job_db_inx')
+    node = models.CharField(max_length=255, db_index=True)
+
+    class Meta:
+        unique_together = (('job', 'node'),)
+
+
+class JobMirrorSync(models.Model):
+    """Position of the incremental sync of JobMirror in the job table of Slurm, by modification time"""
+    last_mod_time = models.PositiveBigIntegerField(default=0)
+    last_job_db_inx = models.PositiveBigIntegerField(default=0)
+    last_sync = models.DateTimeField(auto_now=True)
@@ -0,0 +1,94 @@
+"""
+Pagination of the jobs API
+
+The offset of a deep page is slow on a large job table, the database reads and skips all the rows
+before it. With ?pagination=cursor, the jobs are paged with a cursor on (time_start, job_db_inx):
+each page starts right after the last job of the previous page. The other clients, like the
+datatables of the portal, keep the numbered pages with their count.
+"""
+import binascii
+from base64 import b64decode, b64encode
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_datatables.pagination import DatatablesPageNumberPagination
+
+
+class KeysetPagination(BasePagination):
+    """Forward only cursor on a descending and unique ordering of two integer fields"""
+    ordering = ('time_start', 'job_db_inx')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, api_settings.PAGE_SIZE))
+        except ValueError:
+            page_size = api_settings.PAGE_SIZE
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = [int(value) for value in b64decode(encoded.encode('ascii')).decode('ascii').split(':')]
+        except (UnicodeError, ValueError, binascii.Error):
+            raise NotFound('Invalid cursor')
+        if len(position) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return position
+
+    def encode_cursor(self, position):
+        encoded = b64encode(':'.join(str(value) for value in position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        first, second = self.ordering
+        queryset = queryset.order_by('-' + first, '-' + second)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(
+                Q(**{first + '__lt': position[0]}) | Q(**{first: position[0], second + '__lt': position[1]}))
+
+        # one more job tells if there is a next page, without counting the jobs
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor([getattr(last, field) for field in self.ordering])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class JobsPagination(DatatablesPageNumberPagination):
+    """Numbered pages by default, a cursor for the clients asking for it with ?pagination=cursor"""
+    pagination_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.accepted_renderer.format == 'datatables' or request.query_params.get(self.pagination_query_param) != 'cursor':
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination()
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is None:
+            return super().get_paginated_response(data)
+        return self.keyset.get_paginated_response(data)
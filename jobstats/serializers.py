@@ -6,11 +6,20 @@ import datetime
 
 
 class JobScriptSerializer(serializers.HyperlinkedModelSerializer):
+    # stored in ScriptContent, read and written through the property of JobScript
+    submit_script = serializers.CharField(style={'base_template': 'textarea.html'})
+
     class Meta:
         model = JobScript
         fields = ['id_job', 'submit_script']
 
 
+class JobScriptBulkSerializer(serializers.Serializer):
+    # one script of a bulk upload, validated without querying the database
+    id_job = serializers.IntegerField(min_value=0, max_value=4294967295)
+    submit_script = serializers.CharField()
+
+
 class UnixEpochDateField(serializers.DateTimeField):
     def to_internal_value(self, value):
         """ Return epoch time for a datetime object or ``None``"""
@@ -0,0 +1,311 @@
+"""
+Summary of the stats of a job, stored in JobSummary once the job is completed
+
+The stats of a job cannot change after its end, the summarize_jobs command queries Prometheus once,
+shortly after the end of each job, and the job page reads the stored summary instead.
+"""
+import time
+from django.conf import settings
+from django.utils import translation
+from django.utils.translation import gettext as _
+from slurm.models import JobTable
+from userportal.common import get_prometheus
+from jobstats.models import JobScript, JobSummary
+from jobstats.analyze_job import analyze_job, Comment, Module
+
+GPU_MEMORY = {
+    'GRID V100D-4C': 4,
+    'GRID V100D-8C': 8,
+    'GRID V100D-16C': 16,
+    'GRID V100D-32C': 32,
+    'Tesla V100-SXM2-16GB': 16,
+    'Tesla V100-PCIE-32GB': 32,
+    'NVIDIA A100-SXM4-40GB': 40,
+    'Quadro RTX 6000': 20,
+    '1g.5gb': 5,
+    '1g.10gb': 10,
+    '2g.10gb': 10,
+    '2g.20gb': 20,
+    '3g.20gb': 20,
+    '3g.40gb': 40,
+    '4g.20gb': 20,
+    '4g.40gb': 40,
+    '7g.40gb': 40,
+    '7g.80gb': 80,
+}
+GPU_FULL_POWER = {
+    'Tesla V100-SXM2-16GB': 300,
+    'NVIDIA A100-SXM4-40GB': 400,
+    'Tesla V100-PCIE-32GB': 250,
+    'Quadro RTX 6000': 250,
+    '1g.5gb': 400,  # assuming A100 for all MIGs at the moment
+    '1g.10gb': 400,
+    '2g.10gb': 400,
+    '2g.20gb': 400,
+    '3g.20gb': 400,
+    '3g.40gb': 400,
+    '4g.20gb': 400,
+    '4g.40gb': 400,
+    '7g.40gb': 400,
+    '7g.80gb': 400,
+}
+GPU_IDLE_POWER = {
+    'Tesla V100-SXM2-16GB': 55,
+    'NVIDIA A100-SXM4-40GB': 55,
+    'Tesla V100-PCIE-32GB': 55,
+    'Quadro RTX 6000': 50,
+    '1g.5gb': 55,  # assuming A100 for all MIGs at the moment
+    '1g.10gb': 55,
+    '2g.10gb': 55,
+    '2g.20gb': 55,
+    '3g.20gb': 55,
+    '3g.40gb': 55,
+    '4g.20gb': 55,
+    '4g.40gb': 55,
+    '7g.40gb': 55,
+    '7g.80gb': 55,
+}
+GPU_SHORT_NAME = {
+    'GRID V100D-4C': 'V100 4GB',
+    'GRID V100D-8C': 'V100 8GB',
+    'GRID V100D-16C': 'V100 16GB',
+    'GRID V100D-32C': 'V100 32GB',
+    'Tesla V100-SXM2-16GB': 'V100',
+    'Tesla V100-PCIE-32GB': 'V100-32G',
+    'Quadro RTX 6000': 'RTX6000',
+    'NVIDIA A100-SXM4-40GB': 'A100',
+    '1g.5gb': '1g.5gb',
+    '1g.10gb': '1g.10gb',
+    '2g.10gb': '2g.10gb',
+    '2g.20gb': '2g.20gb',
+    '3g.20gb': '3g.20gb',
+    '3g.40gb': '3g.40gb',
+    '4g.20gb': '4g.20gb',
+    '4g.40gb': '4g.40gb',
+    '7g.40gb': '7g.40gb',
+    '7g.80gb': '7g.80gb',
+}
+
+# a job is summarized once it ended this number of seconds ago, to let Prometheus scrape its last values
+SUMMARY_DELAY = 600
+RUNNING_STATES = [JobTable.StatesJob.PENDING, JobTable.StatesJob.RUNNING, JobTable.StatesJob.SUSPENDED]
+
+
+def job_queries(job, gpu_count):
+    """
+    return the queries of the stats of a job, for Prometheus.query_many()
+
+    Each query is reduced to one value per series by Prometheus over the lifetime of the job
+    """
+    prom = get_prometheus()
+    job_id = job.id_job
+    queries = {
+        'cpu': ('avg', 'sum(rate(slurm_job_core_usage_total{{slurmjobid="{}", {}}}[{}s]) / 1000000000)'.format(job_id, prom.get_filter(), prom.rate('slurm-job-exporter'))),
+        'cpu_bynode': ('max', 'count(slurm_job_core_usage_total{{slurmjobid="{}", {}}}) by ({})'.format(job_id, prom.get_filter(), settings.PROM_NODE_HOSTNAME_LABEL)),
+        'mem': ('max', 'sum(slurm_job_memory_max{{slurmjobid="{}", {}}})'.format(job_id, prom.get_filter())),
+        'threads': ('avg', 'sum(slurm_job_threads_count{{slurmjobid=~"{}", state="running", {}}})'.format(job_id, prom.get_filter())),
+        'exe': ('avg', 'sum(deriv(slurm_job_process_usage_total{{slurmjobid=~"{}", {}}}[1m])) by (exe)'.format(job_id, prom.get_filter())),
+    }
+    if gpu_count > 0:
+        queries['gpu_util'] = ('avg', 'sum(slurm_job_utilization_gpu{{slurmjobid="{}", {}}})'.format(job_id, prom.get_filter()))
+        queries['gpu_mem'] = ('max', 'sum(slurm_job_memory_usage_gpu{{slurmjobid="{}", {}}})/(1024*1024*1024)'.format(job_id, prom.get_filter()))
+        queries['gpu_power'] = ('avg', 'sum(slurm_job_power_gpu{{slurmjobid="{}", {}}})/(1000)'.format(job_id, prom.get_filter()))
+    return {name: {'query': query, 'summary': summary, 'start': job.time_start_dt(), 'end': job.time_end_dt()} for name, (summary, query) in queries.items()}
+
+
+def job_stats(job, gpu_count, stats):
+    """return the scalar stats of a job from the results of job_queries(), as a dict that can be stored in JSON"""
+    prom = get_prometheus()
+    summary = {}
+    try:
+        summary['cpu_used'] = prom.first_value(stats['cpu'])
+    except ValueError:
+        summary['cpu_used'] = None
+
+    cpu_bynode = []
+    for node in stats['cpu_bynode']:
+        node_name = node['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
+        cpu_bynode.append({'name': node_name, 'count': int(node['value'])})
+    summary['cpu_bynode'] = cpu_bynode
+    summary['nb_nodes'] = len(cpu_bynode)
+
+    try:
+        summary['mem_used'] = prom.first_value(stats['mem'])
+    except ValueError:
+        summary['mem_used'] = None
+
+    if gpu_count > 0:
+        try:
+            summary['gpu_used'] = prom.first_value(stats['gpu_util'])
+        except ValueError:
+            summary['gpu_used'] = None
+
+        try:
+            summary['gpu_mem'] = prom.first_value(stats['gpu_mem']) / GPU_MEMORY[job.gpu_type()] * 100
+        except ValueError:
+            summary['gpu_mem'] = None
+
+        try:
+            used_power = prom.first_value(stats['gpu_power']) - GPU_IDLE_POWER[job.gpu_type()]
+            summary['gpu_power'] = used_power / GPU_FULL_POWER[job.gpu_type()] * 100
+        except ValueError:
+            summary['gpu_power'] = None
+
+    try:
+        summary['running_threads'] = prom.first_value(stats['threads'])
+    except ValueError:
+        summary['running_threads'] = None
+
+    summary['applications'] = []
+    for exe in stats['exe']:
+        # sometimes the exe is not present, skip those
+        if 'exe' in exe['metric']:
+            summary['applications'].append({'name': exe['metric']['exe'], 'value': exe['value']})
+    return summary
+
+
+def job_comments(job, summary, submit_script):
+    """
+    return the comments on the stats, the state and the script of a job, and the modules loaded by the script
+
+    summary is a dict from job_stats() and submit_script the submitted script or None
+    """
+    comments = []
+    loaded_modules = None
+    tres_req = job.parse_tres_req()
+    total_mem = tres_req['total_mem'] * 1024 * 1024
+
+    if submit_script is not None:
+        try:
+            comments, loaded_modules = analyze_job(submit_script, job)
+        except ValueError:
+            loaded_modules = None  # Could not parse jobscript to find loaded modules
+
+    if summary['cpu_used'] is not None:
+        if summary['cpu_used'] < 1 and tres_req['total_cores'] > 1:
+            comments += [Comment(
+                _('Less than 1 core was used on average but {} were asked for, this look like a serial job').format(tres_req['total_cores']),
+                'critical',
+                'https://docs.alliancecan.ca/wiki/Running_jobs#Serial_job',
+                graph_ids=['cpu'])]
+
+        if (tres_req['total_cores'] / 2) > summary['cpu_used']:
+            comments += [Comment(
+                _('Less than half the CPU compute cycle were used').format(tres_req['total_cores']),
+                'critical',
+                graph_ids=['cpu'])]
+
+    if summary['mem_used'] is not None:
+        if total_mem / 10 > summary['mem_used']:
+            comments += [Comment(
+                _('Less than 10% of the asked memory was used, please adjust the amount of memory requested'),
+                'critical',
+                graph_ids=['mem'])]
+
+    if job.state == JobTable.StatesJob.COMPLETE:
+        if job.timelimit < 60:  # in minutes
+            comments += [Comment(
+                _('Less than 1 hour was asked, please packages your short jobs with GLOST or GNU parallel if you want to run 100+ short jobs'),
+                'critical',
+                'https://docs.alliancecan.ca/wiki/GLOST')]
+        elif job.used_time() < 3600:
+            comments += [Comment(
+                _('Less than 1 hour was used, please packages your short jobs with GLOST or GNU parallel if you want to run 100+ short jobs'),
+                'warning',
+                'https://docs.alliancecan.ca/wiki/GLOST')]
+
+    if job.state == JobTable.StatesJob.OOM:
+        comments += [Comment(
+            _('Out of memory, increase memory asked and retry this job'),
+            'critical',
+            graph_ids=['mem'])]
+
+    if job.state == JobTable.StatesJob.NODE_FAIL:
+        comments += [Comment(
+            _('Node failure, this is a temporary issue and probably not caused by the job'),
+            'critical')]
+
+    if len(job.nodes()) > 1:
+        comments += [Comment(
+            _('This job is using multiple nodes'),
+            'info')]
+
+    running_threads = summary['running_threads']
+    if running_threads is not None:
+        if running_threads > 1.25 * tres_req['total_cores']:
+            comments += [Comment(
+                _('This job is running on average {:.1f} threads on {} cores, the cores might be oversubscribed').format(
+                    running_threads, tres_req['total_cores']),
+                'warning',
+                graph_ids=['thread'])]
+        elif running_threads < 0.75 * tres_req['total_cores']:
+            comments += [Comment(
+                _('This job is running on average {:.1f} threads on {} cores, the cores might be underused').format(
+                    running_threads, tres_req['total_cores']),
+                'warning',
+                graph_ids=['thread'])]
+
+    return comments, loaded_modules
+
+
+def is_completed(job):
+    return job.time_end != 0 and job.state not in RUNNING_STATES
+
+
+def stored_summary(job):
+    """return the JobSummary of a completed job, None if the job is not completed or not summarized yet"""
+    if not is_completed(job):
+        return None
+    summary = JobSummary.objects.filter(id_job=job.id_job).first()
+    if summary is None or summary.time_end != job.time_end:
+        # a requeued job has a new end
+        return None
+    return summary
+
+
+def summary_comments(job, summary, submit_script):
+    """return the comments and loaded modules of a JobSummary, recomputed without Prometheus if stored in another language"""
+    if summary.language == translation.get_language():
+        comments = [Comment.from_dict(comment) for comment in summary.comments]
+        if summary.loaded_modules is None:
+            return comments, None
+        return comments, [Module(module) for module in summary.loaded_modules]
+    return job_comments(job, summary.stats, submit_script)
+
+
+def summarize_job(job):
+    """query the stats of a completed job once and store them with the comments in JobSummary"""
+    gpu_count = job.gpu_count()
+    stats = job_stats(job, gpu_count, get_prometheus().query_many(job_queries(job, gpu_count)))
+    script = JobScript.objects.select_related('content').filter(id_job=job.id_job).first()
+    comments, loaded_modules = job_comments(job, stats, script.submit_script if script else None)
+    return JobSummary.objects.update_or_create(id_job=job.id_job, defaults={
+        'time_end': job.time_end,
+        'stats': stats,
+        'comments': [comment.to_dict() for comment in comments],
+        'loaded_modules': None if loaded_modules is None else [str(module) for module in loaded_modules],
+        'language': translation.get_language() or settings.LANGUAGE_CODE,
+    })[0]
+
+
+def summarize_completed_jobs(since, delay=SUMMARY_DELAY, batch_size=500):
+    """
+    Summarize the jobs that ended after since (a timestamp) and at least delay seconds ago
+
+    The jobs already summarized with the same end are skipped, return the number of jobs summarized
+    """
+    ended = list(JobTable.objects
+                 .filter(time_end__gte=since, time_end__lte=time.time() - delay)
+                 .exclude(time_start=0)
+                 .exclude(state__in=RUNNING_STATES)
+                 .values_list('job_db_inx', 'id_job', 'time_end'))
+    count = 0
+    for i in range(0, len(ended), batch_size):
+        batch = ended[i:i + batch_size]
+        # JobTable and JobSummary are in different databases, they cannot be joined
+        done = set(JobSummary.objects.filter(id_job__in=[id_job for _inx, id_job, _end in batch]).values_list('id_job', 'time_end'))
+        todo = [inx for inx, id_job, time_end in batch if (id_job, time_end) not in done]
+        for job in JobTable.objects.filter(job_db_inx__in=todo):
+            summarize_job(job)
+            count += 1
+    return count
@@ -1,6 +1,20 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+import numpy as np
+from unittest import mock
+from prometheus_api_client import PrometheusApiClientException
 from django.conf import settings
 from tests.tests import CustomTestCase
-from jobstats.models import JobScript
+from jobstats.models import JobScript, ScriptContent, JobMirror
+from jobstats.dependencies import parse_submit_line
+from jobstats.mirror import job_mirror, rebuild_job_mirror, sync_job_mirror, job_nodes
+from jobstats.analyze_job import RULES, analyze_job
+from jobstats.summary import summarize_job, stored_summary
+from slurm.models import JobTable
+from userportal.common import get_prometheus, graph_since, plotly_timestamps, username_to_uid, uid_to_username, uids_to_usernames
+from userportal.downsample import downsample, lttb_indices, percentile_bands
+from userportal.live import get_hub
 
 
 class JobstatsTestCase(CustomTestCase):
@@ -50,6 +64,26 @@ class JobstatsTestCase(CustomTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertJSONKeys(response, ['draw', 'recordsTotal', 'recordsFiltered', 'data'])
 
+    def test_user_jobstats_job_api_pages(self):
+        # the jobs are paged with numbers and counted by default
+        response = self.user_client.get('/api/jobs/?format=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONKeys(response, ['count', 'next', 'previous', 'results'])
+
+    def test_user_jobstats_job_api_cursor(self):
+        # the jobs are paged with a cursor when asked
+        response = self.user_client.get('/api/jobs/?format=json&pagination=cursor&page_size=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONKeys(response, ['next', 'results'])
+        self.assertLessEqual(len(response.json()['results']), 1)
+        if response.json()['next'] is not None:
+            first = response.json()['results'][0]['id_job']
+            response = self.user_client.get(response.json()['next'])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(first, [job['id_job'] for job in response.json()['results']])
+        response = self.user_client.get('/api/jobs/?format=json&pagination=cursor&cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
     def test_user_jobstats_job_graph(self):
         for job in settings.TESTS_JOBSTATS:
             for graph_type in [
@@ -112,3 +146,208 @@ echo 'Bye World!'"""
         self.assertNotContains(response, 'Submitted job script is not available')
         self.assertContains(response, 'Hello World!')
         self.assertContains(response, 'Line 3: sleep command is used')
+
+    def test_user_jobstats_job_graph_cache(self):
+        # The graph of a completed job is served from the cache the second time
+        job = settings.TESTS_JOBSTATS[0]
+        url = '/secure/jobstats/{user}/{jobid}/graph/cpu.json?step=120'.format(
+            user=job[0],
+            jobid=job[1])
+        first = self.user_client.get(url)
+        with mock.patch.object(get_prometheus().prom, 'custom_query_range') as custom_query_range:
+            second = self.user_client.get(url)
+            custom_query_range.assert_not_called()
+        self.assertEqual(first.json(), second.json())
+
+    def test_user_jobstats_job_graph_bundle(self):
+        for job in settings.TESTS_JOBSTATS:
+            response = self.user_client.get('/secure/jobstats/{user}/{jobid}/graph/bundle.json?graphs=cpu,mem,thread'.format(
+                user=job[0],
+                jobid=job[1]))
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(b''.join(response.streaming_content))
+            self.assertEqual(set(content.keys()), {'cpu', 'mem', 'thread'})
+            for graph in content.values():
+                self.assertIn('data', graph)
+                self.assertIn('layout', graph)
+
+    def test_plotly_timestamps(self):
+        # The vectorized timestamps are identical to the strftime of each datetime
+        epochs = [1700000000, 1700000060, 1710000000, 1720000000]
+        self.assertEqual(
+            plotly_timestamps(epochs),
+            [datetime.fromtimestamp(x).strftime('%Y-%m-%d %H:%M:%S') for x in epochs])
+        self.assertEqual(plotly_timestamps([]), [])
+
+    def test_downsample(self):
+        epochs = np.arange(1000, dtype=np.int64) * 60
+        stats = [{'metric': {'core': str(i)}, 'x': epochs, 'y': np.sin(epochs / 3600 + i)} for i in range(4)]
+        for mode in ['lttb', 'minmax']:
+            for aligned in [False, True]:
+                reduced = downsample(stats, 100, mode, aligned)
+                self.assertEqual(len(reduced), 4)
+                for line in reduced:
+                    self.assertLessEqual(len(line['x']), 100)
+                    self.assertEqual(len(line['x']), len(line['y']))
+                if aligned:
+                    self.assertTrue(all(np.array_equal(reduced[0]['x'], line['x']) for line in reduced))
+        self.assertEqual(list(lttb_indices(epochs, stats[0]['y'], 100)[[0, -1]]), [0, 999])
+
+        bands_epochs, bands = percentile_bands(stats, [10, 50, 90])
+        self.assertEqual(len(bands_epochs), 1000)
+        self.assertTrue(np.all(bands[10] <= bands[90]))
+
+    def test_uids_to_usernames(self):
+        uid = username_to_uid(settings.TESTS_USER)
+        self.assertEqual(uids_to_usernames([uid, uid]), {uid: settings.TESTS_USER})
+        self.assertEqual(uid_to_username(uid), settings.TESTS_USER)
+
+    def test_parse_dependencies(self):
+        self.assertEqual(
+            parse_submit_line('sbatch --dependency=afterok:123:456 -d afterany:789 job.sh'),
+            [('afterok', 123), ('afterok', 456), ('afterany', 789)])
+        self.assertEqual(parse_submit_line('sbatch job.sh'), [])
+        self.assertEqual(parse_submit_line(None), [])
+
+    def test_user_jobstats_job_summary(self):
+        # The stats of a summarized job are not queried again
+        job = settings.TESTS_JOBSTATS[0]
+        job_entry = JobTable.objects.get(id_job=job[1])
+        summary = summarize_job(job_entry)
+        self.assertEqual(stored_summary(job_entry), summary)
+
+        prom = get_prometheus()
+        with mock.patch.object(prom, 'query_many', wraps=prom.query_many) as query_many:
+            response = self.user_client.get('/secure/jobstats/{user}/{jobid}/'.format(
+                user=job[0],
+                jobid=job[1]))
+        self.assertEqual(response.status_code, 200)
+        for call in query_many.call_args_list:
+            self.assertNotIn('cpu', call.args[0])
+
+    def test_query_summary(self):
+        # The summary computed by Prometheus is the same as the one computed from the range
+        job = JobTable.objects.get(id_job=settings.TESTS_JOBSTATS[0][1])
+        prom = get_prometheus()
+        query = 'sum(slurm_job_memory_max{{slurmjobid="{}", {}}})'.format(job.id_job, prom.get_filter())
+        pushed = prom.query_summary_multiple(query, 'max', job.time_start_dt(), job.time_end_dt())
+        with mock.patch.object(prom, 'summary_subqueries', False):
+            reduced = prom.query_summary_multiple(query, 'max', job.time_start_dt(), job.time_end_dt())
+        self.assertEqual(len(pushed), len(reduced))
+        for line_pushed, line_reduced in zip(pushed, reduced):
+            self.assertAlmostEqual(line_pushed['value'], line_reduced['value'], delta=abs(line_reduced['value']) * 0.05)
+
+    def test_query_summary_error(self):
+        # A bad query raises its error and does not disable the subqueries
+        prom = get_prometheus()
+        self.assertTrue(prom.subqueries_supported())
+        with self.assertRaises(PrometheusApiClientException):
+            prom.query_summary_multiple('sum(slurm_job_memory_max{slurmjobid="1"', 'max', datetime.now() - timedelta(hours=1))
+        self.assertTrue(prom.summary_subqueries)
+
+    def test_analyze_job(self):
+        # The prefilter on the literals finds the same comments as a search per rule
+        job = JobTable.objects.get(id_job=settings.TESTS_JOBSTATS[0][1])
+        script = """#!/bin/bash
+module load gromacs/2020.4
+sleep 60
+gmx grompp -f md.mdp
+conda activate env"""
+        comments, modules = analyze_job(script, job)
+        self.assertEqual([str(module) for module in modules], ['gromacs/2020.4'])
+        self.assertEqual(
+            [(comment.line_number, comment.comment) for comment in comments],
+            [(3, 'sleep command is used'), (4, 'GROMACS preprocessor should be used on a login node'), (5, 'conda environment is used')])
+        comments_per_rule, _modules = RULES.analyze_per_rule(script, job)
+        self.assertEqual([comment.comment for comment in comments], [comment.comment for comment in comments_per_rule])
+
+    def test_jobscript_dedup(self):
+        # The jobs with the same script share the same content
+        script = "#!/bin/bash\nsrun ./array_task $SLURM_ARRAY_TASK_ID\n"
+        JobScript(id_job=1000001, submit_script=script).save()
+        JobScript.objects.create(id_job=1000002, submit_script=script)
+        self.assertEqual(ScriptContent.objects.filter(sha256=ScriptContent.hash(script)).count(), 1)
+        self.assertEqual(JobScript.objects.get(id_job=1000002).submit_script, script)
+
+        response = self.admin_client.get('/api/jobscripts/1000001/?format=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id_job': 1000001, 'submit_script': script})
+
+    def test_jobscript_bulk(self):
+        JobScript(id_job=1000003, submit_script='#!/bin/bash\nhostname\n').save()
+        response = self.admin_client.post('/api/jobscripts/bulk/', [
+            {'id_job': 1000003, 'submit_script': '#!/bin/bash\nhostname\n'},
+            {'id_job': 1000004, 'submit_script': '#!/bin/bash\nhostname\n'},
+            {'id_job': 1000005},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], {'1000003': 'exists', '1000004': 'created', '1000005': 'invalid'})
+        self.assertEqual(JobScript.objects.get(id_job=1000004).submit_script, '#!/bin/bash\nhostname\n')
+
+    def test_user_other_jobstats_live(self):
+        # A user cannot stream the usage of other user jobs
+        response = self.user_client.get('/secure/jobstats/{user}/1/live'.format(
+            user=settings.TESTS_ADMIN))
+        self.assertEqual(response.status_code, 403)
+
+    def test_jobstats_live_disabled(self):
+        # The live streams need ASGI, they are disabled by default and refused under WSGI
+        job = settings.TESTS_JOBSTATS[0]
+        url = '/secure/jobstats/{}/{}/live'.format(job[0], job[1])
+        self.assertEqual(self.admin_client.get(url).status_code, 404)
+        with self.settings(LIVE_STREAMS={'enabled': True, 'shared_cache': None}):
+            self.assertEqual(self.admin_client.get(url).status_code, 501)
+
+    async def test_live_hub(self):
+        # the viewers of the same stream share a single fetch
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return {'cpu': 1.0}
+
+        hub = get_hub()
+        stream1, queue1 = hub.subscribe('test:job', 60, fetch)
+        stream2, queue2 = hub.subscribe('test:job', 60, fetch)
+        self.assertIs(stream1, stream2)
+        event1 = await asyncio.wait_for(queue1.get(), 10)
+        event2 = await asyncio.wait_for(queue2.get(), 10)
+        self.assertEqual(event1, event2)
+        self.assertTrue(event1.startswith('event: values\n'))
+        self.assertEqual(len(calls), 1)
+        hub.unsubscribe(stream1, queue1)
+        hub.unsubscribe(stream2, queue2)
+        self.assertNotIn('test:job', hub.streams)
+
+    def test_job_mirror(self):
+        self.assertIsNone(job_mirror())
+        self.assertIsNone(sync_job_mirror())
+        # all the test jobs are recent enough
+        rebuild_job_mirror(days=365 * 100)
+        self.assertIsNotNone(job_mirror())
+        job = JobTable.objects.get(id_job=settings.TESTS_JOBSTATS[0][1])
+        mirrored = JobMirror.objects.get(job_db_inx=job.job_db_inx)
+        self.assertEqual((mirrored.id_job, mirrored.partition, mirrored.state), (job.id_job, job.partition, job.state))
+        self.assertEqual(sorted(mirrored.nodes()), sorted(job_nodes(job.nodelist)))
+        self.assertIsNotNone(sync_job_mirror(days=365 * 100))
+        self.assertTrue(JobMirror.objects.filter(job_db_inx=job.job_db_inx).exists())
+
+    def test_user_jobstats_job_graph_since(self):
+        job = settings.TESTS_JOBSTATS[0]
+        job_entry = JobTable.objects.get(id_job=job[1])
+        response = self.user_client.get('/secure/jobstats/{user}/{jobid}/graph/cpu.json?since={since}'.format(
+            user=job[0],
+            jobid=job[1],
+            since=job_entry.time_start))
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONKeys(response, ['series'])
+
+    def test_graph_since(self):
+        data = {'data': [
+            {'name': 'a', 'x': ['2024-01-01 00:00:00', '2024-01-01 00:01:00', '2024-01-01 00:02:00'], 'y': [1, 2, 3]},
+            {'name': 'a', 'x': [datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 1, 0, 1)], 'y': [4, 5]},
+        ]}
+        self.assertEqual(graph_since(data, datetime(2024, 1, 1, 0, 1)), {'series': {
+            'a': {'x': ['2024-01-01 00:02:00'], 'y': [3]},
+            'a#1': {'x': [], 'y': []},
+        }})
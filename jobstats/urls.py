@@ -33,5 +33,7 @@ urlpatterns = [
     path('<str:username>/<str:job_id>/graph/cpu_interconnect.json', views.graph_cpu_interconnect),
     path('<str:username>/<str:job_id>/graph/ipc.json', views.graph_ipc),
     path('<str:username>/<str:job_id>/graph/power.json', views.graph_power),
+    path('<str:username>/<str:job_id>/graph/bundle.json', views.graph_bundle),
     path('<str:username>/<str:job_id>/value/cost.json', views.value_cost),
+    path('<str:username>/<str:job_id>/live', views.job_live),
 ]
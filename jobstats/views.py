@@ -1,97 +1,47 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponseNotFound, JsonResponse
+from django.http import HttpResponseNotFound, JsonResponse, StreamingHttpResponse
 from slurm.models import JobTable, AssocTable, EventTable
-from userportal.common import user_or_staff, username_to_uid, Prometheus, request_to_username, compute_allocations_by_user, get_step, parse_start_end, fixed_zoom_config
+from userportal.common import user_or_staff, username_to_uid, uids_to_usernames, get_prometheus, request_to_username, compute_allocations_by_user, get_step, parse_start_end, fixed_zoom_config, plotly_timestamps, GraphResponse, graph_since
+from userportal.downsample import reduce_stats, bands_traces
+from userportal.live import event_stream, async_user_or_staff, sampling_rate, instant_values
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from datetime import datetime, timedelta
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
 from rest_framework import viewsets
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from jobstats.models import JobScript
-from jobstats.serializers import JobSerializer, JobScriptSerializer
+from jobstats.dependencies import index_built, job_dependencies, dependency_dag
+from jobstats.summary import stored_summary, job_queries, job_stats, job_comments, summary_comments
+from jobstats.summary import GPU_MEMORY, GPU_FULL_POWER, GPU_IDLE_POWER, GPU_SHORT_NAME
+from jobstats.pagination import JobsPagination
+from jobstats.serializers import JobSerializer, JobScriptSerializer, JobScriptBulkSerializer
 from notes.models import Note
-import statistics
-from jobstats.analyze_job import find_loaded_modules, analyze_jobscript
-from jobstats.analyze_job import Comment
+from jobstats.analyze_job import Comment, analyze_submit_line
 from django.http import Http404
+import functools
+import logging
 import os
 from django.db.models import Q
+from django.db import connections
+from django.utils import translation
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-GPU_MEMORY = {
-    'GRID V100D-4C': 4,
-    'GRID V100D-8C': 8,
-    'GRID V100D-16C': 16,
-    'GRID V100D-32C': 32,
-    'Tesla V100-SXM2-16GB': 16,
-    'Tesla V100-PCIE-32GB': 32,
-    'NVIDIA A100-SXM4-40GB': 40,
-    'Quadro RTX 6000': 20,
-    '1g.5gb': 5,
-    '1g.10gb': 10,
-    '2g.10gb': 10,
-    '2g.20gb': 20,
-    '3g.20gb': 20,
-    '3g.40gb': 40,
-    '4g.20gb': 20,
-    '4g.40gb': 40,
-    '7g.40gb': 40,
-    '7g.80gb': 80,
-}
-GPU_FULL_POWER = {
-    'Tesla V100-SXM2-16GB': 300,
-    'NVIDIA A100-SXM4-40GB': 400,
-    'Tesla V100-PCIE-32GB': 250,
-    'Quadro RTX 6000': 250,
-    '1g.5gb': 400,  # assuming A100 for all MIGs at the moment
-    '1g.10gb': 400,
-    '2g.10gb': 400,
-    '2g.20gb': 400,
-    '3g.20gb': 400,
-    '3g.40gb': 400,
-    '4g.20gb': 400,
-    '4g.40gb': 400,
-    '7g.40gb': 400,
-    '7g.80gb': 400,
-}
-GPU_IDLE_POWER = {
-    'Tesla V100-SXM2-16GB': 55,
-    'NVIDIA A100-SXM4-40GB': 55,
-    'Tesla V100-PCIE-32GB': 55,
-    'Quadro RTX 6000': 50,
-    '1g.5gb': 55,  # assuming A100 for all MIGs at the moment
-    '1g.10gb': 55,
-    '2g.10gb': 55,
-    '2g.20gb': 55,
-    '3g.20gb': 55,
-    '3g.40gb': 55,
-    '4g.20gb': 55,
-    '4g.40gb': 55,
-    '7g.40gb': 55,
-    '7g.80gb': 55,
-}
-GPU_SHORT_NAME = {
-    'GRID V100D-4C': 'V100 4GB',
-    'GRID V100D-8C': 'V100 8GB',
-    'GRID V100D-16C': 'V100 16GB',
-    'GRID V100D-32C': 'V100 32GB',
-    'Tesla V100-SXM2-16GB': 'V100',
-    'Tesla V100-PCIE-32GB': 'V100-32G',
-    'Quadro RTX 6000': 'RTX6000',
-    'NVIDIA A100-SXM4-40GB': 'A100',
-    '1g.5gb': '1g.5gb',
-    '1g.10gb': '1g.10gb',
-    '2g.10gb': '2g.10gb',
-    '2g.20gb': '2g.20gb',
-    '3g.20gb': '3g.20gb',
-    '3g.40gb': '3g.40gb',
-    '4g.20gb': '4g.20gb',
-    '4g.40gb': '4g.40gb',
-    '7g.40gb': '7g.40gb',
-    '7g.80gb': '7g.80gb',
-}
+prom = get_prometheus()
+logger = logging.getLogger(__name__)
+
+# maximum number of job scripts in a request to /api/jobscripts/bulk/
+JOBSCRIPTS_BULK_MAX = 10000
 
-prom = Prometheus(settings.PROMETHEUS)
+# columns of JobTable read by /api/jobs/, with the keys of the pagination
+JOBS_API_FIELDS = [
+    'job_db_inx', 'id_job', 'job_name', 'account', 'id_user', 'state', 'nodelist', 'timelimit',
+    'time_submit', 'time_start', 'time_eligible', 'time_end',
+]
 
 
 def jobid_str_to_list(jobid_str):
@@ -129,6 +79,11 @@ def get_job_ids_regex(jobs):
 
 
 def context_job_info(request, username, job_id):
+    # The bundle view resolves the job once and shares it with the graph views
+    shared = getattr(request, 'job_context', None)
+    if shared is not None and shared['username'] == username and shared['job_id'] == job_id:
+        return dict(shared)
+
     context = {'job_id': job_id, 'username': username}
     uid = username_to_uid(username)
     context['uid'] = uid
@@ -185,11 +140,38 @@ def context_job_info(request, username, job_id):
             except ValueError:
                 pass
     context['step'] = get_step(context['start'], context['end'])
+    if request is not None and 'since' in request.GET:
+        # only the new points are queried, on the same step as the whole graph
+        try:
+            since = datetime.fromtimestamp(int(request.GET['since']))
+            if since > context['start']:
+                context['start'] = since
+        except ValueError:
+            pass
     return context
 
 
+def incremental_graph(view_func):
+    """
+    With ?since=<epoch>, return only the points of each series after since, like graph_since()
+
+    Used by the job page to extend the graphs of a running job with Plotly.extendTraces
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if 'since' not in request.GET or not isinstance(response, GraphResponse) or 'data' not in response.data:
+            return response
+        try:
+            since = datetime.fromtimestamp(int(request.GET['since']))
+        except ValueError:
+            return response
+        return GraphResponse(graph_since(response.data, since))
+    return wrapper
+
+
 def instances_regex(context):
-    return '|'.join([s + '(:.*)?' for s in context['job'].nodes()])
+    return '({})(:.*)?'.format(context['job'].nodes_regex())
 
 
 def display_compute_name(lines, line):
@@ -221,36 +203,34 @@ def user(request, username):
     uid = username_to_uid(username)
     context = {'username': username}
 
-    running_jobs = JobTable.objects.filter(id_user=uid, state=1).all()
-    context['total_cores'] = 0
-    context['total_mem'] = 0
-    context['total_gpus'] = 0
-    for job in running_jobs:
-        info = job.parse_tres_req()
-        context['total_cores'] += info['total_cores']
-        context['total_mem'] += (info['total_mem'] * 1024 * 1024)
-        context['total_gpus'] += job.gpu_count()
+    running = JobTable.objects.filter(id_user=uid, state=JobTable.StatesJob.RUNNING).resources_summary()
+    context['total_cores'] = running.cores
+    context['total_mem'] = running.mem
+    context['total_gpus'] = running.gpus
 
     now = datetime.now()
     delta = timedelta(hours=1)
+    query_cpu = 'sum(rate(slurm_job_core_usage_total{{user="{}", {}}}[{}s]) / 1000000000)'.format(username, prom.get_filter(), prom.rate('slurm-job-exporter'))
+    query_mem = 'sum(slurm_job_memory_max{{user="{}", {}}})'.format(username, prom.get_filter())
+    query_gpu = 'sum(slurm_job_utilization_gpu{{user="{}", {}}})/100'.format(username, prom.get_filter())
+    stats = prom.query_many({
+        'cpu': {'query': query_cpu, 'summary': 'avg', 'start': now - delta, 'end': now},
+        'mem': {'query': query_mem, 'summary': 'max', 'start': now - delta, 'end': now},
+        'gpu': {'query': query_gpu, 'summary': 'max', 'start': now - delta, 'end': now},
+    })
+
     try:
-        query_cpu = 'sum(rate(slurm_job_core_usage_total{{user="{}", {}}}[{}s]) / 1000000000)'.format(username, prom.get_filter(), prom.rate('slurm-job-exporter'))
-        stats_cpu = prom.query_prometheus(query_cpu, now - delta, now)
-        context['cpu_used'] = statistics.mean(stats_cpu[1])
+        context['cpu_used'] = prom.first_value(stats['cpu'])
     except ValueError:
         context['cpu_used'] = 'N/A'
 
     try:
-        query_mem = 'sum(slurm_job_memory_max{{user="{}", {}}})'.format(username, prom.get_filter())
-        stats_mem = prom.query_prometheus(query_mem, now - delta, now)
-        context['mem_used'] = max(stats_mem[1])
+        context['mem_used'] = prom.first_value(stats['mem'])
     except ValueError:
         context['mem_used'] = 'N/A'
 
     try:
-        query_gpu = 'sum(slurm_job_utilization_gpu{{user="{}", {}}})/100'.format(username, prom.get_filter())
-        stats_gpu = prom.query_prometheus(query_gpu, now - delta, now)
-        context['gpu_used'] = max(stats_gpu[1])
+        context['gpu_used'] = prom.first_value(stats['gpu'])
     except ValueError:
         context['gpu_used'] = 'N/A'
 
@@ -271,8 +251,12 @@ def job(request, username, job_id):
     # continue with single job
     job = context['job']
 
-    context['dependencies'] = job.dependencies()
-    context['depends_on_this'] = job.depends_on_this()
+    context['dependencies'], context['depends_on_this'] = job_dependencies(job)
+    if index_built():
+        # show the whole graph only when it goes further than the direct dependencies
+        dag = dependency_dag(job)
+        if len(dag) > len(context['dependencies']) + len(context['depends_on_this']):
+            context['dependency_dag'] = dag
 
     if job.id_array_job != 0:
         # list all jobs in the array
@@ -284,13 +268,7 @@ def job(request, username, job_id):
     context['tres_req'] = job.parse_tres_req()
     context['total_mem'] = context['tres_req']['total_mem'] * 1024 * 1024
 
-    comments = []
-    if '--dependency=singleton' in job.submit_line \
-        or '--depend=singleton' in job.submit_line \
-            or '-d singleton' in job.submit_line:
-        comments += [Comment(
-            _('This job is using a singleton dependency'),
-            'info')]
+    comments = analyze_submit_line(job)
     if len(context['dependencies']) > 0:
         comments += [Comment(
             _('This job has dependencies on other jobs'),
@@ -299,53 +277,35 @@ def job(request, username, job_id):
         comments += [Comment(
             _('This job is a dependency for other jobs'),
             'info')]
-    if '--exclusive' in job.submit_line:
-        comments += [Comment(
-            _('This job is using exclusive mode'),
-            'info')]
-    if '--licenses=' in job.submit_line or '-L ' in job.submit_line:
-        comments += [Comment(
-            _('This job is using licenses'),
-            'info')]
-    if '--nodelist=' in job.submit_line or '-w ' in job.submit_line:
-        comments += [Comment(
-            _('This job is using a specific nodelist'),
-            'info')]
-    if '--exclude=' in job.submit_line or '-x ' in job.submit_line:
-        comments += [Comment(
-            _('This job is excluding nodes'),
-            'warning')]
-    if '--requeue' in job.submit_line:
-        comments += [Comment(
-            _('This job can be requeued'),
-            'info')]
-    if '--no-requeue' in job.submit_line:
-        comments += [Comment(
-            _('This job cannot be requeued'),
-            'info')]
-    if '--reservation=' in job.submit_line:
-        comments += [Comment(
-            _('This job is using a reservation'),
-            'info')]
-    if '--switches=' in job.submit_line:
-        comments += [Comment(
-            _('This job is using a maximum quantity of switches'),
-            'info')]
 
+    # the stats of a completed job are read from its summary, only the priority is queried
+    summary = stored_summary(job)
+
+    # all the queries of the page are sent concurrently, only one round-trip to Prometheus
+    queries = {}
     if 'slurm_exporter' in settings.EXPORTER_INSTALLED:
+        query_priority = 'slurm_account_levelfs{{account="{account}", {filter}}}'.format(
+            account=job.account,
+            filter=prom.get_filter()
+        )
+        if job.time_start_dt() is not None:
+            # If the job has started, use the start time.
+            queries['priority'] = {'query': query_priority, 'start': job.time_start_dt(), 'end': job.time_start_dt() + timedelta(minutes=15)}
+        else:
+            # Otherwise, use the current time.
+            queries['priority'] = {'query': query_priority}
+
+    if job.time_start_dt() is not None and summary is None:
+        queries.update(job_queries(job, context['gpu_count']))
+
+    stats = prom.query_many(queries)
+
+    if 'priority' in stats:
         try:
-            query_priority = 'slurm_account_levelfs{{account="{account}", {filter}}}'.format(
-                account=job.account,
-                filter=prom.get_filter()
-            )
             if job.time_start_dt() is not None:
-                # If the job has started, use the start time.
-                stats_priority = prom.query_prometheus(query_priority, job.time_start_dt(), job.time_start_dt() + timedelta(minutes=15))
-                context['priority'] = stats_priority[1][0]
+                context['priority'] = prom.first_line(stats['priority'])[1][0]
             else:
-                # Otherwise, use the current time.
-                stats_priority = prom.query_last(query_priority)
-                context['priority'] = stats_priority[0]['value'][1]
+                context['priority'] = stats['priority'][0]['value'][1]
         except ValueError:
             context['priority'] = None
         except IndexError:
@@ -355,151 +315,33 @@ def job(request, username, job_id):
         context['comments'] = sorted(comments, key=lambda x: x.line_number)
         return render(request, 'jobstats/job.html', context)
 
-    try:
-        query_cpu = 'sum(rate(slurm_job_core_usage_total{{slurmjobid="{}", {}}}[{}s]) / 1000000000)'.format(job_id, prom.get_filter(), prom.rate('slurm-job-exporter'))
-        stats_cpu = prom.query_prometheus(query_cpu, job.time_start_dt(), job.time_end_dt())
-        context['cpu_used'] = statistics.mean(stats_cpu[1])
-    except ValueError:
-        context['cpu_used'] = None
-
-    try:
-        query_cpu_bynode = 'count(slurm_job_core_usage_total{{slurmjobid="{}", {}}}) by ({})'.format(job_id, prom.get_filter(), settings.PROM_NODE_HOSTNAME_LABEL)
-        stats_cpu_bynode = prom.query_prometheus_multiple(query_cpu_bynode, job.time_start_dt(), job.time_end_dt())
-        cpu_bynode = []
-        for node in stats_cpu_bynode:
-            node_name = node['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-            cpu_bynode.append({'name': node_name, 'count': int(node['y'][0])})
-        context['cpu_bynode'] = cpu_bynode
-        context['nb_nodes'] = len(cpu_bynode)
-    except ValueError:
-        context['cpu_bynode'] = None
-        context['nb_nodes'] = None
-
-    try:
-        query_mem = 'sum(slurm_job_memory_max{{slurmjobid="{}", {}}})'.format(job_id, prom.get_filter())
-        stats_mem = prom.query_prometheus(query_mem, job.time_start_dt(), job.time_end_dt())
-        context['mem_used'] = max(stats_mem[1])
-    except ValueError:
-        context['mem_used'] = None
-
-    if context['gpu_count'] > 0:
-        try:
-            query_gpu_util = 'sum(slurm_job_utilization_gpu{{slurmjobid="{}", {}}})'.format(job_id, prom.get_filter())
-            stats_gpu_util = prom.query_prometheus(query_gpu_util, job.time_start_dt(), job.time_end_dt())
-            context['gpu_used'] = statistics.mean(stats_gpu_util[1])
-        except ValueError:
-            context['gpu_used'] = None
-
-        try:
-            query_gpu_mem = 'sum(slurm_job_memory_usage_gpu{{slurmjobid="{}", {}}})/(1024*1024*1024)'.format(job_id, prom.get_filter())
-            stats_gpu_mem = prom.query_prometheus(query_gpu_mem, job.time_start_dt(), job.time_end_dt())
-            context['gpu_mem'] = max(stats_gpu_mem[1]) / GPU_MEMORY[job.gpu_type()] * 100
-        except ValueError:
-            context['gpu_mem'] = None
-
-        try:
-            query_gpu_power = 'sum(slurm_job_power_gpu{{slurmjobid="{}", {}}})/(1000)'.format(job_id, prom.get_filter())
-            stats_gpu_power = prom.query_prometheus(query_gpu_power, job.time_start_dt(), job.time_end_dt())
-            used_power = statistics.mean(stats_gpu_power[1]) - GPU_IDLE_POWER[job.gpu_type()]
-            context['gpu_power'] = used_power / GPU_FULL_POWER[job.gpu_type()] * 100
-        except ValueError:
-            context['gpu_power'] = None
+    if summary is None:
+        job_summary = job_stats(job, context['gpu_count'], stats)
+    else:
+        job_summary = summary.stats
+    context.update({key: value for key, value in job_summary.items() if key not in ['running_threads', 'applications']})
 
     try:
-        context['job_script'] = JobScript.objects.get(id_job=job_id)
-        try:
-            modules = find_loaded_modules(context['job_script'].submit_script)
-            context['loaded_modules'] = modules
-            comments += analyze_jobscript(context['job_script'].submit_script, context['loaded_modules'], job)
-        except ValueError:
-            context['loaded_modules'] = None  # Could not parse jobscript to find loaded modules
+        context['job_script'] = JobScript.objects.select_related('content').get(id_job=job_id)
+        submit_script = context['job_script'].submit_script
     except JobScript.DoesNotExist:
         context['job_script'] = None
+        submit_script = None
 
-    if context['cpu_used'] is not None:
-        if context['cpu_used'] < 1 and context['tres_req']['total_cores'] > 1:
-            comments += [Comment(
-                _('Less than 1 core was used on average but {} were asked for, this look like a serial job').format(context['tres_req']['total_cores']),
-                'critical',
-                'https://docs.alliancecan.ca/wiki/Running_jobs#Serial_job',
-                graph_ids=['cpu'])]
-
-        if (context['tres_req']['total_cores'] / 2) > context['cpu_used']:
-            comments += [Comment(
-                _('Less than half the CPU compute cycle were used').format(context['tres_req']['total_cores']),
-                'critical',
-                graph_ids=['cpu'])]
-
-    if context['mem_used'] is not None:
-        if context['total_mem'] / 10 > context['mem_used']:
-            comments += [Comment(
-                _('Less than 10% of the asked memory was used, please adjust the amount of memory requested'),
-                'critical',
-                graph_ids=['mem'])]
-
-    if job.state == JobTable.StatesJob.COMPLETE:
-        if job.timelimit < 60:  # in minutes
-            comments += [Comment(
-                _('Less than 1 hour was asked, please packages your short jobs with GLOST or GNU parallel if you want to run 100+ short jobs'),
-                'critical',
-                'https://docs.alliancecan.ca/wiki/GLOST')]
-        elif job.used_time() < 3600:
-            comments += [Comment(
-                _('Less than 1 hour was used, please packages your short jobs with GLOST or GNU parallel if you want to run 100+ short jobs'),
-                'warning',
-                'https://docs.alliancecan.ca/wiki/GLOST')]
-
-    if job.state == JobTable.StatesJob.OOM:
-        comments += [Comment(
-            _('Out of memory, increase memory asked and retry this job'),
-            'critical',
-            graph_ids=['mem'])]
-
-    if job.state == JobTable.StatesJob.NODE_FAIL:
-        comments += [Comment(
-            _('Node failure, this is a temporary issue and probably not caused by the job'),
-            'critical')]
-
-    if len(job.nodes()) > 1:
-        comments += [Comment(
-            _('This job is using multiple nodes'),
-            'info')]
-
-    try:
-        query_threads = 'sum(slurm_job_threads_count{{slurmjobid=~"{}", state="running", {}}})'.format(job_id, prom.get_filter())
-        stats_threads = prom.query_prometheus(query_threads, job.time_start_dt(), job.time_end_dt())
-        running_threads = statistics.mean(stats_threads[1])
-        if running_threads > 1.25 * context['tres_req']['total_cores']:
-            comments += [Comment(
-                _('This job is running on average {:.1f} threads on {} cores, the cores might be oversubscribed').format(
-                    running_threads, context['tres_req']['total_cores']),
-                'warning',
-                graph_ids=['thread'])]
-        elif running_threads < 0.75 * context['tres_req']['total_cores']:
-            comments += [Comment(
-                _('This job is running on average {:.1f} threads on {} cores, the cores might be underused').format(
-                    running_threads, context['tres_req']['total_cores']),
-                'warning',
-                graph_ids=['thread'])]
-    except ValueError:
-        pass
-
-    try:
-        query_exe = 'sum(deriv(slurm_job_process_usage_total{{slurmjobid=~"{}", {}}}[1m])) by (exe)'.format(job_id, prom.get_filter())
-        stats_exe = prom.query_prometheus_multiple(query_exe, job.time_start_dt(), job.time_end_dt())
-        context['applications'] = []
-        for exe in stats_exe:
-            # sometimes the exe is not present, skip those
-            if 'exe' in exe['metric']:
-                name = exe['metric']['exe']
-                value = statistics.mean(exe['y'])
-                if settings.DEMO:
-                    if not name.startswith('/cvmfs'):
-                        # skip non-cvmfs applications in demo mode
-                        name = '[redacted]'
-                context['applications'].append({'name': name, 'value': value})
-    except ValueError:
-        pass
+    if summary is None:
+        job_comments_list, context['loaded_modules'] = job_comments(job, job_summary, submit_script)
+    else:
+        job_comments_list, context['loaded_modules'] = summary_comments(job, summary, submit_script)
+    comments += job_comments_list
+
+    context['applications'] = []
+    for exe in job_summary['applications']:
+        name = exe['name']
+        if settings.DEMO:
+            if not name.startswith('/cvmfs'):
+                # skip non-cvmfs applications in demo mode
+                name = '[redacted]'
+        context['applications'].append({'name': name, 'value': exe['value']})
 
     context['comments'] = sorted(comments, key=lambda x: x.line_number)
 
@@ -544,6 +386,7 @@ def job(request, username, job_id):
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_cpu(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -552,13 +395,23 @@ def graph_cpu(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
+
+    stats, bands = reduce_stats(request, stats, aligned=True)
+    if bands is not None:
+        # too many cores to show them individually
+        layout = {
+            'yaxis': {
+                'title': _('Cores used per core'),
+            }
+        }
+        return GraphResponse({'data': bands_traces(*bands), 'layout': layout, 'config': fixed_zoom_config()})
 
     data = []
     for line in stats:
         core_num = int(line['metric']['core'])
         compute_name = display_compute_name(stats, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         if context['multiple_jobs']:
             name = '{} Core {} {}'.format(line['metric']['slurmjobid'], core_num, compute_name)
@@ -598,7 +451,7 @@ def graph_cpu(request, username, job_id):
     else:
         layout['yaxis']['range'] = [0, context['job'].parse_tres_req()['total_cores']]
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
@@ -627,7 +480,7 @@ def graph_cpu_user(request, username):
             'hovertemplate': '%{y:.1f}',
         })
     except ValueError:
-        return JsonResponse({'data': data, 'layout': {}})
+        return GraphResponse({'data': data, 'layout': {}})
 
     layout = {
         'yaxis': {
@@ -635,7 +488,7 @@ def graph_cpu_user(request, username):
             'title': _('Cores'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -674,7 +527,7 @@ def graph_mem_user(request, username):
             'hovertemplate': '%{y:.1f}',
         })
     except ValueError:
-        return JsonResponse({'data': [], 'layout': {}})
+        return GraphResponse({'data': [], 'layout': {}})
 
     layout = {
         'yaxis': {
@@ -684,11 +537,12 @@ def graph_mem_user(request, username):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_mem(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -717,10 +571,10 @@ def graph_mem(request, username, job_id):
             query,
             context['start'],
             context['end'],
-            step=max(context['step'], prom.rate('slurm-job-exporter')))
+            step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
         for line in stats:
             compute_name = display_compute_name(stats, line)
-            x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+            x = plotly_timestamps(line['x'])
             y = line['y']
             if context['multiple_jobs']:
                 name = '{} {} {}'.format(line['metric']['slurmjobid'], stat[1], compute_name)
@@ -737,7 +591,7 @@ def graph_mem(request, username, job_id):
                 info['stackgroup'] = 'one'
             data.append(info)
         if stat[0] == 'slurm_job_memory_limit':
-            maximum = max(max(map(lambda x: x['y'], stats)))
+            maximum = max(float(line['y'].max()) for line in stats)
 
     if context['multiple_jobs']:
         query_count = 'sum(slurm_job_memory_limit{{slurmjobid=~"{}", {}}})/(1024*1024*1024)'.format(context['id_regex'], prom.get_filter())
@@ -765,11 +619,12 @@ def graph_mem(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_thread(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -780,10 +635,10 @@ def graph_thread(request, username, job_id):
         query_procs,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
     for line in stats_procs:
         compute_name = display_compute_name(stats_procs, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         if context['multiple_jobs']:
             name = '{} {} {}'.format(line['metric']['slurmjobid'], _('Processes'), compute_name)
@@ -802,13 +657,13 @@ def graph_thread(request, username, job_id):
         query_threads,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
     for line in stats_threads:
         if line['metric']['state'] == '?':
             # ignore "?" state
             continue
         compute_name = display_compute_name(stats_threads, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
 
         try:
@@ -834,10 +689,10 @@ def graph_thread(request, username, job_id):
         query_exe,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     for line in stats_exe:
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         # sometimes the exe is not present, skip those
         if 'exe' in line['metric']:
@@ -856,11 +711,12 @@ def graph_thread(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_lustre_mdt(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -898,7 +754,7 @@ def graph_lustre_mdt(request, username, job_id):
             'title': _('IOPS'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
@@ -927,11 +783,12 @@ def graph_lustre_mdt_user(request, username):
             'title': _('IOPS'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_lustre_ost(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -974,7 +831,7 @@ def graph_lustre_ost(request, username, job_id):
             'title': _('Bandwidth'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
@@ -1012,11 +869,12 @@ def graph_lustre_ost_user(request, username):
             'title': _('Bandwidth'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_utilization(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1037,12 +895,12 @@ def graph_gpu_utilization(request, username, job_id):
             query,
             context['start'],
             context['end'],
-            step=max(context['step'], prom.rate('slurm-job-exporter')))
+            step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
         for line in stats:
             gpu_id = display_gpu_id(line)
             compute_name = display_compute_name(stats, line)
-            x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+            x = plotly_timestamps(line['x'])
             y = line['y']
             if context['multiple_jobs']:
                 name = '{} {} GPU {} {}'.format(line['metric']['slurmjobid'], q[1], gpu_id, compute_name)
@@ -1062,7 +920,7 @@ def graph_gpu_utilization(request, username, job_id):
             'title': _('GPU Utilization'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
@@ -1097,11 +955,12 @@ def graph_gpu_utilization_user(request, username):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_memory_utilization(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1110,13 +969,13 @@ def graph_gpu_memory_utilization(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     data = []
     for line in stats:
         gpu_id = display_gpu_id(line)
         compute_name = display_compute_name(stats, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         if context['multiple_jobs']:
             name = '{} GPU {} {}'.format(line['metric']['slurmjobid'], gpu_id, compute_name)
@@ -1136,11 +995,12 @@ def graph_gpu_memory_utilization(request, username, job_id):
             'title': _('GPU Memory Utilization'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_memory(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1149,14 +1009,14 @@ def graph_gpu_memory(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     data = []
     for line in stats:
         gpu_id = display_gpu_id(line)
         gpu_type = line['metric']['gpu_type']
         compute_name = display_compute_name(stats, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         if context['multiple_jobs']:
             name = 'GPU {} {} {}'.format(line['metric']['slurmjobid'], gpu_id, compute_name)
@@ -1176,11 +1036,12 @@ def graph_gpu_memory(request, username, job_id):
             'title': _('GPU Memory'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_power(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1189,14 +1050,14 @@ def graph_gpu_power(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     data = []
     for line in stats:
         gpu_id = display_gpu_id(line)
         gpu_type = line['metric']['gpu_type']
         compute_name = display_compute_name(stats, line)
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         if context['multiple_jobs']:
             name = '{} GPU {} {} {}'.format(line['metric']['slurmjobid'], GPU_SHORT_NAME[gpu_type], gpu_id, compute_name)
@@ -1226,7 +1087,7 @@ def graph_gpu_power(request, username, job_id):
                 'title': _('GPU Power'),
             }
         }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
@@ -1276,11 +1137,12 @@ def graph_gpu_power_user(request, username):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_pcie(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1292,7 +1154,7 @@ def graph_gpu_pcie(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     for line in stats:
         gpu_id = display_gpu_id(line)
@@ -1301,8 +1163,8 @@ def graph_gpu_pcie(request, username, job_id):
         if direction == 'RX':
             y = line['y']
         else:
-            y = [-x for x in line['y']]
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+            y = -line['y']
+        x = plotly_timestamps(line['x'])
         if context['multiple_jobs']:
             name = '{} GPU {} {} {}'.format(line['metric']['slurmjobid'], direction, gpu_id, compute_name)
         else:
@@ -1321,11 +1183,12 @@ def graph_gpu_pcie(request, username, job_id):
             'title': _('Bandwidth'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_gpu_nvlink(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1337,7 +1200,7 @@ def graph_gpu_nvlink(request, username, job_id):
         query,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('slurm-job-exporter')))
+        step=max(context['step'], prom.rate('slurm-job-exporter')), columnar=True)
 
     for line in stats:
         gpu_id = display_gpu_id(line)
@@ -1346,8 +1209,8 @@ def graph_gpu_nvlink(request, username, job_id):
         if direction == 'RX':
             y = line['y']
         else:
-            y = [-x for x in line['y']]
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+            y = -line['y']
+        x = plotly_timestamps(line['x'])
         if context['multiple_jobs']:
             name = '{} GPU {} {} {}'.format(line['metric']['slurmjobid'], direction, gpu_id, compute_name)
         else:
@@ -1366,11 +1229,12 @@ def graph_gpu_nvlink(request, username, job_id):
             'title': _('Bandwidth'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_ethernet_bdw(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1411,11 +1275,12 @@ def graph_ethernet_bdw(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_infiniband_bdw(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1456,11 +1321,12 @@ def graph_infiniband_bdw(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_disk_iops(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1503,11 +1369,12 @@ def graph_disk_iops(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_disk_bdw(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1550,11 +1417,12 @@ def graph_disk_bdw(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_disk_used(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1592,11 +1460,12 @@ def graph_disk_used(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_mem_bdw(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1638,17 +1507,19 @@ def graph_mem_bdw(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_l2_rate(request, username, job_id):
     return graph_cache_rate(request, username, job_id, 'L2')
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_l3_rate(request, username, job_id):
     return graph_cache_rate(request, username, job_id, 'L3')
 
@@ -1704,7 +1575,7 @@ def map_pcm_cores(request, context):
     return used_mapping, reverse_mapping
 
 
-def filter_stats(stats, used_mapping, reverse_mapping):
+def filter_stats(request, stats, used_mapping, reverse_mapping):
     filtered_stats = []
     data = []
     for line in stats:
@@ -1713,12 +1584,16 @@ def filter_stats(stats, used_mapping, reverse_mapping):
         if phys_core in used_mapping[instance]:
             filtered_stats.append(line)
 
+    filtered_stats, bands = reduce_stats(request, filtered_stats)
+    if bands is not None:
+        return bands_traces(*bands)
+
     for line in filtered_stats:
         phys_core = (int(line['metric']['socket']), int(line['metric']['core']), int(line['metric']['thread']))
         compute_name = "Core {} {}".format(
             reverse_mapping[line['metric']['instance'].split(':')[0]][phys_core],
             display_compute_name(filtered_stats, line))
-        x = list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x']))
+        x = plotly_timestamps(line['x'])
         y = line['y']
         data.append({
             'x': x,
@@ -1748,10 +1623,10 @@ def graph_cache_rate(request, username, job_id, l_cache):
         query_cache,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('pcm-sensor-server')))
+        step=max(context['step'], prom.rate('pcm-sensor-server')), columnar=True)
 
     # from all the L3 cache hits and misses, keep only the ones used by the job
-    data = filter_stats(stats_cache, used_mapping, reverse_mapping)
+    data = filter_stats(request, stats_cache, used_mapping, reverse_mapping)
 
     layout = {
         'yaxis': {
@@ -1761,9 +1636,10 @@ def graph_cache_rate(request, username, job_id, l_cache):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
+@incremental_graph
 def graph_ipc(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1786,9 +1662,9 @@ def graph_ipc(request, username, job_id):
         query_ipc,
         context['start'],
         context['end'],
-        step=max(context['step'], prom.rate('pcm-sensor-server')))
+        step=max(context['step'], prom.rate('pcm-sensor-server')), columnar=True)
 
-    data = filter_stats(stats_ipc, used_mapping, reverse_mapping)
+    data = filter_stats(request, stats_ipc, used_mapping, reverse_mapping)
 
     layout = {
         'yaxis': {
@@ -1796,11 +1672,12 @@ def graph_ipc(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_cpu_interconnect(request, username, job_id):
     context = context_job_info(request, username, job_id)
     instances = instances_regex(context)
@@ -1839,11 +1716,11 @@ def graph_cpu_interconnect(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
 
 
 def power(job, step):
-    nodes = job.nodes()
+    nodes = job.nodes_regex()
     if job.gpu_count() > 0:
         # ( take the node power
         # - remove the power of all the GPUs in the compute)
@@ -1855,18 +1732,18 @@ def power(job, step):
 * ( label_replace(count(slurm_job_power_gpu{{slurmjobid="{jobid}", {filter}}} / 1000) by ({hostname_label}),"{hostname_label}", "$1", "{hostname_label}", "(.*):.*") / label_replace((count(nvidia_gpu_power_usage_milliwatts{{{hostname_label}=~"({nodes}):9445", {filter}}} / 1000) by ({hostname_label})), "{hostname_label}", "$1", "{hostname_label}", "(.*):.*") )\
 + ( label_replace(sum(slurm_job_power_gpu{{slurmjobid="{jobid}", {filter}}} / 1000) by ({hostname_label}),"{hostname_label}", "$1", "{hostname_label}", "(.*):.*") )'.format(
             hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-            nodes='|'.join(nodes),
+            nodes=nodes,
             filter=prom.get_filter(),
             jobid=job.id_job,
         )
     else:
         # ( take the node power)
         # * (the ratio of cpu cores allocated in that node)
-        nodes_node_exporter = '|'.join([s + '(:.*)?' for s in nodes])
+        nodes_node_exporter = '({})(:.*)?'.format(nodes)
         query = '(label_replace(sum(redfish_chassis_power_average_consumed_watts{{{hostname_label}=~"({nodes})-oob", {filter} }}) by ({hostname_label}), "{hostname_label}", "$1", "{hostname_label}", "(.*)-oob") ) \
             * ( label_replace(count(slurm_job_core_usage_total{{slurmjobid="{jobid}", {filter}}} / 1000) by ({hostname_label}),"{hostname_label}", "$1", "{hostname_label}", "(.*):.*") / label_replace((count(node_cpu_seconds_total{{{hostname_label}=~"({nodes_node_exporter})", mode="idle", {filter}}} / 1000) by ({hostname_label})), "{hostname_label}", "$1", "{hostname_label}", "(.*):.*") )'.format(
             hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-            nodes='|'.join(nodes),
+            nodes=nodes,
             filter=prom.get_filter(),
             jobid=job.id_job,
             nodes_node_exporter=nodes_node_exporter,
@@ -1876,6 +1753,7 @@ def power(job, step):
 
 @login_required
 @user_or_staff
+@incremental_graph
 def graph_power(request, username, job_id):
     context = context_job_info(request, username, job_id)
 
@@ -1899,7 +1777,99 @@ def graph_power(request, username, job_id):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+    return GraphResponse({'data': data, 'layout': layout, 'config': fixed_zoom_config()})
+
+
+def job_graphs(context):
+    """return the names of the graphs shown on the job page, in order"""
+    graphs = ['cpu', 'mem', 'thread']
+    if 'lustre_exporter' in settings.EXPORTER_INSTALLED:
+        graphs += ['lustre_mdt', 'lustre_ost']
+    if 'pcm-sensor-server' in settings.EXPORTER_INSTALLED:
+        graphs += ['l2_rate', 'l3_rate', 'ipc']
+    if context['gpu_count'] > 0:
+        graphs += ['gpu_utilization', 'gpu_memory_utilization', 'gpu_memory', 'gpu_power', 'gpu_pcie']
+        if context['gpu_count'] > 1:
+            graphs.append('gpu_nvlink')
+    if 'node_exporter' in settings.EXPORTER_INSTALLED and not context['multiple_jobs']:
+        graphs += ['infiniband_bdw', 'ethernet_bdw', 'disk_iops', 'disk_bdw', 'disk_used']
+        if 'pcm-sensor-server' in settings.EXPORTER_INSTALLED:
+            graphs += ['mem_bdw', 'cpu_interconnect']
+        if 'redfish_exporter' in settings.EXPORTER_INSTALLED:
+            graphs.append('power')
+    return graphs
+
+
+@login_required
+@user_or_staff
+def graph_bundle(request, username, job_id):
+    """
+    Return multiple graphs of a job in a single response, as {name: graph}
+
+    The job is resolved once and the graphs are computed concurrently, each graph is streamed as soon
+    as it is ready. The graphs can be selected with ?graphs=cpu,mem, by default all the graphs of the
+    job page are returned. A graph that failed is returned as null.
+    """
+    context = context_job_info(request, username, job_id)
+    request.job_context = context
+
+    if 'graphs' in request.GET:
+        names = [name for name in request.GET['graphs'].split(',') if name in BUNDLE_GRAPHS]
+    else:
+        names = job_graphs(context)
+    language = translation.get_language()
+
+    def render_graph(name):
+        try:
+            with translation.override(language):
+                response = BUNDLE_GRAPHS[name](request, username=username, job_id=job_id)
+            if response.status_code != 200:
+                logger.warning('Graph %s of job %s returned status %s', name, job_id, response.status_code)
+                return b'null'
+            return response.content
+        except Exception:
+            logger.exception('Graph %s of job %s failed', name, job_id)
+            return b'null'
+        finally:
+            # each worker thread opens its own database connections
+            connections.close_all()
+
+    def stream():
+        yield b'{'
+        if names:
+            with ThreadPoolExecutor(max_workers=min(len(names), prom.max_workers), thread_name_prefix='jobstats-bundle') as executor:
+                futures = {executor.submit(render_graph, name): name for name in names}
+                for i, future in enumerate(as_completed(futures)):
+                    yield '{}"{}":'.format(',' if i else '', futures[future]).encode() + future.result()
+        yield b'}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+
+BUNDLE_GRAPHS = {
+    'cpu': graph_cpu,
+    'mem': graph_mem,
+    'thread': graph_thread,
+    'lustre_mdt': graph_lustre_mdt,
+    'lustre_ost': graph_lustre_ost,
+    'gpu_utilization': graph_gpu_utilization,
+    'gpu_memory_utilization': graph_gpu_memory_utilization,
+    'gpu_memory': graph_gpu_memory,
+    'gpu_power': graph_gpu_power,
+    'gpu_pcie': graph_gpu_pcie,
+    'gpu_nvlink': graph_gpu_nvlink,
+    'ethernet_bdw': graph_ethernet_bdw,
+    'infiniband_bdw': graph_infiniband_bdw,
+    'disk_iops': graph_disk_iops,
+    'disk_bdw': graph_disk_bdw,
+    'disk_used': graph_disk_used,
+    'mem_bdw': graph_mem_bdw,
+    'l2_rate': graph_l2_rate,
+    'l3_rate': graph_l3_rate,
+    'cpu_interconnect': graph_cpu_interconnect,
+    'ipc': graph_ipc,
+    'power': graph_power,
+}
 
 
 @login_required
@@ -1953,19 +1923,80 @@ def value_cost(request, username, job_id):
     return JsonResponse(response)
 
 
+def live_queries(id_regex, gpu_count):
+    queries = {
+        'cpu': 'sum(rate(slurm_job_core_usage_total{{slurmjobid=~"{}", {}}}[{}s]) / 1000000000)'.format(id_regex, prom.get_filter(), prom.rate('slurm-job-exporter')),
+        'mem': 'sum(slurm_job_memory_usage{{slurmjobid=~"{}", {}}})/(1024*1024*1024)'.format(id_regex, prom.get_filter()),
+        'threads': 'sum(slurm_job_threads_count{{slurmjobid=~"{}", state="running", {}}})'.format(id_regex, prom.get_filter()),
+    }
+    if gpu_count > 0:
+        queries['gpu_util'] = 'sum(slurm_job_utilization_gpu{{slurmjobid=~"{}", {}}})'.format(id_regex, prom.get_filter())
+        queries['gpu_mem'] = 'sum(slurm_job_memory_usage_gpu{{slurmjobid=~"{}", {}}})/(1024*1024*1024)'.format(id_regex, prom.get_filter())
+        queries['gpu_power'] = 'sum(slurm_job_power_gpu{{slurmjobid=~"{}", {}}})/1000'.format(id_regex, prom.get_filter())
+    return {name: {'query': query} for name, query in queries.items()}
+
+
+@async_user_or_staff
+async def job_live(request, username, job_id):
+    # Server-Sent Events with the current usage of a running job, the viewers of a job share the same poller
+    context = await sync_to_async(context_job_info)(None, username, job_id)
+    queries = live_queries(context['id_regex'], context['gpu_count'])
+
+    def fetch():
+        return instant_values(prom.query_many(queries))
+
+    return event_stream(request, 'job:{}'.format(context['id_regex']), sampling_rate('slurm-job-exporter'), fetch)
+
+
 class JobScriptViewSet(viewsets.ModelViewSet):
-    queryset = JobScript.objects.all().order_by('-last_modified')
+    queryset = JobScript.objects.select_related('content').order_by('-last_modified')
     serializer_class = JobScriptSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Store a list of {id_job, submit_script} in one request, the existing jobs are left unchanged
+
+        return the status of each job: created, exists or invalid
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of job scripts'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > JOBSCRIPTS_BULK_MAX:
+            return Response({'detail': 'At most {} job scripts per request'.format(JOBSCRIPTS_BULK_MAX)}, status=status.HTTP_400_BAD_REQUEST)
+
+        scripts = {}
+        results = {}
+        for item in request.data:
+            serializer = JobScriptBulkSerializer(data=item)
+            if serializer.is_valid():
+                # the first script of a job wins, like with the existing jobs
+                scripts.setdefault(serializer.validated_data['id_job'], serializer.validated_data['submit_script'])
+            elif isinstance(item, dict) and 'id_job' in item:
+                results[str(item['id_job'])] = 'invalid'
+
+        for id_job, job_status in JobScript.bulk_store(scripts).items():
+            results[str(id_job)] = job_status
+        counts = {job_status: list(results.values()).count(job_status) for job_status in ['created', 'exists', 'invalid']}
+        return Response({'counts': counts, 'results': results})
+
 
 class JobsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = JobSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = JobsPagination
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            # resolve the usernames of the page at once, the serializer will then read them from the cache
+            uids_to_usernames([job.id_user for job in page])
+        return page
 
     def get_queryset(self):
         user = self.request.user
-        queryset = JobTable.objects.all().order_by('-time_start')
+        # only the columns used by JobSerializer, the submit line and the tres are not loaded
+        queryset = JobTable.objects.only(*JOBS_API_FIELDS).order_by('-time_start', '-job_db_inx')
 
         if self.request.query_params.get('status'):
             status = self.request.query_params.get('status').split(',')
@@ -1978,26 +2009,16 @@ class JobsViewSet(viewsets.ReadOnlyModelViewSet):
 
         if self.request.query_params.get('account'):
             account = self.request.query_params.get('account')
-            # jobtable is not indexed by account, so we need to get assocs for this account, that one is indexed
-            assocs = []
-            for assoc in AssocTable.objects.filter(acct=account):
-                assocs.append(assoc.id_assoc)
-            queryset = queryset.filter(id_assoc__in=assocs)
+            # jobtable is not indexed by account, so we filter on the assocs of this account in a subquery, that one is indexed
+            assocs = AssocTable.objects.filter(acct=account).values('id_assoc')
 
             if user.is_staff is False:
                 alloc_per_user = compute_allocations_by_user(user.get_username())
-                for alloc in alloc_per_user:
-                    if alloc['name'] == account:
-                        # The user is a member of the account
-                        queryset = queryset.filter(id_assoc__in=assocs)
-                        break
-                else:
+                if not any(alloc['name'] == account for alloc in alloc_per_user):
                     # The user is not a member of the account, block access
-                    queryset = JobTable.objects.none()
+                    return JobTable.objects.none()
 
-            else:
-                # The user is a staff member
-                queryset = queryset.filter(id_assoc__in=assocs)
+            queryset = queryset.filter(id_assoc__in=assocs)
 
         if user.is_staff:
             username = self.request.query_params.get('username')
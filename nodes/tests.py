@@ -1 +1,53 @@
-# Create your tests here.
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+from unittest import mock
+from tests.tests import CustomTestCase
+from nodes.views import node_state, node_window, nodes_trends, prom, NODE_WINDOW_MAX
+
+
+class NodesTestCase(CustomTestCase):
+    def test_node_state(self):
+        start = datetime.fromtimestamp(1700000000)
+        end = datetime.fromtimestamp(1700000000 + 1800)
+        x = 1700000000 + np.array([0, 180, 360, 900, 1080, 1260, 1800], dtype=np.int64)
+        stats = [
+            {'metric': {'state': 'drained'}, 'x': x[:3], 'y': np.ones(3)},
+            {'metric': {'state': 'down'}, 'x': x[3:], 'y': np.array([1, 1, 1, 1.0])},
+        ]
+        with mock.patch.object(prom, 'query_prometheus_multiple', return_value=stats) as query:
+            events = node_state('node1', start, end, step=180)
+        # a single query for all the states
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual([(e[0].timestamp() - 1700000000, e[1].timestamp() - 1700000000, e[2]) for e in events[:2]], [
+            (0, 540, 'drained'),
+            (900, 1440, 'down'),
+        ])
+        # the node is still down at the end of the window
+        self.assertEqual(events[2][0].timestamp() - 1700000000, 1800)
+        self.assertGreater(events[2][1], end)
+
+    def test_node_window(self):
+        now = datetime.now()
+        # the step of 31 days does not divide the window, any end time is bounded
+        for i in range(200):
+            end = now + timedelta(seconds=i * 37)
+            start, window_end, step = node_window(SimpleNamespace(start=end - timedelta(days=400), end=end))
+            # bounded and aligned on the step
+            self.assertLessEqual(window_end - start, NODE_WINDOW_MAX)
+            self.assertEqual(int(start.timestamp()) % step, 0)
+            self.assertEqual(int(window_end.timestamp()) % step, 0)
+            self.assertLessEqual(window_end, end)
+
+    def test_nodes_trends_query(self):
+        with mock.patch.object(prom, 'query_many', return_value={}) as query_many:
+            nodes_trends(['rack1-node01', 'rack1-node02', 'login.cluster'])
+        query = query_many.call_args[0][0]['cpu_used']['query']
+        # a valid string of PromQL, without the escape of - and with the escape of . doubled
+        self.assertIn('=~"(rack1-node0[1-2]|login\\\\.cluster)(:.*)"', query)
+
+    def test_nodes_index(self):
+        response = self.admin_client.get('/secure/nodes/?sort=-cpu_count')
+        self.assertEqual(response.status_code, 200)
+        response = self.user_client.get('/secure/nodes/')
+        self.assertEqual(response.status_code, 403)
@@ -18,4 +18,5 @@ urlpatterns = [
     path('<str:node>/graph_gpu_utilization.json', views.graph_gpu_utilization),
     path('<str:node>/graph_gpu_memory.json', views.graph_gpu_memory),
     path('<str:node>/graph_gpu_power.json', views.graph_gpu_power),
+    path('<str:node>/live', views.node_live),
 ]
@@ -2,156 +2,230 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
 from django.http import JsonResponse
-from userportal.common import staff, Prometheus, parse_start_end
+from userportal.common import staff, get_prometheus, parse_start_end, get_step, GraphResponse, plotly_timestamps, step_seconds
+from userportal.downsample import reduce_stats
+from userportal.live import event_stream, async_staff, sampling_rate, instant_values
 from userportal.common import anonymize as a
 from datetime import datetime, timedelta
 from django.utils.translation import gettext as _
 from jobstats.views import GPU_MEMORY, GPU_SHORT_NAME, GPU_IDLE_POWER, GPU_FULL_POWER
 from slurm.models import EventTable
-
-
-prom = Prometheus(settings.PROMETHEUS)
-START = datetime.now() - timedelta(days=2)
-END = datetime.now()
+from slurm.hostlist import promql_hostlist_regex
+from urllib.parse import urlencode
+from django.core.cache import cache
+import numpy as np
+
+
+prom = get_prometheus()
+
+# the node views show 2 days by default and at most NODE_WINDOW_MAX
+NODE_WINDOW_DEFAULT = timedelta(days=2)
+NODE_WINDOW_MAX = timedelta(days=31)
+
+# states shown in the gantt charts of a node
+NODE_STATES = ['down', 'drained', 'draining', 'fail']
+STATES_CACHE_TTL = 180
+
+# the hardware of the nodes is read once for all the nodes and kept this number of seconds
+INVENTORY_TTL = 3600
+# the hardware is read from the last sample of the nodes within this range
+INVENTORY_RANGE = '10m'
+# the list of the nodes with their state is kept this number of seconds
+NODE_LIST_TTL = 60
+NODES_PAGE_SIZE = 100
+# columns of the list of nodes that can be sorted
+NODES_SORT = ['name', 'state', 'cpu_count', 'mem_installed', 'disk_installed']
+
+
+def node_window(request):
+    """return the (start, end, step) of a request parsed by parse_start_end, at most NODE_WINDOW_MAX and aligned on the step"""
+    start = max(request.start, request.end - NODE_WINDOW_MAX)
+    step = get_step(start, request.end)
+    # the start is rounded up and the end down, the aligned window is not longer than the requested one
+    start_ts = -(-int(start.timestamp()) // step) * step
+    end_ts = int(request.end.timestamp()) // step * step
+    if start_ts >= end_ts:
+        start_ts = end_ts - step
+    return datetime.fromtimestamp(start_ts), datetime.fromtimestamp(end_ts), step
+
+
+def node_inventory():
+    """
+    return a dict of node: {'cpus', 'memory', 'disk'} for all the nodes, cached for INVENTORY_TTL seconds
+
+    The hardware comes from instant queries on the last sample of each series within INVENTORY_RANGE,
+    a few minutes of samples are read per series instead of a day. The nodes not scraped during this
+    range are unknown, their graphs use the autorange.
+    """
+    inventory = cache.get('nodes:inventory')
+    if inventory is not None:
+        return inventory
+    queries = {
+        'cpus': 'count(last_over_time(node_cpu_seconds_total{{mode="idle", {filter}}}[{range}])) by ({hostname_label})',
+        'memory': 'max(last_over_time(node_memory_MemTotal_bytes{{ {filter} }}[{range}])) by ({hostname_label})',
+        'disk': 'max(last_over_time(node_filesystem_size_bytes{{mountpoint="{localscratch}", {filter} }}[{range}])) by ({hostname_label})',
+    }
+    stats = prom.query_many({name: {'query': query.format(
+        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
+        localscratch=settings.LOCALSCRATCH,
+        range=INVENTORY_RANGE,
+        filter=prom.get_filter())} for name, query in queries.items()})
+    inventory = {}
+    for name, lines in stats.items():
+        for line in lines:
+            node_name = line['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
+            inventory.setdefault(node_name, {})[name] = int(float(line['value'][1]))
+    cache.set('nodes:inventory', inventory, INVENTORY_TTL)
+    return inventory
 
 
 def cpu_count(node):
-    # return the number of cpu cores on a node
-    query = 'count(node_cpu_seconds_total{{ {hostname_label}=~"{node}(:.*)", mode="idle", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        node=node,
-        filter=prom.get_filter())
-    stats = prom.query_prometheus_multiple(query, START, END, step="5m")
-    return int(max(stats[0]['y']))
+    # return the number of cpu cores on a node, None if the node is unknown
+    return node_inventory().get(node, {}).get('cpus')
 
 
 def memory(node):
-    query = 'node_memory_MemTotal_bytes{{ {hostname_label}=~"{node}(:.*)", {filter} }}'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        node=node,
-        filter=prom.get_filter())
-    stats = prom.query_prometheus_multiple(query, START, END, step="5m")
-    return int(max(stats[0]['y']))
+    # return the memory of a node in bytes, None if the node is unknown
+    return node_inventory().get(node, {}).get('memory')
 
 
-@login_required
-@staff
-def index(request):
-    context = {}
-    # slice of nodes to show in the table
-    start = int(request.GET.get('start', 0))
-    step = 100
-    end = int(request.GET.get('end', step))
+def yaxis_range(maximum, scale=1):
+    # the graphs of an unknown node use the autorange of plotly
+    if maximum is None:
+        return {}
+    return {'range': [0, maximum / scale]}
+
 
+def node_list():
+    """return the nodes known by Slurm, sorted by name, with their state and hardware, cached for NODE_LIST_TTL seconds"""
+    nodes = cache.get('nodes:list')
+    if nodes is not None:
+        return nodes
     query = 'slurm_node_state_info{{ {filter} }}'.format(
         filter=prom.get_filter()
     )
-    stats = prom.query_prometheus_multiple(query, datetime.now() - timedelta(minutes=10), datetime.now())
-    nodes = []
-    node_states = {}
-    for line in stats:
+    inventory = node_inventory()
+    nodes = {}
+    for line in prom.query_last(query):
         name = line['metric']['node']
-        nodes.append(name)
-        node_states[name] = {'state': line['metric']['state']}
-
-    # pagination
-    nodes = nodes[start:end]
-    node_stats = {}
-
-    query_cpu_count = 'count(node_cpu_seconds_total{{ {hostname_label}=~"({nodes})(:.*)", mode="idle", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        filter=prom.get_filter())
-
-    stats_cpu_count = prom.query_prometheus_multiple(query_cpu_count, datetime.now() - timedelta(hours=1), datetime.now(), step="5m")
-    for cpu in stats_cpu_count:
-        node_name = cpu['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name] = {
-            'name': node_name,
-            'cpu_count': max(cpu['y']),
-            'state': node_states[node_name]['state'],
+        hardware = inventory.get(name, {})
+        nodes[name] = {
+            'name': name,
+            'state': line['metric']['state'],
+            'cpu_count': hardware.get('cpus'),
+            'mem_installed': hardware.get('memory'),
+            'disk_installed': hardware.get('disk'),
         }
+    nodes = sorted(nodes.values(), key=lambda node: node['name'])
+    cache.set('nodes:list', nodes, NODE_LIST_TTL)
+    return nodes
+
+
+def nodes_trends(names):
+    """return the usage of the last hour of some nodes, with concurrent queries restricted to these nodes"""
+    queries = {
+        'cpu_used': 'sum(rate(node_cpu_seconds_total{{ {hostname_label}=~"({nodes})(:.*)", mode!="idle", {filter} }}[1m])) by ({hostname_label})',
+        'mem_used': 'max(node_memory_MemTotal_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
+            - node_memory_MemFree_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
+            - node_memory_Buffers_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
+            - node_memory_Cached_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }}) by ({hostname_label})',
+        'disk_used': 'max(node_filesystem_size_bytes{{ {hostname_label}=~"({nodes})(:.*)", mountpoint="{localscratch}", {filter} }} \
+            - node_filesystem_free_bytes{{ {hostname_label}=~"({nodes})(:.*)", mountpoint="{localscratch}", {filter} }}) by ({hostname_label})',
+    }
+    # a compact regex like cn(0[1-9]|[1-9][0-9]) instead of the nodes joined with |
+    nodes_regex = promql_hostlist_regex(','.join(names))
+    start = datetime.now() - timedelta(hours=1)
+    stats = prom.query_many({name: {
+        'query': query.format(
+            hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
+            nodes=nodes_regex,
+            localscratch=settings.LOCALSCRATCH,
+            filter=prom.get_filter()),
+        'start': start,
+        'step': '1m',
+        'columnar': True,
+    } for name, query in queries.items()})
+
+    trends = {}
+    for name, lines in stats.items():
+        for line in lines:
+            node_name = line['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
+            trends.setdefault(node_name, {})[name] = line['y'].tolist()
+            trends[node_name][name + '_avg'] = float(line['y'].mean()) if len(line['y']) > 0 else 0
+    return trends
 
-    query_cpu = 'sum(rate(node_cpu_seconds_total{{ {hostname_label}=~"({nodes})(:.*)", mode!="idle", {filter} }}[1m])) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        filter=prom.get_filter())
-    stats_cpu = prom.query_prometheus_multiple(query_cpu, datetime.now() - timedelta(hours=1), datetime.now(), step="1m")
-
-    for cpu in stats_cpu:
-        node_name = cpu['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name]['cpu_used'] = cpu['y']
-        node_stats[node_name]['cpu_used_avg'] = sum(cpu['y']) / len(cpu['y'])
-
-    query_memory_installed = 'max(node_memory_MemTotal_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        filter=prom.get_filter())
-    stats_memory_installed = prom.query_prometheus_multiple(query_memory_installed, datetime.now() - timedelta(hours=1), datetime.now(), step="10m")
-    for memory in stats_memory_installed:
-        node_name = memory['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name]['mem_installed'] = max(memory['y'])
-
-    query_memory_used = 'max(node_memory_MemTotal_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
-        - node_memory_MemFree_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
-        - node_memory_Buffers_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }} \
-        - node_memory_Cached_bytes{{ {hostname_label}=~"({nodes})(:.*)", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        filter=prom.get_filter())
 
-    stats_memory_used = prom.query_prometheus_multiple(query_memory_used, datetime.now() - timedelta(hours=1), datetime.now(), step="1m")
-    for memory in stats_memory_used:
-        node_name = memory['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name]['mem_used'] = memory['y']
-        node_stats[node_name]['mem_used_avg'] = sum(memory['y']) / len(memory['y'])
+@login_required
+@staff
+def index(request):
+    context = {}
+    nodes = node_list()
+    context['states'] = sorted(set(node['state'] for node in nodes))
+
+    # filters and sorting, kept in the links to the other pages
+    filters = {
+        'name': request.GET.get('name', ''),
+        'state': request.GET.get('state', ''),
+        'sort': request.GET.get('sort', 'name'),
+    }
+    if filters['name']:
+        nodes = [node for node in nodes if filters['name'] in node['name']]
+    if filters['state']:
+        nodes = [node for node in nodes if node['state'] == filters['state']]
+    field = filters['sort'].lstrip('-')
+    if field in NODES_SORT:
+        # the nodes without a value are last
+        known = [node for node in nodes if node[field] is not None]
+        unknown = [node for node in nodes if node[field] is None]
+        nodes = sorted(known, key=lambda node: node[field], reverse=filters['sort'].startswith('-')) + unknown
 
-    query_disk_installed = 'max(node_filesystem_size_bytes{{ {hostname_label}=~"({nodes})(:.*)", mountpoint="{localscratch}", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        localscratch=settings.LOCALSCRATCH,
-        filter=prom.get_filter())
-    stats_disk_installed = prom.query_prometheus_multiple(query_disk_installed, datetime.now() - timedelta(hours=1), datetime.now(), step="10m")
-    for disk in stats_disk_installed:
-        node_name = disk['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name]['disk_installed'] = max(disk['y'])
+    # slice of nodes to show in the table
+    try:
+        start = max(int(request.GET.get('start', 0)), 0)
+    except ValueError:
+        start = 0
+    page = nodes[start:start + NODES_PAGE_SIZE]
 
-    query_disk_used = 'max(node_filesystem_size_bytes{{ {hostname_label}=~"({nodes})(:.*)", mountpoint="{localscratch}", {filter} }} \
-        - node_filesystem_free_bytes{{ {hostname_label}=~"({nodes})(:.*)", mountpoint="{localscratch}", {filter} }}) by ({hostname_label})'.format(
-        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-        nodes='|'.join(nodes),
-        localscratch=settings.LOCALSCRATCH,
-        filter=prom.get_filter())
-    stats_disk_used = prom.query_prometheus_multiple(query_disk_used, datetime.now() - timedelta(hours=1), datetime.now(), step="1m")
-    for disk in stats_disk_used:
-        node_name = disk['metric'][settings.PROM_NODE_HOSTNAME_LABEL].split(':')[0]
-        node_stats[node_name]['disk_used'] = disk['y']
-        node_stats[node_name]['disk_used_avg'] = sum(disk['y']) / len(disk['y'])
+    node_stats = {node['name']: dict(node) for node in page}
+    if len(node_stats) > 0:
+        for node_name, trend in nodes_trends(list(node_stats)).items():
+            if node_name in node_stats:
+                node_stats[node_name].update(trend)
 
     context['node_stats'] = list(node_stats.values())
-    context['next_start'] = end
-    context['next_end'] = end + step
+    context['filters'] = filters
+    context['query_string'] = urlencode(filters)
+    context['count'] = len(nodes)
+    context['first'] = start + 1
+    context['last'] = start + len(page)
+    context['next_start'] = start + NODES_PAGE_SIZE if start + NODES_PAGE_SIZE < len(nodes) else None
+    context['previous_start'] = max(start - NODES_PAGE_SIZE, 0) if start > 0 else None
 
     return render(request, 'nodes/index.html', context)
 
 
 @login_required
 @staff
+@parse_start_end(timedelta_start=NODE_WINDOW_DEFAULT)
 def node(request, node):
     context = {}
     context['node'] = node
+    window_start, window_end, step = node_window(request)
 
     query_gpu = 'count(slurm_job_utilization_gpu{{{hostname_label}=~"{node}(:.*)", {filter}}})'.format(
         hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
         node=node,
         filter=prom.get_filter())
-    stats_gpu = prom.query_prometheus_multiple(query_gpu, START, END)
+    stats_gpu = prom.query_prometheus_multiple(query_gpu, window_start, window_end, step=step)
     context['gpu'] = len(stats_gpu) > 0
 
+    # fetched once for the CPU and GPU gantt charts requested by the page
+    cached_node_state(node, window_start, window_end, step)
+
     context['node_events'] = []
     try:
-        start = START.timestamp()
-        end = END.timestamp()
+        start = window_start.timestamp()
+        end = window_end.timestamp()
 
         started = EventTable.objects\
             .filter(node_name=node)\
@@ -170,7 +244,7 @@ def node(request, node):
     return render(request, 'nodes/node.html', context)
 
 
-def node_gantt(node, gpu=False):
+def node_gantt(node, start, end, step, gpu=False):
     if gpu:
         query_alloc = 'count(slurm_job_utilization_gpu{{{hostname_label}=~"{node}(:.*)", {filter}}})'.format(
             hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
@@ -182,29 +256,29 @@ def node_gantt(node, gpu=False):
             filter=prom.get_filter())
         unit = 'gpu'
     else:
-        query_alloc = 'count(node_cpu_seconds_total{{{hostname_label}=~"{node}(:.*)", mode="idle", {filter}}})'.format(
-            hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
-            node=node,
-            filter=prom.get_filter())
+        query_alloc = None
         query_used = 'count(slurm_job_core_usage_total{{{hostname_label}=~"{node}(:.*)", {filter}}}) by (account,user,slurmjobid)'.format(
             hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
             node=node,
             filter=prom.get_filter())
         unit = 'cores'
 
-    stats_alloc = prom.query_prometheus_multiple(query_alloc, START, END)
-
-    node_alloc = max(stats_alloc[0]['y'])
-    stats_used = prom.query_prometheus_multiple(query_used, START, END)
+    if query_alloc is None:
+        node_alloc = cpu_count(node)
+    else:
+        stats_alloc = prom.query_prometheus_multiple(query_alloc, start, end, step=step)
+        node_alloc = max(stats_alloc[0]['y'])
+    stats_used = prom.query_prometheus_multiple(query_used, start, end, step=step)
+    states = cached_node_state(node, start, end, step)
 
     users = {}
     for line in stats_used:
-        start = min(line['x'])
-        end = max(line['x'])
+        job_start = min(line['x'])
+        job_end = max(line['x'])
         cores = line['y'][0]
         user = a(line['metric']['user'])
         jobid = line['metric']['slurmjobid']
-        if start == end:
+        if job_start == job_end:
             # skip short jobs
             continue
 
@@ -214,7 +288,7 @@ def node_gantt(node, gpu=False):
         users[user].append({
             'label': '{jobid}'.format(jobid=jobid),
             'data': [{
-                'timeRange': [start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')],
+                'timeRange': [job_start.strftime('%Y-%m-%d %H:%M:%S'), job_end.strftime('%Y-%m-%d %H:%M:%S')],
                 'val': cores,
             }],
         })
@@ -222,7 +296,7 @@ def node_gantt(node, gpu=False):
     groups = []
     events = []
     count = 0
-    for event in node_state(node):
+    for event in states:
         events.append({
             'label': '{} {}'.format(event[2], count),
             'data': [{
@@ -251,52 +325,59 @@ def node_gantt(node, gpu=False):
 
 @login_required
 @staff
+@parse_start_end(timedelta_start=NODE_WINDOW_DEFAULT)
 def node_gantt_cpu(request, node):
-    return node_gantt(node, gpu=False)
+    return node_gantt(node, *node_window(request), gpu=False)
 
 
 @login_required
 @staff
+@parse_start_end(timedelta_start=NODE_WINDOW_DEFAULT)
 def node_gantt_gpu(request, node):
-    return node_gantt(node, gpu=True)
+    return node_gantt(node, *node_window(request), gpu=True)
 
 
-def node_state(node):
+def node_state(node, start, end, step):
+    """
+    return the (start, end, state) periods of a node in one of NODE_STATES between start and end
+
+    All the states come from a single query, a period is a run of consecutive samples of a state,
+    found with numpy on the timestamps of its series.
+    """
+    query = 'count(slurm_node_state_info{{node="{node}", state=~"{states}", {filter}}}) by (state)'.format(
+        node=node,
+        states='|'.join(NODE_STATES),
+        filter=prom.get_filter())
+    stats = prom.query_prometheus_multiple(query, start, end, step=step, columnar=True)
+    step_s = step_seconds(step)
     events = []
-    for state in ['down', 'drained', 'draining', 'fail']:
-        query = 'count(slurm_node_state_info{{node="{node}", state=~"{state}", {filter}}}) or on() vector(0)'.format(
-            node=node,
-            state=state,
-            filter=prom.get_filter())
-        stats = prom.query_prometheus_multiple(query, START, END)
-        for line in stats:
-            # zip together the x and y values
-            data = list(zip(line['x'], line['y']))
-            # only trigger a event if the state moves from 0 to 1
-            trigger = False
-            starts = []
-            ends = []
-            for item in data:
-                if int(item[1]) == 1:
-                    if trigger:
-                        # already triggered
-                        continue
-                    else:
-                        # up transition
-                        trigger = True
-                        starts.append(item[0])
-                else:
-                    if trigger:
-                        # down transition
-                        ends.append(item[0])
-                        trigger = False
-            if len(starts) > len(ends):
-                # still in state
-                ends.append(datetime.now())
-            # zip together the start and end times
-            if len(starts) > 0:
-                for event in list(zip(starts, ends, [state] * len(starts))):
-                    events.append(event)
+    for line in stats:
+        x = line['x'][line['y'] >= 1]
+        if len(x) == 0:
+            continue
+        # a gap of more than one step ends a period, it ends on the first sample without the state
+        breaks = np.flatnonzero(np.diff(x) > step_s)
+        starts = np.concatenate(([x[0]], x[breaks + 1]))
+        ends = np.concatenate((x[breaks] + step_s, [x[-1] + step_s]))
+        if x[-1] + step_s > end.timestamp():
+            # still in state
+            ends[-1] = int(datetime.now().timestamp())
+        for period_start, period_end in zip(starts, ends):
+            events.append((datetime.fromtimestamp(int(period_start)), datetime.fromtimestamp(int(period_end)), line['metric']['state']))
+    return sorted(events)
+
+
+def cached_node_state(node, start, end, step):
+    """
+    return node_state() through the cache, per node and window
+
+    The windows are aligned on the step by node_window(), the node page and its CPU and GPU gantt charts share the same result.
+    """
+    key = 'nodes:states:{}:{}:{}:{}'.format(node, int(start.timestamp()), int(end.timestamp()), step)
+    events = cache.get(key)
+    if events is None:
+        events = node_state(node, start, end, step)
+        cache.set(key, events, STATES_CACHE_TTL)
     return events
 
 
@@ -327,7 +408,7 @@ def graph_disk_used(request, node):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -339,12 +420,13 @@ def graph_cpu_jobstats(request, node):
         node=node,
         filter=prom.get_filter(),
         step=prom.rate('slurm-job-exporter'))
-    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step)
+    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step, columnar=True)
+    stats = reduce_stats(request, stats, bands=False)[0]
 
     data = []
     for line in stats:
         data.append({
-            'x': list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x'])),
+            'x': plotly_timestamps(line['x']),
             'y': line['y'],
             'type': 'scatter',
             'name': '{} {}'.format(a(line['metric']['user']), line['metric']['slurmjobid']),
@@ -354,11 +436,11 @@ def graph_cpu_jobstats(request, node):
     layout = {
         'yaxis': {
             'title': _('Cores'),
-            'range': [0, cpu_count(node)],
+            **yaxis_range(cpu_count(node)),
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -386,11 +468,11 @@ def graph_cpu_node(request, node):
     layout = {
         'yaxis': {
             'title': _('Cores'),
-            'range': [0, cpu_count(node)],
+            **yaxis_range(cpu_count(node)),
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -401,12 +483,13 @@ def graph_memory_jobstats(request, node):
         hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
         node=node,
         filter=prom.get_filter())
-    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step)
+    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step, columnar=True)
+    stats = reduce_stats(request, stats, bands=False)[0]
 
     data = []
     for line in stats:
         data.append({
-            'x': list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x'])),
+            'x': plotly_timestamps(line['x']),
             'y': line['y'],
             'type': 'scatter',
             'name': '{} {}'.format(a(line['metric']['user']), line['metric']['slurmjobid']),
@@ -417,11 +500,11 @@ def graph_memory_jobstats(request, node):
         'yaxis': {
             'title': _('Memory'),
             'ticksuffix': 'GiB',
-            'range': [0, memory(node) / (1024 * 1024 * 1024)],
+            **yaxis_range(memory(node), 1024 * 1024 * 1024),
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -471,11 +554,11 @@ def graph_memory_node(request, node):
         'yaxis': {
             'title': _('Memory'),
             'ticksuffix': 'GiB',
-            'range': [0, memory(node) / (1024 * 1024 * 1024)],
+            **yaxis_range(memory(node), 1024 * 1024 * 1024),
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -512,7 +595,7 @@ def graph_ethernet_bdw(request, node):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -548,7 +631,7 @@ def graph_infiniband_bdw(request, node):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -584,7 +667,7 @@ def graph_disk_iops(request, node):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -620,7 +703,7 @@ def graph_disk_bdw(request, node):
         }
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -643,7 +726,8 @@ def graph_gpu_utilization(request, node):
             hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
             node=node,
             filter=prom.get_filter())
-        stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step)
+        stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step, columnar=True)
+        stats = reduce_stats(request, stats, bands=False)[0]
 
         for line in stats:
             name = '{t} {user} {jobid} GPU {gpuid}'.format(
@@ -652,7 +736,7 @@ def graph_gpu_utilization(request, node):
                 jobid=line['metric']['slurmjobid'],
                 gpuid=line['metric']['gpu'])
             data.append({
-                'x': list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x'])),
+                'x': plotly_timestamps(line['x']),
                 'y': line['y'],
                 'type': 'scatter',
                 'name': name,
@@ -665,7 +749,7 @@ def graph_gpu_utilization(request, node):
             'title': _('GPU Utilization'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -676,7 +760,8 @@ def graph_gpu_memory(request, node):
         hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
         node=node,
         filter=prom.get_filter())
-    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step)
+    stats = prom.query_prometheus_multiple(query, request.start, request.end, step=request.step, columnar=True)
+    stats = reduce_stats(request, stats, bands=False)[0]
 
     data = []
     for line in stats:
@@ -685,7 +770,7 @@ def graph_gpu_memory(request, node):
             jobid=line['metric']['slurmjobid'],
             gpuid=line['metric']['gpu'])
         data.append({
-            'x': list(map(lambda x: x.strftime('%Y-%m-%d %H:%M:%S'), line['x'])),
+            'x': plotly_timestamps(line['x']),
             'y': line['y'],
             'type': 'scatter',
             'name': name,
@@ -698,7 +783,7 @@ def graph_gpu_memory(request, node):
             'title': _('GPU Memory'),
         }
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -744,4 +829,31 @@ def graph_gpu_power(request, node):
                 'title': _('GPU Power'),
             }
         }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
+
+
+def live_queries(node):
+    queries = {
+        'cpu': 'sum(irate(node_cpu_seconds_total{{mode!="idle",{hostname_label}=~"{node}(:.*)",{filter}}}[{rate}s]))',
+        'mem': '(node_memory_MemTotal_bytes{{{hostname_label}=~"{node}(:.*)",{filter}}} - node_memory_MemAvailable_bytes{{{hostname_label}=~"{node}(:.*)",{filter}}})/(1024*1024*1024)',
+        'load': 'node_load1{{{hostname_label}=~"{node}(:.*)",{filter}}}',
+        'gpu_util': 'sum(slurm_job_utilization_gpu{{{hostname_label}=~"{node}(:.*)", {filter}}})',
+        'gpu_mem': 'sum(slurm_job_memory_usage_gpu{{{hostname_label}=~"{node}(:.*)", {filter}}})/(1024*1024*1024)',
+        'gpu_power': 'sum(slurm_job_power_gpu{{{hostname_label}=~"{node}(:.*)", {filter}}})/1000',
+    }
+    return {name: {'query': query.format(
+        hostname_label=settings.PROM_NODE_HOSTNAME_LABEL,
+        node=node,
+        filter=prom.get_filter(),
+        rate=prom.rate('node_exporter'))} for name, query in queries.items()}
+
+
+@async_staff
+async def node_live(request, node):
+    # Server-Sent Events with the current usage of a node, the viewers of a node share the same poller
+    queries = live_queries(node)
+
+    def fetch():
+        return instant_values(prom.query_many(queries))
+
+    return event_stream(request, 'node:{}'.format(node), sampling_rate('node_exporter'), fetch)
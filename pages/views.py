@@ -1,13 +1,13 @@
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.conf import settings
-from userportal.common import Prometheus, parse_start_end
+from userportal.common import get_prometheus, parse_start_end, GraphResponse
 from django.utils.translation import gettext as _
 from datetime import datetime, timedelta
 import statistics
 import re
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 def index(request):
@@ -82,7 +82,7 @@ def graph_lustre_mdt(request, fs):
         },
         'height': 300,
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @parse_start_end(minimum=prom.rate('lustre_exporter'))
@@ -132,7 +132,7 @@ def graph_lustre_ost(request, fs):
         },
         'height': 300,
     }
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @parse_start_end(minimum=prom.rate('node_exporter'))
@@ -193,7 +193,7 @@ def graph_login_cpu(request, login):
         'height': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @parse_start_end(minimum=prom.rate('node_exporter'))
@@ -247,7 +247,7 @@ def graph_login_memory(request, login):
         'height': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @parse_start_end(minimum=prom.rate('node_exporter'))
@@ -288,7 +288,7 @@ def graph_login_load(request, login):
         'height': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 def graph_login_network(request, login):
@@ -374,7 +374,7 @@ def graph_network(request, node, device):
         'height': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 def graph_scheduler_cpu(request):
@@ -493,7 +493,7 @@ def graph_scheduler_cpu_gpu(request, res_type='cpu'):
     else:
         layout['yaxis']['title'] = _('Cores')
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 def graph_software_processes(request):
@@ -7,9 +7,9 @@ from django.utils.translation import gettext as _
 
 from userportal.common import user_or_staff, query_time, staff
 from ccldap.models import LdapUser, LdapAllocation
-from userportal.common import Prometheus
+from userportal.common import get_prometheus
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 @login_required
@@ -7,4 +7,9 @@ set -o nounset
 cp /secrets/settings/99-local.py /opt/userportal/userportal/settings/99-local.py
 mkdir -p /var/www/api/static
 cp -r /opt/userportal/collected-static/* /var/www/api/static/
-/opt/userportal-env/bin/gunicorn --bind :8000 --workers $WORKERS --threads $THREADS --timeout 90 userportal.wsgi
+if [ "${ASGI:-0}" = "1" ]; then
+    # async workers, needed by the live streams of the running jobs and nodes
+    /opt/userportal-env/bin/gunicorn --bind :8000 --workers $WORKERS --timeout 90 -k uvicorn.workers.UvicornWorker userportal.asgi
+else
+    /opt/userportal-env/bin/gunicorn --bind :8000 --workers $WORKERS --threads $THREADS --timeout 90 userportal.wsgi
+fi
@@ -8,9 +8,9 @@ from django.utils.translation import gettext as _
 from userportal.common import staff
 from ccldap.models import LdapCCAccount, LdapAllocation
 from slurm.models import AcctTable
-from userportal.common import Prometheus
+from userportal.common import get_prometheus
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 @login_required
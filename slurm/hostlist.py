@@ -0,0 +1,166 @@
+"""
+Slurm hostlist expressions, like 'cn[001-003,010],gpu[1-2]' or 'rack[1-2]-node[01-04]'
+"""
+import functools
+import itertools
+import re
+
+RE_NUMBERED_HOST = re.compile(r'^(.*?)(\d+)$')
+# re.escape also escapes - and ., these escapes are not valid in the strings of PromQL
+REGEX_SPECIAL = set('\\.^$*+?()[]{}|')
+
+
+def split_hostlist(hostlist):
+    """split a hostlist on the commas outside of the brackets"""
+    parts = []
+    depth = 0
+    current = ''
+    for char in hostlist:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def expand_ranges(ranges):
+    """expand the content of a bracket, like '001-003,010', keeping the zero padding"""
+    values = []
+    for component in ranges.split(','):
+        first, sep, last = component.partition('-')
+        if sep:
+            width = len(first)
+            values += ['{:0{}d}'.format(i, width) for i in range(int(first), int(last) + 1)]
+        else:
+            values.append(first)
+    return values
+
+
+@functools.lru_cache(maxsize=4096)
+def expand_hostlist(hostlist):
+    """return a tuple of the hosts of a hostlist, each bracket of a host is expanded as a cartesian product"""
+    if hostlist.count('[') != hostlist.count(']'):
+        raise ValueError("Incomplete nodelist: {}".format(hostlist))
+    hosts = []
+    for part in split_hostlist(hostlist):
+        # alternate the literal parts and the content of the brackets
+        pieces = re.split(r'\[([^\]]*)\]', part)
+        choices = [[piece] if i % 2 == 0 else expand_ranges(piece) for i, piece in enumerate(pieces)]
+        hosts += [''.join(product) for product in itertools.product(*choices)]
+    return tuple(hosts)
+
+
+def group_hosts(hosts):
+    """
+    group the hosts by prefix and width of their trailing number
+
+    return a list of (prefix, width, sorted numbers), a host without a trailing number has a width of 0
+    """
+    groups = {}
+    for host in hosts:
+        match = RE_NUMBERED_HOST.match(host)
+        if match is None:
+            groups.setdefault((host, 0), set())
+        else:
+            groups.setdefault((match.group(1), len(match.group(2))), set()).add(int(match.group(2)))
+    return [(prefix, width, sorted(numbers)) for (prefix, width), numbers in groups.items()]
+
+
+def consecutive_ranges(numbers):
+    """return the (first, last) ranges of consecutive sorted numbers"""
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return [tuple(r) for r in ranges]
+
+
+def compress_hostlist(hosts):
+    """return the hostlist of a list of hosts, like 'cn[001-003,010]'"""
+    parts = []
+    for prefix, width, numbers in group_hosts(hosts):
+        if width == 0:
+            parts.append(prefix)
+            continue
+        ranges = []
+        for first, last in consecutive_ranges(numbers):
+            if first == last:
+                ranges.append('{:0{}d}'.format(first, width))
+            else:
+                ranges.append('{:0{}d}-{:0{}d}'.format(first, width, last, width))
+        if len(numbers) == 1:
+            parts.append(prefix + ranges[0])
+        else:
+            parts.append('{}[{}]'.format(prefix, ','.join(ranges)))
+    return ','.join(parts)
+
+
+def digits_regex(low, high):
+    """return a regex matching the digit strings between low and high, both of the same length"""
+    if low == high:
+        return [low]
+    if len(low) == 1:
+        return ['[{}-{}]'.format(low, high)]
+    if low[0] == high[0]:
+        return [low[0] + pattern for pattern in digits_regex(low[1:], high[1:])]
+
+    rest = len(low) - 1
+    any_digits = '[0-9]' if rest == 1 else '[0-9]{{{}}}'.format(rest)
+    patterns = []
+    first, last = int(low[0]), int(high[0])
+    if low[1:] != '0' * rest:
+        patterns += [low[0] + pattern for pattern in digits_regex(low[1:], '9' * rest)]
+        first += 1
+    if high[1:] != '9' * rest:
+        last -= 1
+    if first == last:
+        patterns.append(str(first) + any_digits)
+    elif first < last:
+        patterns.append('[{}-{}]'.format(first, last) + any_digits)
+    if high[1:] != '9' * rest:
+        patterns += [high[0] + pattern for pattern in digits_regex('0' * rest, high[1:])]
+    return patterns
+
+
+def escape_regex(text):
+    """escape only the metacharacters of a regex"""
+    return ''.join('\\' + char if char in REGEX_SPECIAL else char for char in text)
+
+
+@functools.lru_cache(maxsize=4096)
+def hostlist_regex(hostlist):
+    """
+    return a compact regex matching the hosts of a hostlist, for a Prometheus label matcher
+
+    'cn[01-12]' returns 'cn(0[1-9]|1[0-2])' instead of the 12 hosts joined with |
+    """
+    parts = []
+    for prefix, width, numbers in group_hosts(expand_hostlist(hostlist)):
+        if width == 0:
+            parts.append(escape_regex(prefix))
+            continue
+        patterns = []
+        for first, last in consecutive_ranges(numbers):
+            patterns += digits_regex('{:0{}d}'.format(first, width), '{:0{}d}'.format(last, width))
+        if len(patterns) == 1:
+            parts.append(escape_regex(prefix) + patterns[0])
+        else:
+            parts.append('{}({})'.format(escape_regex(prefix), '|'.join(patterns)))
+    return '|'.join(parts)
+
+
+def promql_hostlist_regex(hostlist):
+    """
+    return hostlist_regex() escaped for a double-quoted string of PromQL, like {instance=~"..."}
+
+    'login.cluster' returns 'login\\\\.cluster', read as the regex login\\.cluster by Prometheus
+    """
+    return hostlist_regex(hostlist).replace('\\', '\\\\').replace('"', '\\"')
@@ -6,36 +6,24 @@
 #   * Remove `managed = False` lines if you wish to allow Django to create, modify, and delete the table
 # Feel free to rename the models, but don't rename db_table values or field names.
 from django.db import models
+from collections import namedtuple
 import datetime
 from django.conf import settings
 import re
 import time
 from userportal.common import uid_to_username
+from slurm.hostlist import expand_hostlist, promql_hostlist_regex
+from slurm.tres import tres_info, tres_totals
 
 # regex to parse dependencies from the submit line
 RE_DEPS = re.compile(r'(--depend=|--dependency=|-d )(afterok|afterany|afterburstbuffer|aftercorr|afternotok|after):([:\d]+)')
 
 
-# from https://github.com/NERSC/slurm-helpers/blob/master/slurm_utils.py
 def expand_nodelist(nlist: str, as_list=False) -> str:
-    """ translate a nodelist like 'nid[02516-02575,02580-02635,02836]' into a
+    """ translate a nodelist like 'nid[02516-02575,02580-02635,02836],gpu[1-2]' into a
         list of explicitly-named nodes, eg 'nid02516 nid02517 ...'
     """
-    nodes = []
-    if nlist.count('[') != nlist.count(']'):
-        raise Exception("Incomplete nodelist: {}".format(nlist))
-    prefix, sep0, nl = nlist.partition('[')
-    if sep0:
-        for component in nl.rstrip(']').split(','):
-            first, sep1, last = component.partition('-')
-            width = '0{:d}'.format(len(first))
-            if sep1:
-                nodes += ['{0:s}{2:{1:s}d}'.format(prefix, width, i)
-                          for i in range(int(first), int(last) + 1)]
-            else:
-                nodes += ['{0:s}{2:{1:s}d}'.format(prefix, width, int(first))]
-    else:
-        nodes += [prefix]
+    nodes = list(expand_hostlist(nlist))
     if as_list:
         return nodes
     else:
@@ -184,6 +172,26 @@ class EventTable(models.Model):
         return self.time_end_dt() - self.time_start_dt()
 
 
+# resources of a set of jobs, mem is in bytes
+ResourcesSummary = namedtuple('ResourcesSummary', ['jobs', 'cores', 'mem', 'gpus'])
+
+
+class JobTableQuerySet(models.QuerySet):
+    def resources_summary(self):
+        """
+        return a ResourcesSummary of the jobs, like JobTable.objects.filter(id_user=uid, state=1).resources_summary()
+
+        Only the TRES columns are read and no model instance is created
+        """
+        rows = list(self.values_list('tres_req', 'tres_alloc', 'mem_req'))
+        totals = tres_totals(rows)
+        return ResourcesSummary(
+            jobs=len(rows),
+            cores=totals['total_cores'],
+            mem=totals['total_mem'] * 1024 * 1024,
+            gpus=totals['gpus'])
+
+
 class JobTable(models.Model):
     class StatesJob(models.IntegerChoices):
         PENDING = 0
@@ -248,6 +256,8 @@ class JobTable(models.Model):
     tres_req = models.TextField()
     submit_line = models.TextField(blank=True, null=True)
 
+    objects = JobTableQuerySet.as_manager()
+
     class Meta:
         managed = False
         db_table = settings.CLUSTER_NAME + '_job_table'
@@ -323,17 +333,10 @@ class JobTable(models.Model):
         return '{}'.format(status[self.state])
 
     def gpu_count(self):
-        gpu_match = re.match(r'.*1001=(\d+)', self.tres_alloc)
-        if gpu_match:
-            return int(gpu_match.group(1))
-        else:
-            return 0
+        return self.tres_info()['gpus']
 
     def gpu_type(self):
-        for key in settings.SLURM_TRES:
-            if key in self.tres_alloc:
-                return settings.SLURM_TRES[key]
-        return None
+        return self.tres_info()['gpu_type']
 
     def wallclock_progress(self):
         if self.time_start == 0:
@@ -344,26 +347,23 @@ class JobTable(models.Model):
             delta = datetime.datetime.now() - self.time_start_dt()
             return (delta.total_seconds() / (self.timelimit * 60)) * 100
 
+    def tres_info(self):
+        # parsed once per instance, see slurm.tres.tres_info
+        if getattr(self, '_tres_info', None) is None:
+            self._tres_info = tres_info(self.tres_req, self.tres_alloc, self.mem_req)
+        return self._tres_info
+
     def parse_tres_req(self):
-        info = {}
-        for item in self.tres_req.split(','):
-            key, value = item.split('=')
-            if key == '1':
-                info['total_cores'] = int(value)
-            elif key == '2':
-                info['total_mem'] = int(value)
-            elif key == '4':
-                info['nb_nodes'] = int(value)
-
-        # Sometime the total_mem is not in TRES, so we use the other column
-        # in the DB
-        if 'total_mem' not in info:
-            info['total_mem'] = self.mem_req
-        return info
+        info = self.tres_info()
+        return {key: info[key] for key in ['total_cores', 'total_mem', 'nb_nodes'] if key in info}
 
     def nodes(self):
         return expand_nodelist(self.nodelist, as_list=True)
 
+    def nodes_regex(self):
+        # compact regex matching the nodes of the job, like cn(0[1-9]|1[0-2]), for the label matchers of PromQL
+        return promql_hostlist_regex(self.nodelist)
+
     def username(self):
         # convert user id to username from ldap database
         return uid_to_username(self.id_user)
@@ -1,3 +1,57 @@
-# from django.test import TestCase
+import re
+from django.test import SimpleTestCase
+from slurm.hostlist import expand_hostlist, compress_hostlist, hostlist_regex, promql_hostlist_regex
+from slurm.models import expand_nodelist, JobTable
+from slurm.tres import parse_tres, tres_totals
 
-# Create your tests here.
+
+class HostlistTestCase(SimpleTestCase):
+    def test_expand(self):
+        self.assertEqual(expand_nodelist('nid[02516-02518,02836]'), 'nid02516 nid02517 nid02518 nid02836')
+        self.assertEqual(expand_nodelist('cn[1-3],gpu[4-5]', as_list=True), ['cn1', 'cn2', 'cn3', 'gpu4', 'gpu5'])
+        self.assertEqual(expand_nodelist('node1', as_list=True), ['node1'])
+        self.assertEqual(
+            expand_hostlist('rack[1-2]-node[01-02]'),
+            ('rack1-node01', 'rack1-node02', 'rack2-node01', 'rack2-node02'))
+        with self.assertRaises(ValueError):
+            expand_hostlist('cn[1-3')
+
+    def test_compress(self):
+        hosts = ['cn001', 'cn002', 'cn003', 'cn010', 'gpu1', 'gpu2', 'login']
+        self.assertEqual(compress_hostlist(hosts), 'cn[001-003,010],gpu[1-2],login')
+        self.assertEqual(list(expand_hostlist(compress_hostlist(hosts))), hosts)
+
+    def test_regex(self):
+        self.assertEqual(hostlist_regex('cn[01-12]'), 'cn(0[1-9]|1[0-2])')
+        hosts = expand_hostlist('cn[0007-0120,0300],gpu[1-3]')
+        regex = re.compile('^({})$'.format(hostlist_regex('cn[0007-0120,0300],gpu[1-3]')))
+        for i in range(1000):
+            for host in ['cn{:04d}'.format(i), 'gpu{}'.format(i)]:
+                self.assertEqual(regex.match(host) is not None, host in hosts)
+
+    def test_regex_promql(self):
+        # - is not escaped, the escape of . is doubled in the string of PromQL
+        self.assertEqual(hostlist_regex('rack1-node[01-03],login.cluster'), 'rack1-node0[1-3]|login\\.cluster')
+        self.assertEqual(promql_hostlist_regex('rack1-node[01-03],login.cluster'), 'rack1-node0[1-3]|login\\\\.cluster')
+        job = JobTable(nodelist='rack1-node[01-03]')
+        query = 'node_load1{{instance=~"({})(:.*)?"}}'.format(job.nodes_regex())
+        self.assertEqual(query, 'node_load1{instance=~"(rack1-node0[1-3])(:.*)?"}')
+
+
+class TresTestCase(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(parse_tres('1=8,2=16000,4=1,1001=2'), {1: 8, 2: 16000, 4: 1, 1001: 2})
+        self.assertEqual(parse_tres(''), {})
+
+    def test_job(self):
+        job = JobTable(tres_req='1=8,2=16000,4=2,5=8', tres_alloc='1=8,2=16000,4=2,1001=2,11001=5', mem_req=0)
+        self.assertEqual(job.parse_tres_req(), {'total_cores': 8, 'total_mem': 16000, 'nb_nodes': 2})
+        self.assertEqual(job.gpu_count(), 2)
+        job = JobTable(tres_req='1=4,4=1', tres_alloc='1=4,4=1', mem_req=4000)
+        self.assertEqual(job.parse_tres_req()['total_mem'], 4000)
+        self.assertEqual(job.gpu_count(), 0)
+        self.assertIsNone(job.gpu_type())
+
+    def test_totals(self):
+        rows = [('1=8,2=1000,4=1', '1=8,1001=2', 0), ('1=4,4=1', '1=4', 500)]
+        self.assertEqual(tres_totals(rows), {'total_cores': 12, 'total_mem': 1500, 'nb_nodes': 2, 'gpus': 2})
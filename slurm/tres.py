@@ -0,0 +1,79 @@
+"""
+Parse the TRES (trackable resources) strings of the Slurm database, like '1=8,2=16000,4=1,5=8,1001=2'
+"""
+import functools
+from django.conf import settings
+
+# ids of the tres_table in the Slurm database
+TRES_CPU = 1
+TRES_MEM = 2
+TRES_ENERGY = 3
+TRES_NODE = 4
+TRES_BILLING = 5
+# gres/gpu, the total of GPUs whatever their type
+TRES_GPU = 1001
+
+
+@functools.lru_cache(maxsize=16384)
+def _parse_tres(tres):
+    info = {}
+    if tres:
+        for item in tres.split(','):
+            key, sep, value = item.partition('=')
+            if sep:
+                info[int(key)] = int(value)
+    return info
+
+
+def parse_tres(tres):
+    """return a dict of TRES id: value, the parsing of each string is cached"""
+    return dict(_parse_tres(tres))
+
+
+def gpu_type(tres):
+    """return the type of GPU in a TRES string, with the ids in settings.SLURM_TRES like '1001='"""
+    info = _parse_tres(tres)
+    for key in settings.SLURM_TRES:
+        if int(key.rstrip('=')) in info:
+            return settings.SLURM_TRES[key]
+    return None
+
+
+def tres_info(tres_req, tres_alloc, mem_req=None):
+    """
+    return a dict with total_cores, total_mem (MB), nb_nodes and billing from tres_req
+    and gpus and gpu_type from tres_alloc
+
+    Sometime the memory is not in TRES, mem_req is then used
+    """
+    req = _parse_tres(tres_req)
+    alloc = _parse_tres(tres_alloc)
+    info = {
+        'gpus': alloc.get(TRES_GPU, 0),
+        'gpu_type': gpu_type(tres_alloc),
+    }
+    if TRES_CPU in req:
+        info['total_cores'] = req[TRES_CPU]
+    if TRES_NODE in req:
+        info['nb_nodes'] = req[TRES_NODE]
+    if TRES_BILLING in req:
+        info['billing'] = req[TRES_BILLING]
+    info['total_mem'] = req.get(TRES_MEM, mem_req)
+    return info
+
+
+def tres_totals(rows):
+    """
+    Sum the resources of multiple jobs without building the model instances
+
+    rows are (tres_req, tres_alloc, mem_req) tuples, like JobTable.objects.values_list('tres_req', 'tres_alloc', 'mem_req')
+    return a dict with total_cores, total_mem (MB), nb_nodes and gpus
+    """
+    totals = {'total_cores': 0, 'total_mem': 0, 'nb_nodes': 0, 'gpus': 0}
+    for tres_req, tres_alloc, mem_req in rows:
+        req = _parse_tres(tres_req)
+        totals['total_cores'] += req.get(TRES_CPU, 0)
+        totals['total_mem'] += req.get(TRES_MEM, mem_req or 0)
+        totals['nb_nodes'] += req.get(TRES_NODE, 0)
+        totals['gpus'] += _parse_tres(tres_alloc).get(TRES_GPU, 0)
+    return totals
@@ -1,15 +1,14 @@
-from userportal.common import staff, Prometheus
+from userportal.common import staff, get_prometheus
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from slurm.models import JobTable, AssocTable
 import time
 import datetime
-from django.conf import settings
 import statistics
 from django.db.models import Count
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 def get_start_end(request):
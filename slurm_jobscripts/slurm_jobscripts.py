@@ -1,15 +1,325 @@
 import requests
 import configparser
 import os
+import re
+import sqlite3
 import time
 import argparse
 import logging
 
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
 # This is script is taking the submitted script on the slurmctld server
 # and send it to the userportal so it can be stored in a database
+#
+# New jobs are detected with inotify on the hash.N directories of the spool when inotify_simple
+# is installed, otherwise the directories are listed periodically. The scripts are read as soon
+# as possible, since the spool directory of a job is removed when it ends, and are kept in a
+# SQLite journal until the portal accepted them, so nothing is lost while the portal is down.
+# A batch rejected as too large or invalid is split in halves to find the scripts the portal refuses,
+# a script failing max_attempts times is parked in the journal and not sent again.
+
+RE_JOB_DIR = re.compile(r'^job\.(\d+)$')
+
+
+class Journal:
+    """
+    Scripts waiting to be sent, stored in SQLite so they survive a restart of the collector
+
+    The scripts that failed are sent after the others, and are parked after max_attempts failures.
+    """
+    def __init__(self, path, max_attempts=5):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pending (id_job INTEGER PRIMARY KEY, script TEXT NOT NULL, added REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(pending)')]
+        if 'attempts' not in columns:
+            # journal of a previous version of the collector
+            self.db.execute('ALTER TABLE pending ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        self.db.commit()
+
+    def add(self, scripts):
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR IGNORE INTO pending (id_job, script, added) VALUES (?, ?, ?)',
+            [(jobid, script, now) for jobid, script in scripts])
+        self.db.commit()
+
+    def peek(self, count):
+        return self.db.execute(
+            'SELECT id_job, script FROM pending WHERE attempts < ? ORDER BY attempts, added LIMIT ?',
+            (self.max_attempts, count)).fetchall()
+
+    def failed(self, jobids):
+        self.db.executemany('UPDATE pending SET attempts = attempts + 1 WHERE id_job = ?', [(jobid,) for jobid in jobids])
+        self.db.commit()
+        for jobid, in self.db.execute(
+                'SELECT id_job FROM pending WHERE attempts = ? AND id_job IN ({})'.format(','.join('?' * len(jobids))),
+                [self.max_attempts] + list(jobids)):
+            logging.error('Job script {} parked after {} attempts'.format(jobid, self.max_attempts))
+
+    def remove(self, jobids):
+        self.db.executemany('DELETE FROM pending WHERE id_job = ?', [(jobid,) for jobid in jobids])
+        self.db.commit()
+
+    def depth(self):
+        return self.db.execute('SELECT COUNT(*) FROM pending WHERE attempts < ?', (self.max_attempts,)).fetchone()[0]
+
+    def parked(self):
+        return self.db.execute('SELECT COUNT(*) FROM pending WHERE attempts >= ?', (self.max_attempts,)).fetchone()[0]
+
+    def oldest(self):
+        return self.db.execute('SELECT MIN(added) FROM pending WHERE attempts < ?', (self.max_attempts,)).fetchone()[0]
+
+
+class Metrics:
+    """Counters of the collector, written in the Prometheus text format for the textfile collector of node_exporter"""
+    def __init__(self, path):
+        self.path = path
+        self.values = {
+            'scripts_read_total': 0,
+            'scripts_sent_total': 0,
+            'scripts_invalid_total': 0,
+            'scripts_missing_total': 0,
+            'send_errors_total': 0,
+            'send_requests_total': 0,
+            'send_latency_seconds_sum': 0.0,
+            'send_latency_seconds_last': 0.0,
+            'queue_depth': 0,
+            'queue_parked': 0,
+            'queue_oldest_age_seconds': 0.0,
+        }
+        self.warned = False
+
+    def inc(self, name, value=1):
+        self.values[name] += value
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def write(self):
+        if self.path is None:
+            return
+        lines = ['slurm_jobscripts_{} {}'.format(name, value) for name, value in self.values.items()]
+        # written in a temporary file then renamed, so node_exporter never reads a partial file
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.rename(self.path + '.tmp', self.path)
+        except OSError as e:
+            # the metrics are optional, the scripts are still collected
+            if not self.warned:
+                logging.warning('Metrics not written in {}: {}'.format(self.path, e))
+                self.warned = True
+
+
+class Sender:
+    """Send the scripts of the journal with the bulk endpoint of the portal, with a backoff when it is unreachable"""
+    def __init__(self, journal, metrics, host, token, batch_size):
+        self.journal = journal
+        self.metrics = metrics
+        self.host = host
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Token ' + token
+        self.failures = 0
+        self.retry_at = 0
+        self.bulk = True
+
+    def backoff(self):
+        self.failures += 1
+        self.retry_at = time.time() + min(2 ** self.failures, 60)
+        self.metrics.inc('send_errors_total')
+
+    def flush(self, max_batches=10):
+        """send up to max_batches batches, return False if the portal could not be reached"""
+        if time.time() < self.retry_at:
+            return False
+        for _i in range(max_batches):
+            batch = self.journal.peek(self.batch_size)
+            if len(batch) == 0:
+                break
+            start = time.time()
+            try:
+                if self.bulk:
+                    done = self.send_bulk(batch)
+                else:
+                    done = self.send_one_by_one(batch)
+            except requests.exceptions.RequestException as e:
+                logging.error('{} job scripts not sent - API is unreachable: {}'.format(len(batch), e))
+                self.backoff()
+                return False
+            latency = time.time() - start
+            self.metrics.inc('send_requests_total')
+            self.metrics.inc('send_latency_seconds_sum', latency)
+            self.metrics.set('send_latency_seconds_last', latency)
+            if done is None:
+                self.backoff()
+                return False
+            self.journal.remove(done)
+            if len(done) < len(batch):
+                # the rest of the batch is retried later
+                self.backoff()
+                return False
+            self.failures = 0
+        return True
+
+    def send_bulk(self, batch):
+        """
+        return the job ids accepted or rejected by the portal, None to retry the batch later
+
+        A batch refused as a whole (400, 413 or 500) is split in halves, the halves after a failed one
+        are kept for later. A single script refused this way counts as a failed attempt.
+        """
+        r = self.session.post(
+            '{}/api/jobscripts/bulk/'.format(self.host),
+            json=[{'id_job': jobid, 'submit_script': script} for jobid, script in batch],
+            timeout=(5, 120))
+        if r.status_code == 404:
+            # the portal does not have the bulk endpoint, send the scripts one by one
+            logging.info('Bulk endpoint not available, sending the scripts one by one')
+            self.bulk = False
+            return self.send_one_by_one(batch)
+        if r.status_code == 401:
+            logging.error('Token is invalid')
+            return None
+        if r.status_code in (400, 413, 500):
+            if len(batch) == 1:
+                logging.error('Job script {} not saved: {}'.format(batch[0][0], r.text[:200]))
+                self.journal.failed([batch[0][0]])
+                return None
+            half = len(batch) // 2
+            first = self.send_bulk(batch[:half])
+            if first is None or len(first) < half:
+                return first
+            second = self.send_bulk(batch[half:])
+            return first + (second or [])
+        if r.status_code != 200:
+            logging.error('{} job scripts not saved: {}'.format(len(batch), r.text[:200]))
+            return None
+
+        for jobid, status in r.json()['results'].items():
+            if status == 'invalid':
+                logging.error('Job script {} not saved: invalid'.format(jobid))
+                self.metrics.inc('scripts_invalid_total')
+            else:
+                logging.debug('Job script {}: {}'.format(jobid, status))
+                self.metrics.inc('scripts_sent_total')
+        # a job missing from the results can't be saved, it is not retried either
+        return [jobid for jobid, script in batch]
+
+    def send_one_by_one(self, batch):
+        done = []
+        for jobid, script in batch:
+            r = self.session.post(
+                '{}/api/jobscripts/'.format(self.host),
+                json={'id_job': jobid, 'submit_script': script},
+                timeout=(5, 60))
+            if r.status_code == 201:
+                self.metrics.inc('scripts_sent_total')
+            elif 'job script with this id job already exists' in r.text:
+                logging.debug('Job script already exists')
+            elif r.status_code == 400:
+                logging.error('Job script {} not saved: {}'.format(jobid, r.text[:200]))
+                self.metrics.inc('scripts_invalid_total')
+            else:
+                if r.status_code == 401:
+                    logging.error('Token is invalid')
+                else:
+                    logging.error('Job script {} not saved: {}'.format(jobid, r.text[:200]))
+                # keep the rest of the batch for later
+                return done if len(done) > 0 else None
+            done.append(jobid)
+        return done
+
 
+class Spool:
+    """
+    New jobs in the spool directory of slurmctld
 
-def send_job(jobid):
+    With inotify, only the creation of the job directories is watched and the whole spool is
+    listed every resync_interval seconds, to catch the events lost on an overflow. Without
+    inotify, the spool is listed every poll_interval seconds.
+    """
+    def __init__(self, spool, poll_interval, resync_interval):
+        self.spool = spool
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.known = set()
+        self.next_resync = 0
+        self.inotify = None
+        self.watches = {}
+        if inotify_simple is not None:
+            self.inotify = inotify_simple.INotify()
+            self.inotify.add_watch(spool, inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO)
+            self.watch_hash_dirs()
+        else:
+            logging.info('inotify_simple is not installed, polling the spool every {}s'.format(poll_interval))
+
+    def hash_dir(self, mod):
+        return '{spool}/hash.{mod}'.format(spool=self.spool, mod=mod)
+
+    def watch_hash_dirs(self):
+        for mod in range(10):
+            if mod not in self.watches.values() and os.path.isdir(self.hash_dir(mod)):
+                wd = self.inotify.add_watch(self.hash_dir(mod), inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO)
+                self.watches[wd] = mod
+
+    def list_jobs(self):
+        jobids = set()
+        for mod in range(10):
+            try:
+                listing = os.listdir(self.hash_dir(mod))
+            except FileNotFoundError:
+                logging.debug('hash.{mod} does not exist yet'.format(mod=mod))
+                continue
+            for name in listing:
+                match = RE_JOB_DIR.match(name)
+                if match:
+                    jobids.add(int(match.group(1)))  # parse the jobid (job.12345 -> 12345)
+        return jobids
+
+    def resync(self):
+        # the ended jobs are forgotten, the set only contains the jobs still in the spool
+        current = self.list_jobs()
+        new_jobs = current - self.known
+        self.known = current
+        self.next_resync = time.time() + (self.resync_interval if self.inotify is not None else self.poll_interval)
+        return new_jobs
+
+    def wait(self, timeout):
+        """return the new job ids, waiting at most timeout seconds"""
+        if time.time() >= self.next_resync:
+            return self.resync()
+        timeout = min(timeout, max(self.next_resync - time.time(), 0))
+        if self.inotify is None:
+            time.sleep(timeout)
+            return set()
+
+        new_jobs = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & inotify_simple.flags.Q_OVERFLOW:
+                logging.warning('inotify queue overflow, listing the spool')
+                self.next_resync = 0
+                continue
+            if event.wd not in self.watches:
+                # a hash.N directory was created in the spool
+                self.watch_hash_dirs()
+                continue
+            match = RE_JOB_DIR.match(event.name)
+            if match and int(match.group(1)) not in self.known:
+                self.known.add(int(match.group(1)))
+                new_jobs.add(int(match.group(1)))
+        return new_jobs
+
+
+def read_script(jobid):
+    """return the script of a job, '' if it is not written yet and None if it can't be read"""
     try:
         with open('{spool}/hash.{mod}/job.{jobid}/script'.format(
                 spool=spool,
@@ -18,33 +328,14 @@ def send_job(jobid):
             content = f.read()[:script_length].strip('\x00')
     except UnicodeDecodeError:
         # Ignore problems with wrong file encoding
-        return
+        return None
     except FileNotFoundError:
-        # The script disappeared before we could read it
-        return
+        # The script is not written yet or disappeared
+        return ''
 
     # Only log first 100 characters into DEBUG log
     logging.debug('Job script {}: {}'.format(jobid, content[:100]))
-
-    try:
-        r = requests.post(
-            '{}/api/jobscripts/'.format(host),
-            json={'id_job': int(jobid), 'submit_script': content},
-            headers={'Authorization': 'Token ' + token}
-        )
-    except requests.exceptions.ConnectionError:
-        logging.error('Job script {} not saved - API is unreachable'.format(jobid))
-        return
-
-    if r.status_code != 201:
-        if r.status_code == 401:
-            logging.error('Token is invalid')
-        elif r.status_code == 503:
-            logging.error('Job script {} not saved - API is unreachable'.format(jobid))
-        elif 'job script with this id job already exists' in r.text:
-            logging.debug('Job script already exists')
-        else:
-            logging.error('Job script {} not saved: {}'.format(jobid, r.text))
+    return content
 
 
 if __name__ == '__main__':
@@ -69,24 +360,51 @@ if __name__ == '__main__':
     host = config['api']['host']
     script_length = int(config['api']['script_length'])
     spool = config['slurm']['spool']
+    if not config.has_section('collector'):
+        config.add_section('collector')
+    collector = config['collector']
 
-    jobs = set()
+    journal = Journal(collector.get('journal', '/var/lib/slurm_jobscripts/journal.sqlite'), collector.getint('max_attempts', 5))
+    metrics = Metrics(collector.get('metrics_textfile'))
+    sender = Sender(journal, metrics, host, token, collector.getint('batch_size', 1000))
+    watcher = Spool(spool, collector.getfloat('poll_interval', 5), collector.getfloat('resync_interval', 300))
+    flush_interval = collector.getfloat('flush_interval', 2)
+    # a script is read after this delay, to let slurmctld finish writing it, and retried until read_timeout
+    read_delay = collector.getfloat('read_delay', 1)
+    read_timeout = collector.getfloat('read_timeout', 30)
 
+    to_read = {}
+    last_flush = 0
     while True:
-        updated_jobs = set()
-        for mod in range(10):
-            try:
-                listing = os.listdir('{spool}/hash.{mod}'.format(spool=spool, mod=mod))
-            except FileNotFoundError:
-                logging.debug('hash.{mod} does not exist yet'.format(mod=mod))
+        now = time.time()
+        for jobid in watcher.wait(timeout=min(flush_interval, read_delay)):
+            logging.debug('New job: {}'.format(jobid))
+            to_read[jobid] = now
+
+        scripts = []
+        for jobid, seen in list(to_read.items()):
+            if time.time() - seen < read_delay:
+                continue
+            content = read_script(jobid)
+            if content == '' and time.time() - seen < read_timeout:
                 continue
-            for job in filter(lambda x: 'job' in x, listing):
-                jobid = int(job[4:])  # parse the jobid (job.12345 -> 12345)
-                updated_jobs.add(jobid)
+            del to_read[jobid]
+            if content:
+                scripts.append((jobid, content))
+            else:
+                metrics.inc('scripts_missing_total')
+        if len(scripts) > 0:
+            journal.add(scripts)
+            metrics.inc('scripts_read_total', len(scripts))
 
-                if jobid not in jobs:
-                    logging.debug('New job: {}'.format(jobid))
-                    send_job(jobid)
+        depth = journal.depth()
+        if depth >= sender.batch_size or (depth > 0 and time.time() - last_flush >= flush_interval):
+            sender.flush()
+            last_flush = time.time()
+            depth = journal.depth()
 
-        jobs = updated_jobs
-        time.sleep(5)
+        metrics.set('queue_depth', depth)
+        metrics.set('queue_parked', journal.parked())
+        oldest = journal.oldest()
+        metrics.set('queue_oldest_age_seconds', 0 if oldest is None else time.time() - oldest)
+        metrics.write()
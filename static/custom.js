@@ -12,6 +12,87 @@ var debounce_loadGraph = _.debounce(function(container, url){
     loadGraph(container, url);
 }, 100);
 
+function renderGraph(container, url, content){
+    var container_div = '#' + container;
+    if(content['data']){
+        if(content['data'].length == 0){
+            replace_div_nodata(container_div);
+        }
+        else{
+            $(container_div).html('');
+            if(content['layout'] == undefined){
+                content['layout'] = {};
+            }
+            if(content['layout']['margin'] == undefined){
+                // set a default margin
+                content['layout']['margin'] = {l: 80, r: 0, b: 50, t: 50, pad: 0};
+            }
+
+            if(content['config'] == undefined) {
+                content['config'] = {};
+            }
+
+            content['config']['modeBarButtonsToAdd'] = [
+                {
+                    name: 'Filter series',
+                    icon: Plotly.Icons.eraseshape,
+                    click: function(gd) {
+                        bootbox.prompt(gettext('Filter series by name (case sensitive):'),
+                            function(filter_value) {
+                            if (filter_value != null) {
+                                var new_data = [];
+                                for (var i = 0; i < content['data'].length; i++) {
+                                    var trace = content['data'][i];
+                                    // check if the trace name contains the filter value
+                                    if(trace['name'].includes(filter_value)){
+                                        new_data.push(trace);
+                                    }
+                                }
+                                Plotly.newPlot(gd, new_data, content['layout'], content['config']);
+                            }
+                        });
+                    }
+                }
+            ]
+
+            Plotly.newPlot(container, content['data'], content['layout'], content['config']);
+            // url of the data shown, used by refreshGraph
+            $(container_div).data('url', url);
+
+            $(container_div).on('plotly_relayout', function(self, relayout_data){
+                if(relayout_data['xaxis.autorange'] == true && relayout_data['xaxis.showspikes'] == false){
+                    // reset X axis event (unzoom)
+                    // remove the old parameters from the url string
+                    var url_splitted = url.split('?');
+                    url = url_splitted[0];
+                    debounce_loadGraph(container, url);
+                }
+                else if(relayout_data['xaxis.range[0]']){
+                    // zoom event
+                    // the date is in UTC and we need to convert it to unix timestamp
+                    var start_date = new Date(relayout_data['xaxis.range[0]'] + " Z");
+                    var start_date_unix = Math.round(start_date.getTime() / 1000);
+
+                    var end_date = new Date(relayout_data['xaxis.range[1]'] + " Z");
+                    var end_date_unix = Math.round(end_date.getTime() / 1000);
+
+                    // remove the old parameters from the url string
+                    var url_splitted = url.split('?');
+                    url = url_splitted[0];
+
+                    // get the new range and reload the graph
+                    var newurl = url + '?start=' + start_date_unix + '&end=' + end_date_unix;
+                    debounce_loadGraph(container, newurl);
+                }
+                else{
+                    // event not handled
+                    // autoscale will end up here and it will not refresh the graph on purpose
+                }
+            });
+        }
+    }
+}
+
 function loadGraph(container, url){
     var container_div = '#' + container;
     const loadingString = gettext('Loading...');
@@ -28,81 +109,7 @@ function loadGraph(container, url){
         dataType    : 'json',
         contentType : 'application/json',
         success : function(content) {
-            if(content['data']){
-                if(content['data'].length == 0){
-                    replace_div_nodata(container_div);
-                }
-                else{
-                    $(container_div).html('');
-                    if(content['layout'] == undefined){
-                        content['layout'] = {};
-                    }
-                    if(content['layout']['margin'] == undefined){
-                        // set a default margin
-                        content['layout']['margin'] = {l: 80, r: 0, b: 50, t: 50, pad: 0};
-                    }
-
-                    if(content['config'] == undefined) {
-                        content['config'] = {};
-                    }
-
-                    content['config']['modeBarButtonsToAdd'] = [
-                        {
-                            name: 'Filter series',
-                            icon: Plotly.Icons.eraseshape,
-                            click: function(gd) {
-                                bootbox.prompt(gettext('Filter series by name (case sensitive):'),
-                                    function(filter_value) {
-                                    if (filter_value != null) {
-                                        var new_data = [];
-                                        for (var i = 0; i < content['data'].length; i++) {
-                                            var trace = content['data'][i];
-                                            // check if the trace name contains the filter value
-                                            if(trace['name'].includes(filter_value)){
-                                                new_data.push(trace);
-                                            }
-                                        }
-                                        Plotly.newPlot(gd, new_data, content['layout'], content['config']);
-                                    }
-                                });
-                            }
-                        }
-                    ]
-
-                    Plotly.newPlot(container, content['data'], content['layout'], content['config']);
-
-                    $(container_div).on('plotly_relayout', function(self, relayout_data){
-                        if(relayout_data['xaxis.autorange'] == true && relayout_data['xaxis.showspikes'] == false){
-                            // reset X axis event (unzoom)
-                            // remove the old parameters from the url string
-                            var url_splitted = url.split('?');
-                            url = url_splitted[0];
-                            debounce_loadGraph(container, url);
-                        }
-                        else if(relayout_data['xaxis.range[0]']){
-                            // zoom event
-                            // the date is in UTC and we need to convert it to unix timestamp
-                            var start_date = new Date(relayout_data['xaxis.range[0]'] + " Z");
-                            var start_date_unix = Math.round(start_date.getTime() / 1000);
-
-                            var end_date = new Date(relayout_data['xaxis.range[1]'] + " Z");
-                            var end_date_unix = Math.round(end_date.getTime() / 1000);
-
-                            // remove the old parameters from the url string
-                            var url_splitted = url.split('?');
-                            url = url_splitted[0];
-
-                            // get the new range and reload the graph
-                            var newurl = url + '?start=' + start_date_unix + '&end=' + end_date_unix;
-                            debounce_loadGraph(container, newurl);
-                        }
-                        else{
-                            // event not handled
-                            // autoscale will end up here and it will not refresh the graph on purpose
-                        }
-                    });
-                }
-            }
+            renderGraph(container, url, content);
         },
         error : function(xhr, textStatus, errorThrown ) {
             if (textStatus == 'timeout' || textStatus == 'error') {
@@ -122,4 +129,126 @@ function loadGraph(container, url){
             }
         }
     });
-}
\ No newline at end of file
+}
+
+// Load multiple graphs of the same page with a single request
+// graphs is an object {name: container}, each graph is reloaded from its own url on zoom
+function loadGraphBundle(url, graphs){
+    const loadingString = gettext('Loading...');
+    for (const [name, container] of Object.entries(graphs)) {
+        var container_div = '#' + container;
+        if($(container_div).html().trim().length == 0){
+            $(container_div).html('<div class="spinner-border m-5 justify-content-center" role="status"><span class="sr-only">' + loadingString + '</span></div>');
+        }
+    }
+
+    $.ajax({
+        url : url + '?graphs=' + Object.keys(graphs).join(','),
+        type : 'GET',
+        dataType    : 'json',
+        contentType : 'application/json',
+        success : function(content) {
+            for (const [name, container] of Object.entries(graphs)) {
+                if(content[name]){
+                    renderGraph(container, 'graph/' + name + '.json', content[name]);
+                }
+                else{
+                    // retry the failed graph on its own
+                    loadGraph(container, 'graph/' + name + '.json');
+                }
+            }
+        },
+        error : function(xhr, textStatus, errorThrown ) {
+            // fallback to one request per graph
+            for (const [name, container] of Object.entries(graphs)) {
+                loadGraph(container, 'graph/' + name + '.json');
+            }
+        }
+    });
+}
+
+// Stable id of each trace, same as trace_ids() in userportal/common.py
+function traceIds(traces){
+    var ids = [];
+    var seen = {};
+    for (var i = 0; i < traces.length; i++) {
+        var name = traces[i]['name'] !== undefined ? String(traces[i]['name']) : String(i);
+        seen[name] = (seen[name] || 0) + 1;
+        ids.push(seen[name] == 1 ? name : name + '#' + (seen[name] - 1));
+    }
+    return ids;
+}
+
+// Append the new points of a graph, only the points after the last one shown are requested with ?since=
+function refreshGraph(container){
+    var gd = document.getElementById(container);
+    var url = $(gd).data('url');
+    if(url == undefined || url.includes('?') || gd.data == undefined){
+        // not loaded yet or zoomed, nothing to refresh
+        return;
+    }
+
+    var last = null;
+    for (const trace of gd.data) {
+        if(trace['x'] && trace['x'].length > 0 && (last == null || trace['x'][trace['x'].length - 1] > last)){
+            last = trace['x'][trace['x'].length - 1];
+        }
+    }
+    if(last == null){
+        loadGraph(container, url);
+        return;
+    }
+    var since = Math.round(new Date(last + " Z").getTime() / 1000);
+
+    $.ajax({
+        url : url + '?since=' + since,
+        type : 'GET',
+        dataType    : 'json',
+        contentType : 'application/json',
+        success : function(content) {
+            var ids = traceIds(gd.data);
+            var update = {x: [], y: []};
+            var indices = [];
+            for (const [id, points] of Object.entries(content['series'] || {})) {
+                var index = ids.indexOf(id);
+                if(index == -1){
+                    // a new series appeared, redraw the whole graph
+                    loadGraph(container, url);
+                    return;
+                }
+                if(points['x'].length > 0){
+                    update['x'].push(points['x']);
+                    update['y'].push(points['y']);
+                    indices.push(index);
+                }
+            }
+            if(indices.length > 0){
+                Plotly.extendTraces(gd, update, indices);
+            }
+        }
+    });
+}
+
+// Refresh the graphs of a running job, graphs is an object {name: container}
+function autoRefreshGraphs(graphs, interval){
+    setInterval(function(){
+        for (const container of Object.values(graphs)) {
+            refreshGraph(container);
+        }
+    }, interval);
+}
+
+// Show the values streamed by a live endpoint in the elements with a data-live attribute
+// the browser reconnects by itself if the stream is closed
+function liveValues(url, container){
+    var source = new EventSource(url);
+    source.addEventListener('values', function(event){
+        var content = JSON.parse(event.data);
+        for (const [name, value] of Object.entries(content['values'])) {
+            $(container).find('[data-live="' + name + '"]').text(value == null ? '-' : value.toFixed(1));
+        }
+        $(container).find('[data-live-time]').text(new Date(content['time'] * 1000).toLocaleTimeString());
+        $(container).show();
+    });
+    return source;
+}
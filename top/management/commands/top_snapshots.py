@@ -0,0 +1,32 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from top.snapshots import KINDS, take_snapshot, prune_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Store the rows of the top pages, read by the pages and the JSON API instead of querying Prometheus on each view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', choices=list(KINDS), help='Kind of snapshot, all by default')
+        parser.add_argument('--loop', type=int, default=0, help='Run every this number of seconds instead of once')
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or list(KINDS)
+        while True:
+            start = time.monotonic()
+            for kind in kinds:
+                try:
+                    snapshot = take_snapshot(kind)
+                    self.stdout.write('{}: {} rows'.format(kind, len(snapshot.rows)))
+                except Exception as e:
+                    if not options['loop']:
+                        raise
+                    # Prometheus or a database might be temporarily unavailable, retry on the next run
+                    self.stderr.write('Error while taking the {} snapshot: {}'.format(kind, e))
+            deleted = prune_snapshots(settings.TOP_SNAPSHOT_RETENTION_DAYS, settings.TOP_SNAPSHOT_HOURLY_AFTER_DAYS)
+            if deleted:
+                self.stdout.write('{} old snapshots deleted'.format(deleted))
+            if not options['loop']:
+                break
+            time.sleep(max(options['loop'] - (time.monotonic() - start), 0))
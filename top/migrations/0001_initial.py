@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('time', models.PositiveBigIntegerField()),
+                ('rows', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'time'], name='top_snapshot_kind_time')],
+            },
+        ),
+    ]
@@ -1,3 +1,19 @@
-# from django.db import models
+from datetime import datetime
+from django.db import models
 
-# Create your models here.
+
+class TopSnapshot(models.Model):
+    """Rows of a top page at a time, taken by the top_snapshots command"""
+    # compute, gpucompute or largemem
+    kind = models.CharField(max_length=32)
+    # epoch of the Prometheus queries
+    time = models.PositiveBigIntegerField()
+    rows = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'time'], name='top_snapshot_kind_time'),
+        ]
+
+    def time_dt(self):
+        return datetime.fromtimestamp(self.time)
@@ -0,0 +1,315 @@
+"""
+Snapshots of the top pages
+
+The rows of the compute, gpucompute and largemem pages come from cluster-wide queries. They are
+taken every minute by the top_snapshots command and stored in TopSnapshot, the pages and the JSON
+API read the last snapshot, or the one of a past time. The notes are added when a page is shown.
+The labels of the badges are stored untranslated and translated by the views.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_noop
+from userportal.common import get_prometheus, uids_to_usernames
+from slurm.models import JobTable
+from jobstats.mirror import job_mirror
+from top.models import TopSnapshot
+
+prom = get_prometheus()
+
+# seconds a page taking a snapshot holds the lock, the other pages use the previous snapshot meanwhile
+SNAPSHOT_LOCK_TIMEOUT = 120
+
+
+def metrics_to_user(metrics):
+    users_metrics = {}
+    for line in metrics:
+        users_metrics[(line['metric']['user'], line['metric']['account'])] = float(line['value'][1])
+    return users_metrics
+
+
+def metrics_to_job(metrics):
+    jobs_metrics = {}
+    for line in metrics:
+        jobs_metrics[line['metric']['slurmjobid']] = float(line['value'][1])
+    return jobs_metrics
+
+
+def stats_for_users(users=None):
+    if users is None:
+        # get the top 100 and use the same list for all the other queries
+        query_cpu = 'topk(100, sum(slurm_job:allocated_core:count_user_account{{ {filter} }}) by (user, account))'.format(
+            filter=prom.get_filter())
+        stats_cpu = prom.query_last(query_cpu)
+        users = []
+        for line in stats_cpu:
+            users.append(line['metric']['user'])
+    else:
+        # use the list of users as filter
+        query_cpu = 'sum(slurm_job:allocated_core:count_user_account{{ user=~"{users}", {filter} }}) by (user, account)'.format(
+            users='|'.join(users),
+            filter=prom.get_filter())
+        stats_cpu = prom.query_last(query_cpu)
+    stats_cpu_asked = metrics_to_user(stats_cpu)
+
+    queries = {
+        'cpu_used': 'sum(slurm_job:used_core:sum_user_account{{user=~"{users}", {filter} }}) by (user, account)',
+        'mem_asked': 'sum(slurm_job:allocated_memory:sum_user_account{{user=~"{users}", {filter}}}) by (user, account)',
+        'mem_max': 'sum(slurm_job:max_memory:sum_user_account{{user=~"{users}", {filter}}}) by (user, account)',
+    }
+    stats = prom.query_many({name: {'query': query.format(users='|'.join(users), filter=prom.get_filter())} for name, query in queries.items()})
+    return (stats_cpu_asked, metrics_to_user(stats['cpu_used']), metrics_to_user(stats['mem_asked']), metrics_to_user(stats['mem_max']))
+
+
+def compute_rows():
+    stats_cpu_asked, stats_cpu_used, stats_mem_asked, stats_mem_max = stats_for_users(users=None)
+
+    rows = []
+    for line in stats_cpu_asked.keys():
+        try:
+            reasonable_mem = stats_cpu_asked[line] * settings.NORMAL_MEM_BY_CORE * 1.1
+            stats = {
+                'user': line[0],
+                'account': line[1],
+                'cpu_asked': stats_cpu_asked[line],
+                'cpu_used': stats_cpu_used[line],
+                'cpu_ratio': stats_cpu_used[line] / stats_cpu_asked[line],
+                'mem_asked': stats_mem_asked[line],
+                'mem_max': stats_mem_max[line],
+                'mem_ratio': stats_mem_max[line] / stats_mem_asked[line],
+            }
+            waste_badges = []
+            if stats_mem_asked[line] > reasonable_mem:
+                # If the user ask for more memory than what's available per core on a standard node
+                if stats['mem_ratio'] < 0.1:
+                    waste_badges.append(('danger', gettext_noop('Memory')))
+                elif stats['mem_ratio'] < 0.5:
+                    waste_badges.append(('warning', gettext_noop('Memory')))
+            else:
+                # The user might be wasting memory, but this is fine since its probably cpu bound and fully use the node regardless
+                # No other users could use the left-over memory in most cases since all cores are presumed to be used
+                # The next check will ensure that all cores are used
+                pass
+
+            if stats['cpu_ratio'] < 0.75:
+                waste_badges.append(('danger', gettext_noop('Cores')))
+            elif stats['cpu_ratio'] < 0.9:
+                waste_badges.append(('warning', gettext_noop('Cores')))
+
+            stats['waste_badges'] = waste_badges
+            rows.append(stats)
+        except KeyError:
+            pass
+    return rows
+
+
+def gpucompute_rows():
+    query_gpu = 'topk(100, sum(slurm_job:allocated_gpu:count_user_account{{ {filter} }}) by (user, account))'.format(
+        filter=prom.get_filter())
+    stats_gpu = prom.query_last(query_gpu)
+    gpu_users = []
+    for line in stats_gpu:
+        gpu_users.append(line['metric']['user'])
+
+    stats_gpu_asked = metrics_to_user(stats_gpu)
+
+    queries = {
+        'gpu_util': 'sum(slurm_job:used_gpu:sum_user_account{{user=~"{users}", {filter} }}) by (user, account)',
+        'gpu_used': 'sum(slurm_job:non_idle_gpu:sum_user_account{{user=~"{users}", {filter}}}) by (user, account)',
+    }
+    stats = prom.query_many({name: {'query': query.format(users='|'.join(gpu_users), filter=prom.get_filter())} for name, query in queries.items()})
+    stats_gpu_util = metrics_to_user(stats['gpu_util'])
+    stats_gpu_used = metrics_to_user(stats['gpu_used'])
+
+    # grab the cores, memory for each user
+    users = [x[0] for x in stats_gpu_asked.keys()]
+    stats_cpu_asked, stats_cpu_used, stats_mem_asked, stats_mem_max = stats_for_users(users=users)
+
+    rows = []
+    for line in stats_gpu:
+        try:
+            user = line['metric']['user']
+            account = line['metric']['account']
+            identifier = (user, account)
+            if identifier not in stats_gpu_used:
+                # User is not using any GPU
+                stats_gpu_used[identifier] = 0
+
+            reasonable_mem = stats_gpu_asked[identifier] * settings.NORMAL_MEM_BY_GPU * 1.1
+            reasonable_cores = stats_gpu_asked[identifier] * settings.NORMAL_CORES_BY_GPU * 1.1
+
+            stats = {
+                'user': user,
+                'account': account,
+                'gpu_asked': stats_gpu_asked[identifier],
+                'gpu_util': stats_gpu_util[identifier],
+                'gpu_used': stats_gpu_used[identifier],
+                'gpu_ratio': stats_gpu_util[identifier] / stats_gpu_asked[identifier],
+                'cpu_asked': stats_cpu_asked[identifier],
+                'cpu_used': stats_cpu_used[identifier],
+                'cpu_ratio': stats_cpu_used[identifier] / stats_cpu_asked[identifier],
+                'mem_asked': stats_mem_asked[identifier],
+                'mem_max': stats_mem_max[identifier],
+                'mem_ratio': stats_mem_max[identifier] / stats_mem_asked[identifier],
+                'reasonable_mem': stats_mem_asked[identifier] < reasonable_mem,
+                'reasonable_cores': stats_cpu_asked[identifier] < reasonable_cores,
+            }
+            waste_badges = []
+            if stats_mem_asked[identifier] > reasonable_mem:
+                # Using more memory than the fair share per GPU
+                if stats['mem_ratio'] < 0.1:
+                    waste_badges.append(('danger', gettext_noop('Memory')))
+                elif stats['mem_ratio'] < 0.5:
+                    waste_badges.append(('warning', gettext_noop('Memory')))
+            if stats_cpu_asked[identifier] > reasonable_cores:
+                # Using more cores than the fair share per GPU
+                if stats['cpu_ratio'] < 0.75:
+                    waste_badges.append(('danger', gettext_noop('Cores')))
+                elif stats['cpu_ratio'] < 0.9:
+                    waste_badges.append(('warning', gettext_noop('Cores')))
+            if stats['gpu_used'] == float(0):
+                waste_badges.append(('danger', gettext_noop('GPU ares totally unused')))
+            elif stats['gpu_ratio'] < 0.1:
+                waste_badges.append(('danger', gettext_noop('GPUs')))
+            elif stats['gpu_ratio'] < 0.2:
+                waste_badges.append(('warning', gettext_noop('GPUs')))
+
+            stats['waste_badges'] = waste_badges
+            rows.append(stats)
+        except KeyError:
+            pass
+    return rows
+
+
+def largemem_rows():
+    hour_ago = int(time.time()) - (3600)
+    week_ago = int(time.time()) - (3600 * 24 * 7)
+
+    mirror = job_mirror()
+    if mirror is not None:
+        # the mirror is indexed by state and time_start
+        jobs_running = mirror.filter(
+            time_start__lt=hour_ago,
+            partition__icontains='large',
+            state=JobTable.StatesJob.RUNNING)
+    else:
+        jobs_running = JobTable.objects.filter(
+            time_start__lt=hour_ago,
+            time_eligible__gt=week_ago,  # time_start is not indexed in the job table of Slurm
+            partition__icontains='large',
+            state=JobTable.StatesJob.RUNNING)
+    jobs_running = list(jobs_running)
+
+    jobs = []
+    for job in jobs_running:
+        jobs.append(str(job.id_job))
+    usernames = uids_to_usernames([job.id_user for job in jobs_running])
+
+    queries = {
+        'cpu_asked': 'count(slurm_job_core_usage_total{{slurmjobid=~"{jobs}", {filter}}}) by (slurmjobid)',
+        'cpu_used': 'sum(rate(slurm_job_core_usage_total{{slurmjobid=~"{jobs}", {filter}}}[2m]) / 1000000000) by (slurmjobid)',
+        'mem_asked': 'sum(slurm_job_memory_limit{{slurmjobid=~"{jobs}", {filter}}}) by (slurmjobid)',
+        'mem_max': 'sum(slurm_job_memory_max{{slurmjobid=~"{jobs}", {filter}}}) by (slurmjobid)',
+    }
+    stats = prom.query_many({name: {'query': query.format(jobs='|'.join(jobs), filter=prom.get_filter())} for name, query in queries.items()})
+    stats_cpu_asked = metrics_to_job(stats['cpu_asked'])
+    stats_cpu_used = metrics_to_job(stats['cpu_used'])
+    stats_mem_asked = metrics_to_job(stats['mem_asked'])
+    stats_mem_max = metrics_to_job(stats['mem_max'])
+
+    rows = []
+    for job in jobs_running:
+        try:
+            job_id = str(job.id_job)
+
+            mem_ratio = stats_mem_max[job_id] / stats_mem_asked[job_id]
+            cpu_ratio = stats_cpu_used[job_id] / stats_cpu_asked[job_id]
+            stats = {
+                'user': usernames.get(job.id_user, job.id_user),
+                'job_id': job.id_job,
+                'account': job.account,
+                'time_start': job.time_start,
+                'cpu_asked': stats_cpu_asked[job_id],
+                'cpu_used': stats_cpu_used[job_id],
+                'mem_asked': stats_mem_asked[job_id],
+                'mem_max': stats_mem_max[job_id],
+                'mem_ratio': mem_ratio,
+                'cpu_ratio': cpu_ratio,
+                'min_ratio': min(mem_ratio, cpu_ratio),
+            }
+            waste_badges = []
+            if stats['mem_ratio'] < 0.1:
+                waste_badges.append(('danger', gettext_noop('Memory')))
+            elif stats['mem_ratio'] < 0.5:
+                waste_badges.append(('warning', gettext_noop('Memory')))
+            if stats['cpu_ratio'] < 0.75:
+                waste_badges.append(('danger', gettext_noop('Cores')))
+            elif stats['cpu_ratio'] < 0.9:
+                waste_badges.append(('warning', gettext_noop('Cores')))
+
+            stats['waste_badges'] = waste_badges
+            rows.append(stats)
+        except KeyError:
+            pass
+    return rows
+
+
+# rows of each kind of snapshot
+KINDS = {
+    'compute': compute_rows,
+    'gpucompute': gpucompute_rows,
+    'largemem': largemem_rows,
+}
+
+
+def take_snapshot(kind):
+    now = int(time.time())
+    return TopSnapshot.objects.create(kind=kind, time=now, rows=KINDS[kind]())
+
+
+def get_snapshot(kind, at=None):
+    """
+    return the last snapshot of a kind taken at or before the epoch at, None if there is none
+
+    Without at, a snapshot older than TOP_SNAPSHOT_MAX_AGE is not used and a new one is taken,
+    so the pages still work when the top_snapshots command is not running. Only the page holding the
+    lock takes it, the others get the previous snapshot, or wait for the first one of a kind.
+    """
+    snapshots = TopSnapshot.objects.filter(kind=kind).order_by('-time')
+    if at is not None:
+        return snapshots.filter(time__lte=at).first()
+    snapshot = snapshots.filter(time__gte=time.time() - settings.TOP_SNAPSHOT_MAX_AGE).first()
+    if snapshot is not None:
+        return snapshot
+
+    lock = 'top:snapshot:{}'.format(kind)
+    if cache.add(lock, 1, SNAPSHOT_LOCK_TIMEOUT):
+        try:
+            return take_snapshot(kind)
+        finally:
+            cache.delete(lock)
+
+    deadline = time.time() + SNAPSHOT_LOCK_TIMEOUT
+    snapshot = snapshots.first()
+    while snapshot is None and time.time() < deadline:
+        time.sleep(1)
+        snapshot = snapshots.first()
+    return snapshot
+
+
+def prune_snapshots(retention_days, hourly_after_days):
+    """delete the snapshots older than retention_days, and keep one per hour after hourly_after_days"""
+    now = time.time()
+    deleted, _ = TopSnapshot.objects.filter(time__lt=now - retention_days * 24 * 3600).delete()
+
+    kept = set()
+    old = []
+    for id_snapshot, kind, snapshot_time in TopSnapshot.objects.filter(time__lt=now - hourly_after_days * 24 * 3600)\
+            .order_by('time').values_list('id', 'kind', 'time'):
+        if (kind, snapshot_time // 3600) in kept:
+            old.append(id_snapshot)
+        else:
+            kept.add((kind, snapshot_time // 3600))
+    for i in range(0, len(old), 1000):
+        deleted += TopSnapshot.objects.filter(id__in=old[i:i + 1000]).delete()[0]
+    return deleted
@@ -1,5 +1,10 @@
+import time
+from unittest import mock
 from django.conf import settings
+from django.core.cache import cache
 from tests.tests import CustomTestCase
+from top.models import TopSnapshot
+from top.snapshots import get_snapshot, prune_snapshots, take_snapshot
 
 
 class TopTestCase(CustomTestCase):
@@ -34,6 +39,36 @@ class TopTestCase(CustomTestCase):
         self.assertContains(response, '<th scope="col">Allocated cores</th>')
         self.assertContains(response, '/secure/jobstats/')
 
+    def test_top_snapshot(self):
+        now = int(time.time())
+        TopSnapshot.objects.create(kind='compute', time=now - 3600, rows=[{'user': 'past', 'account': 'def-past', 'waste_badges': []}])
+        # the past snapshot is not used as the current one
+        self.assertNotEqual(get_snapshot('compute').time, now - 3600)
+        self.assertEqual(get_snapshot('compute', now - 1800).rows[0]['user'], 'past')
+        self.assertIsNone(get_snapshot('compute', now - 7200))
+
+        response = self.admin_client.get('/secure/top/snapshot/compute.json?at={}'.format(now - 1800))
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONKeys(response, ['kind', 'time', 'rows'])
+        self.assertEqual(response.json()['time'], now - 3600)
+
+        response = self.admin_client.get('/secure/top/compute/?at={}'.format(now - 1800))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.user_client.get('/secure/top/snapshot/compute.json')
+        self.assertEqual(response.status_code, 403)
+        response = self.admin_client.get('/secure/top/snapshot/unknown.json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_top_snapshot_prune(self):
+        now = int(time.time())
+        hour = (now // 3600 - 24 * 5) * 3600
+        for minute in range(3):
+            TopSnapshot.objects.create(kind='largemem', time=hour + minute * 60, rows=[])
+        TopSnapshot.objects.create(kind='largemem', time=now - 3600 * 24 * 365, rows=[])
+        self.assertEqual(prune_snapshots(90, 2), 3)
+        self.assertEqual(list(TopSnapshot.objects.filter(kind='largemem').values_list('time', flat=True)), [hour])
+
     def test_top_lustre(self):
         response = self.admin_client.get('/secure/top/lustre/')
         self.assertEqual(response.status_code, 200)
@@ -47,3 +82,15 @@ class TopTestCase(CustomTestCase):
             json_ost = self.admin_client.get('/secure/top/lustre/graph/lustre_ost/{fs}.json'.format(fs=fs))
             self.assertEqual(json_ost.status_code, 200)
             self.assertJSONKeys(json_ost, ['data', 'layout'])
+
+    def test_top_snapshot_lock(self):
+        # while another page takes a snapshot, the previous one is returned instead of querying again
+        now = int(time.time())
+        TopSnapshot.objects.create(kind='compute', time=now - 3600, rows=[])
+        cache.set('top:snapshot:compute', 1)
+        try:
+            with mock.patch('top.snapshots.take_snapshot', wraps=take_snapshot) as take:
+                self.assertEqual(get_snapshot('compute').time, now - 3600)
+            take.assert_not_called()
+        finally:
+            cache.delete('top:snapshot:compute')
@@ -7,6 +7,7 @@ urlpatterns = [
     path('gpucompute/', views.gpucompute),
     path('largemem/', views.largemem),
     path('lustre/', views.lustre),
+    path('snapshot/<str:kind>.json', views.snapshot_json),
     path('lustre/graph/lustre_mdt/<str:fs>.json', views.graph_lustre_mdt),
     path('lustre/graph/lustre_ost/<str:fs>.json', views.graph_lustre_ost),
 ]
@@ -1,14 +1,32 @@
 import functools
-from django.http import HttpResponseForbidden
-from prometheus_api_client import PrometheusConnect
+import hashlib
+from collections import OrderedDict
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.http import HttpResponse, HttpResponseForbidden
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.cache import caches
+from prometheus_api_client import PrometheusConnect, PrometheusApiClientException
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from ccldap.models import LdapAllocation, LdapUser
 from ccldap.common import cc_storage_allocations, cc_compute_allocations_by_user, cc_compute_allocations_by_account
 import yaml
 from django.conf import settings
 import os
+import json
+import numpy as np
 import userportal.petname as petname
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # How many points in the X axis of the graphs
 RESOLUTION = 500
@@ -137,14 +155,135 @@ def cloud_projects_by_user(username):
     return returned_projects
 
 
+class TTLCache:
+    """Thread-safe LRU cache where each entry expires after ttl seconds"""
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class IdentityCache:
+    """
+    Cache of the uid <-> username mapping, configured with settings.IDENTITY_CACHE
+
+    Each process keeps a LRU with a TTL, a Django cache can be added as a second tier shared by all the processes.
+    Unknown users are not cached.
+    """
+    def __init__(self, config):
+        self.local = TTLCache(config.get('size', 10000), config.get('ttl', 3600))
+        self.ttl = config.get('ttl', 3600)
+        self.shared_alias = config.get('shared_cache')
+
+    def get(self, kind, key):
+        value = self.local.get((kind, key))
+        if value is None and self.shared_alias is not None:
+            value = caches[self.shared_alias].get('identity:{}:{}'.format(kind, key))
+            if value is not None:
+                self.local.set((kind, key), value)
+        return value
+
+    def get_many(self, kind, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get((kind, key))
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing and self.shared_alias is not None:
+            shared = caches[self.shared_alias].get_many(['identity:{}:{}'.format(kind, key) for key in missing])
+            for key in missing:
+                value = shared.get('identity:{}:{}'.format(kind, key))
+                if value is not None:
+                    self.local.set((kind, key), value)
+                    found[key] = value
+        return found
+
+    def set(self, uid, username):
+        self.set_many({uid: username})
+
+    def set_many(self, usernames):
+        """usernames is a dict of uid: username"""
+        shared = {}
+        for uid, username in usernames.items():
+            self.local.set(('uid', uid), username)
+            self.local.set(('username', username), uid)
+            shared['identity:uid:{}'.format(uid)] = username
+            shared['identity:username:{}'.format(username)] = uid
+        if shared and self.shared_alias is not None:
+            caches[self.shared_alias].set_many(shared, self.ttl)
+
+
+_identity_cache = None
+_identity_cache_lock = threading.Lock()
+
+
+def identity_cache():
+    """return the IdentityCache of the process"""
+    global _identity_cache
+    with _identity_cache_lock:
+        if _identity_cache is None:
+            _identity_cache = IdentityCache(getattr(settings, 'IDENTITY_CACHE', {}))
+        return _identity_cache
+
+
 def username_to_uid(username):
     """return the uid of a username"""
-    return LdapUser.objects.filter(username=username).get().uid
+    uid = identity_cache().get('username', username)
+    if uid is None:
+        uid = LdapUser.objects.filter(username=username).get().uid
+        identity_cache().set(uid, username)
+    return uid
 
 
 def uid_to_username(uid):
     """return the username of a uid"""
-    return LdapUser.objects.filter(uid=uid).get().username
+    username = identity_cache().get('uid', uid)
+    if username is None:
+        username = LdapUser.objects.filter(uid=uid).get().username
+        identity_cache().set(uid, username)
+    return username
+
+
+def uids_to_usernames(uids):
+    """
+    return a dict of uid: username for multiple uids
+
+    The uids missing from the cache are resolved with a single LDAP search per chunk, unknown uids are not returned.
+    """
+    uids = set(uids)
+    usernames = identity_cache().get_many('uid', uids)
+    missing = list(uids - set(usernames.keys()))
+    for i in range(0, len(missing), 500):
+        found = {user.uid: user.username for user in LdapUser.objects.filter(uid__in=missing[i:i + 500])}
+        identity_cache().set_many(found)
+        usernames.update(found)
+    return usernames
 
 
 def request_to_username(request):
@@ -224,32 +363,81 @@ def anonymize(name):
         return name
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default (connect, read) timeout to every request"""
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
 class Prometheus:
     def __init__(self, config):
+        # The HTTP session is pooled, so the TCP/TLS connections are kept alive between queries
+        self.session = requests.Session()
+        adapter = TimeoutHTTPAdapter(
+            timeout=(config.get('connect_timeout', 5), config.get('read_timeout', 60)),
+            pool_connections=1,
+            pool_maxsize=config.get('pool_size', 20),
+            max_retries=Retry(
+                total=config.get('retries', 3),
+                backoff_factor=config.get('backoff_factor', 0.5),
+                status_forcelist=[408, 429, 500, 502, 503, 504],
+                allowed_methods=['GET'],
+            ))
         self.prom = PrometheusConnect(
             url=config['url'],
-            headers=config['headers'])
+            headers=config['headers'],
+            session=self.session)
+        # PrometheusConnect mount its own adapter on the url, replace it with the pooled one
+        self.session.mount(config['url'], adapter)
         self.filter = config['filter']
+        self.cache_config = config.get('cache')
+        # evaluate the summaries in Prometheus with subqueries, None until the server is probed for them
+        self.summary_subqueries = None if config.get('summary_subqueries', True) else False
+        self.max_workers = config.get('max_workers', 8)
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def get_filter(self, module='default'):
         return self.filter[module]
 
     def query_prometheus(self, query, duration, end=None, step='3m'):
         values = self.query_prometheus_multiple(query, duration, end, step)
+        return self.first_line(values)
+
+    @staticmethod
+    def first_line(values):
+        # return the first line of a query_prometheus_multiple result as (x, y)
         if len(values) == 0:
             raise ValueError
         return (values[0]['x'], values[0]['y'])
 
-    def query_prometheus_multiple(self, query, start, end=None, step='3m'):
+    def query_prometheus_multiple(self, query, start, end=None, step='3m', columnar=False):
+        """
+        Range query returning a list of {'metric', 'x', 'y'}
+
+        x is a list of datetime and y a list of float, or with columnar=True, x is a numpy
+        array of int64 epochs and y a numpy array of float64. Use plotly_timestamps() to
+        format the epochs for a graph.
+        """
         if end is None:
             end = datetime.now()
-        q = self.prom.custom_query_range(
-            query=query,
-            start_time=start,
-            end_time=end,
-            step=step,
-        )
+        q = self.query_range(query, start, end, step)
         return_list = []
+        if columnar:
+            for line in q:
+                count = len(line['values'])
+                return_list.append({
+                    'metric': line['metric'],
+                    'x': np.fromiter((x[0] for x in line['values']), dtype=np.float64, count=count).astype(np.int64),
+                    'y': np.fromiter((x[1] for x in line['values']), dtype=np.float64, count=count),
+                })
+            return return_list
         for line in q:
             return_list.append({
                 'metric': line['metric'],
@@ -258,15 +446,264 @@ class Prometheus:
             })
         return return_list
 
+    def query_range(self, query, start, end, step):
+        """
+        Run a range query through the cache configured in settings.PROMETHEUS['cache']
+
+        start and end are aligned on the step, so the same window requested at a slightly
+        different time will reuse the same cache entry. A window ending in the past can't change
+        anymore and is kept for a long time, a window touching now is only kept for a short time.
+        """
+        step_s = step_seconds(step)
+        start_ts = int(start.timestamp()) // step_s * step_s
+        end_ts = int(end.timestamp()) // step_s * step_s
+        return self.cached('range', '{}|{}|{}|{}'.format(query, start_ts, end_ts, step_s), end_ts, lambda: self.prom.custom_query_range(
+            query=query,
+            start_time=datetime.fromtimestamp(start_ts),
+            end_time=datetime.fromtimestamp(end_ts),
+            step=step,
+        ))
+
+    def cached(self, kind, key, end_ts, fetch):
+        """return fetch() through the cache, with a TTL depending on how far end_ts is in the past"""
+        if self.cache_config is None:
+            return fetch()
+
+        key = 'prometheus:{}:'.format(kind) + hashlib.sha1(key.encode()).hexdigest()
+        cache = caches[self.cache_config.get('alias', 'default')]
+        q = cache.get(key)
+        if q is None:
+            q = fetch()
+            if end_ts < time.time() - self.cache_config.get('recent_window', 900):
+                ttl = self.cache_config.get('ttl_past', 3600 * 24 * 7)
+            else:
+                ttl = self.cache_config.get('ttl_recent', 60)
+            cache.set(key, q, ttl)
+        return q
+
+    def query_summary_multiple(self, query, summary, start, end=None, step='3m'):
+        """
+        Reduce each series of a range query to one value, return a list of {'metric', 'value'}
+
+        summary is avg, max, min or sum. The query is sent as an instant query at the end, such as
+        avg_over_time((query)[duration:step]), so only one value per series is transferred instead of
+        the whole range. Without subqueries support, the range is queried and reduced in Python.
+        """
+        if end is None:
+            end = datetime.now()
+        step_s = step_seconds(step)
+        end_ts = int(end.timestamp()) // step_s * step_s
+        duration = max(end_ts - int(start.timestamp()) // step_s * step_s, step_s)
+
+        if self.subqueries_supported():
+            summary_query = '{}_over_time(({})[{}s:{}s])'.format(summary, query, duration, step_s)
+            q = self.cached('summary', '{}|{}'.format(summary_query, end_ts), end_ts,
+                            lambda: self.prom.custom_query(summary_query, params={'time': end_ts}))
+            return [{'metric': line['metric'], 'value': float(line['value'][1])} for line in q]
+
+        reduce = {'avg': np.mean, 'max': np.max, 'min': np.min, 'sum': np.sum}[summary]
+        values = self.query_prometheus_multiple(query, start, end, step, columnar=True)
+        return [{'metric': line['metric'], 'value': float(reduce(line['y']))} for line in values if len(line['y']) > 0]
+
+    def subqueries_supported(self):
+        """
+        Probe once if the server supports subqueries, added in Prometheus 2.7
+
+        Only a parse error of the probe disables them, the errors of the other queries are raised.
+        """
+        if self.summary_subqueries is None:
+            try:
+                self.prom.custom_query('max_over_time(vector(1)[1m:1m])')
+                self.summary_subqueries = True
+            except PrometheusApiClientException as e:
+                if 'HTTP Status Code 400' not in str(e):
+                    raise
+                self.summary_subqueries = False
+        return self.summary_subqueries
+
+    def query_summary(self, query, summary, start, end=None, step='3m'):
+        """return the value of the first series of query_summary_multiple(), raise ValueError if there is none"""
+        values = self.query_summary_multiple(query, summary, start, end, step)
+        return self.first_value(values)
+
+    @staticmethod
+    def first_value(values):
+        # return the value of the first line of a query_summary_multiple result
+        if len(values) == 0:
+            raise ValueError
+        return values[0]['value']
+
     def query_last(self, query):
         q = self.prom.custom_query(query)
         return q
 
+    def executor(self):
+        # the thread pool is created on first use, so idle processes do not keep threads around
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='prometheus')
+            return self._executor
+
+    def query_many(self, queries):
+        """
+        Run a batch of queries concurrently on a bounded thread pool
+
+        queries is a dict of name: query, each query being a dict with these keys:
+        - query: the PromQL query
+        - start: start of a range query, an instant query is done with query_last if missing
+        - end: end of a range query (optional)
+        - step: step of a range query (optional)
+        - columnar: return numpy arrays for a range query (optional)
+        - summary: reduce each series of a range query with avg, max, min or sum (optional)
+
+        return a dict with the same names and the result of query_prometheus_multiple,
+        query_summary_multiple or query_last. If a query failed, its exception is raised
+        like with a sequential call.
+        """
+        futures = {}
+        for name, query in queries.items():
+            if query.get('start') is None:
+                futures[name] = self.executor().submit(self.query_last, query['query'])
+            elif query.get('summary') is not None:
+                futures[name] = self.executor().submit(
+                    self.query_summary_multiple,
+                    query['query'],
+                    query['summary'],
+                    query['start'],
+                    query.get('end'),
+                    query.get('step', '3m'))
+            else:
+                futures[name] = self.executor().submit(
+                    self.query_prometheus_multiple,
+                    query['query'],
+                    query['start'],
+                    query.get('end'),
+                    query.get('step', '3m'),
+                    query.get('columnar', False))
+        return {name: future.result() for name, future in futures.items()}
+
     def rate(self, exporter_name):
         # return twice the sampling rate of the exporter in seconds
         return int(settings.EXPORTER_SAMPLING_RATE[exporter_name]) * 2
 
 
+def plotly_timestamps(epochs):
+    """
+    Format an array of epochs like datetime.fromtimestamp(x).strftime('%Y-%m-%d %H:%M:%S')
+
+    The local offset is applied on the whole array at once, unless the window could cross a DST change
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if len(epochs) == 0:
+        return []
+    first, last = int(epochs[0]), int(epochs[-1])
+    offset = time.localtime(first).tm_gmtoff
+    if offset == time.localtime(last).tm_gmtoff and last - first < 3600 * 24 * 120:
+        local = epochs + offset
+    else:
+        local = epochs + np.array([time.localtime(int(x)).tm_gmtoff for x in epochs], dtype=np.int64)
+    strings = np.datetime_as_string(local.astype('datetime64[s]'), unit='s')
+    return np.char.replace(strings, 'T', ' ').tolist()
+
+
+class GraphJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder with support for numpy arrays and scalars"""
+    def default(self, o):
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, np.generic):
+            return o.item()
+        return super().default(o)
+
+
+def stdlib_json_dumps(data):
+    """serialize to bytes like JsonResponse does"""
+    return json.dumps(data, cls=GraphJSONEncoder).encode()
+
+
+def orjson_dumps(data):
+    """serialize to bytes with orjson, numpy arrays are serialized natively"""
+    return orjson.dumps(
+        data,
+        default=GraphJSONEncoder().default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+# orjson is optional, the standard library is used when it is not installed
+json_dumps = orjson_dumps if orjson is not None else stdlib_json_dumps
+
+
+class GraphResponse(HttpResponse):
+    """JsonResponse for the graphs, using the fastest encoder available"""
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=json_dumps(data), **kwargs)
+        # kept for the decorators transforming a graph, like incremental_graph
+        self.data = data
+
+
+def trace_ids(traces):
+    """
+    return a stable id for each trace of a graph, its name or name#N for the Nth trace with the same name
+
+    The same ids are computed in traceIds() of custom.js to find the traces of a graph
+    """
+    ids = []
+    seen = {}
+    for i, trace in enumerate(traces):
+        name = str(trace.get('name', i))
+        seen[name] = seen.get(name, 0) + 1
+        ids.append(name if seen[name] == 1 else '{}#{}'.format(name, seen[name] - 1))
+    return ids
+
+
+def graph_since(data, since):
+    """
+    return only the points after since (a datetime) of each trace of a graph, as {'series': {id: {'x', 'y'}}}
+
+    x is a list of datetime or of strings from plotly_timestamps(), both sorted
+    """
+    since_str = since.strftime('%Y-%m-%d %H:%M:%S')
+    series = {}
+    for trace_id, trace in zip(trace_ids(data['data']), data['data']):
+        if 'x' not in trace or 'y' not in trace:
+            continue
+        x = trace['x']
+        first = len(x)
+        for i in range(len(x) - 1, -1, -1):
+            if (x[i] if isinstance(x[i], str) else x[i].strftime('%Y-%m-%d %H:%M:%S')) <= since_str:
+                break
+            first = i
+        series[trace_id] = {'x': x[first:], 'y': trace['y'][first:]}
+    return {'series': series}
+
+
+def step_seconds(step):
+    """return a Prometheus step, such as 60, '60' or '3m', in seconds"""
+    if isinstance(step, (int, float)):
+        return max(int(step), 1)
+    match = re.match(r'^(\d+)(ms|s|m|h|d|w|y)?$', str(step))
+    if match is None:
+        raise ValueError('Invalid step: {}'.format(step))
+    units = {None: 1, 'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 3600 * 24, 'w': 3600 * 24 * 7, 'y': 3600 * 24 * 365}
+    return max(int(int(match.group(1)) * units[match.group(2)]), 1)
+
+
+_prometheus = None
+_prometheus_lock = threading.Lock()
+
+
+def get_prometheus():
+    """return the Prometheus client shared by the whole process, built from settings.PROMETHEUS"""
+    global _prometheus
+    with _prometheus_lock:
+        if _prometheus is None:
+            _prometheus = Prometheus(settings.PROMETHEUS)
+        return _prometheus
+
+
 # Override the function here with the one in local.py if file exist
 if os.path.isfile(os.path.join(os.path.dirname(__file__), 'local.py')):
     from .local import *  # noqa
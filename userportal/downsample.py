@@ -0,0 +1,142 @@
+import warnings
+import numpy as np
+from django.conf import settings
+from django.utils.translation import gettext as _
+from userportal.common import plotly_timestamps
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets, return the indices of the points to keep
+
+    The first and last points are always kept, then for each bucket the point forming
+    the largest triangle with the previous kept point and the average of the next bucket.
+    """
+    length = len(y)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        height = (x[previous] - next_x) * (y[start:end] - y[previous])
+        width = (x[previous] - x[start:end]) * (next_y - y[previous])
+        areas = np.abs(height - width)
+        previous = start + int(np.argmax(areas))
+        indices[i + 1] = previous
+    return indices
+
+
+def minmax_indices(y, threshold):
+    """Min/max envelope, return the indices of the minimum and maximum of each bucket"""
+    length = len(y)
+    buckets = threshold // 2
+    if threshold >= length or buckets < 1:
+        return np.arange(length)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    edges = np.linspace(0, length, buckets + 1).astype(np.int64)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            chunk = y[start:end]
+            indices += [start + int(np.argmin(chunk)), start + int(np.argmax(chunk))]
+    return np.unique(indices)
+
+
+def select_indices(x, y, threshold, mode):
+    if mode == 'minmax':
+        return minmax_indices(y, threshold)
+    return lttb_indices(x, y, threshold)
+
+
+def union_grid(stats):
+    """return the sorted epochs of all the series and a matrix of the values on that grid, NaN where missing"""
+    epochs = np.unique(np.concatenate([line['x'] for line in stats]))
+    matrix = np.full((len(stats), len(epochs)), np.nan)
+    for i, line in enumerate(stats):
+        matrix[i, np.searchsorted(epochs, line['x'])] = line['y']
+    return epochs, matrix
+
+
+def downsample(stats, max_points, mode='lttb', aligned=False):
+    """
+    Downsample columnar series from query_prometheus_multiple(columnar=True)
+
+    max_points is the number of points kept per series. With aligned=True, the same timestamps
+    are kept in every series, chosen on their sum, which is needed for stacked graphs.
+    """
+    if len(stats) == 0 or max(len(line['x']) for line in stats) <= max_points:
+        return stats
+
+    if aligned:
+        epochs, matrix = union_grid(stats)
+        keep = epochs[select_indices(epochs, np.nansum(matrix, axis=0), max_points, mode)]
+        indices = [np.isin(line['x'], keep) for line in stats]
+    else:
+        indices = [select_indices(line['x'], line['y'], max_points, mode) for line in stats]
+
+    return [{'metric': line['metric'], 'x': line['x'][index], 'y': line['y'][index]} for line, index in zip(stats, indices)]
+
+
+def percentile_bands(stats, percentiles):
+    """return the epochs and a dict of percentile: values, computed over all the series at each timestamp"""
+    epochs, matrix = union_grid(stats)
+    with warnings.catch_warnings():
+        # timestamps without any value are returned as NaN
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        values = np.nanpercentile(matrix, percentiles, axis=0)
+    return epochs, dict(zip(percentiles, values))
+
+
+def reduce_stats(request, stats, aligned=False, bands=True):
+    """
+    Apply settings.GRAPH_DOWNSAMPLING to columnar series
+
+    return (stats, None) with the downsampled series, or (None, (epochs, bands)) when there are
+    too many series to show them individually, unless bands is False. The request can disable it with
+    ?downsample=none and ?bands=0 or select the mode with ?downsample=lttb or minmax.
+    """
+    config = getattr(settings, 'GRAPH_DOWNSAMPLING', None)
+    if config is None or len(stats) == 0:
+        return stats, None
+
+    bands_above = config.get('bands_above')
+    if bands and bands_above is not None and len(stats) > bands_above and request.GET.get('bands') != '0':
+        return None, percentile_bands(stats, config.get('percentiles', [10, 50, 90]))
+
+    mode = request.GET.get('downsample', config.get('mode'))
+    if mode not in ['lttb', 'minmax']:
+        return stats, None
+    max_points = max(config.get('max_points', 20000) // len(stats), config.get('min_points_per_series', 100))
+    return downsample(stats, max_points, mode, aligned), None
+
+
+def bands_traces(epochs, bands, hovertemplate='%{y:.1f}'):
+    """return the Plotly traces of percentile bands, each percentile is filled down to the previous one"""
+    x = plotly_timestamps(epochs)
+    data = []
+    for i, percentile in enumerate(sorted(bands)):
+        trace = {
+            'x': x,
+            'y': bands[percentile],
+            'type': 'scatter',
+            'mode': 'lines',
+            'name': _('Percentile {}').format(percentile),
+            'hovertemplate': hovertemplate,
+        }
+        if i > 0:
+            trace['fill'] = 'tonexty'
+        data.append(trace)
+    return data
@@ -0,0 +1,186 @@
+"""
+Live values of running jobs and nodes, streamed with Server-Sent Events
+
+Each stream, like a job or a node, is polled by a single task per event loop at the sampling rate of
+its exporter, whatever the number of viewers. With a shared_cache in LIVE_STREAMS, the values of each
+sampling period are also shared between the processes, so the workers query Prometheus once.
+The views are async and need an ASGI server: under WSGI, Django collects the whole response of an
+async view before sending it, a stream that never ends would hold a worker. They are disabled
+unless LIVE_STREAMS is enabled, and refused when the request does not come from ASGI.
+"""
+import asyncio
+import functools
+import json
+import time
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, StreamingHttpResponse
+
+# number of events kept for a slow viewer, the oldest are dropped
+QUEUE_SIZE = 4
+
+
+class Stream:
+    """One poller and its subscribers, the poller stops when the last subscriber leaves"""
+    def __init__(self, hub, key, interval, fetch):
+        self.hub = hub
+        self.key = key
+        self.interval = interval
+        self.fetch = fetch
+        self.subscribers = set()
+        self.last = None
+        self.task = None
+
+    def cached_fetch(self):
+        alias = settings.LIVE_STREAMS.get('shared_cache')
+        if alias is None:
+            return {'time': int(time.time()), 'values': self.fetch()}
+        # the processes polling the same stream share the values of each sampling period
+        cache = caches[alias]
+        slot = int(time.time() // self.interval)
+        cache_key = 'live:{}:{}'.format(self.key, slot)
+        event = cache.get(cache_key)
+        if event is None:
+            event = {'time': int(time.time()), 'values': self.fetch()}
+            cache.set(cache_key, event, self.interval * 2)
+        return event
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                start = time.monotonic()
+                try:
+                    event = await sync_to_async(self.cached_fetch, thread_sensitive=False)()
+                    self.publish('values', event)
+                except Exception:
+                    self.publish('error', {'time': int(time.time())})
+                await asyncio.sleep(max(self.interval - (time.monotonic() - start), 1))
+        finally:
+            self.hub.remove(self)
+
+    def publish(self, name, data):
+        self.last = 'event: {}\ndata: {}\n\n'.format(name, json.dumps(data))
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self.last)
+
+
+class Hub:
+    """Streams of an event loop"""
+    def __init__(self):
+        self.streams = {}
+
+    def subscribe(self, key, interval, fetch):
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = Stream(self, key, interval, fetch)
+        queue = asyncio.Queue(QUEUE_SIZE)
+        if stream.last is not None:
+            # the new viewer gets the last values without waiting for the next poll
+            queue.put_nowait(stream.last)
+        stream.subscribers.add(queue)
+        if stream.task is None:
+            stream.task = asyncio.ensure_future(stream.run())
+        return stream, queue
+
+    def unsubscribe(self, stream, queue):
+        stream.subscribers.discard(queue)
+        if not stream.subscribers:
+            # a new viewer will start a new poller
+            self.remove(stream)
+            if stream.task is not None:
+                stream.task.cancel()
+
+    def remove(self, stream):
+        if self.streams.get(stream.key) is stream:
+            del self.streams[stream.key]
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    """return the hub of the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = Hub()
+    return _hubs[loop]
+
+
+def sampling_rate(exporter_name):
+    return int(settings.EXPORTER_SAMPLING_RATE[exporter_name])
+
+
+def instant_values(results):
+    """return the first value of each result of query_many with instant queries, None when a series is missing"""
+    values = {}
+    for name, result in results.items():
+        values[name] = float(result[0]['value'][1]) if len(result) > 0 else None
+    return values
+
+
+def live_enabled():
+    return settings.LIVE_STREAMS.get('enabled', False)
+
+
+def event_stream(request, key, interval, fetch):
+    """
+    return a text/event-stream response of the values returned by fetch() every interval seconds
+
+    fetch is a sync function called in a thread, shared by all the viewers of the same key.
+    return 404 when the live streams are disabled, and 501 when the request does not come from ASGI.
+    """
+    if not live_enabled():
+        return HttpResponseNotFound()
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('The live streams need an ASGI server', status=501, content_type='text/plain')
+
+    async def events():
+        hub = get_hub()
+        stream, queue = hub.subscribe(key, interval, fetch)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=interval * 2)
+                except asyncio.TimeoutError:
+                    # keep the connection open through the proxies
+                    yield ': keepalive\n\n'
+        finally:
+            hub.unsubscribe(stream, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # disable the buffering of nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def async_user_or_staff(func):
+    """login_required and user_or_staff for the async views"""
+    @functools.wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if user.get_username() != kwargs['username'] and not user.is_staff:
+            return HttpResponseForbidden()
+        return await func(request, *args, **kwargs)
+    return wrapper
+
+
+def async_staff(func):
+    """login_required and staff for the async views"""
+    @functools.wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not user.is_staff:
+            return HttpResponseForbidden()
+        return await func(request, *args, **kwargs)
+    return wrapper
@@ -149,6 +149,30 @@ BASE_URL = '/'
 STATIC_URL = '/static/'
 STATIC_ROOT = '/opt/userportal/collected-static/'
 
+# Cache, used to store the results of Prometheus queries
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The local memory cache is per process, a shared cache is recommended in production with multiple workers:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': '/var/tmp/userportal_cache',
+# or
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#     'LOCATION': 'redis://127.0.0.1:6379',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+# Current usage of the running jobs and of the nodes, streamed with Server-Sent Events
+# Each viewer holds a connection, enable only when the portal runs under ASGI (ASGI=1 in run-django-production.sh)
+LIVE_STREAMS = {
+    'enabled': False,
+    'shared_cache': None,  # alias in CACHES shared by all the processes, like a redis cache, None to poll in each process
+}
+
 AUTHENTICATION_BACKENDS = [
     'userportal.authentication.staffRemoteUserBackend',
     'django.contrib.auth.backends.ModelBackend',
@@ -173,6 +197,7 @@ SETTINGS_EXPORT = [
     'OTHER_PORTALS',
     'BASE_URL',
     'DEMO',
+    'LIVE_STREAMS',
 ]
 
 INTERNAL_IPS = [
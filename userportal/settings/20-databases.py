@@ -32,6 +32,13 @@ DATABASES = {
     },
 }
 
+# Cache of the uid <-> username mapping read from LDAP
+IDENTITY_CACHE = {
+    'size': 10000,  # entries kept by each process
+    'ttl': 3600,  # seconds
+    'shared_cache': None,  # alias in CACHES shared by all the processes, like 'default', None to disable
+}
+
 WATCHMAN_DATABASES = ['default', 'slurm']
 
 DATABASE_ROUTERS = ['database_routers.dbrouters.DbRouter']
\ No newline at end of file
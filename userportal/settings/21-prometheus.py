@@ -5,6 +5,34 @@ PROMETHEUS = {
         'default': "cluster='narval'",
         'cloudstats': "cluster='narval', instance=~'blg.*'" # example to override the default filter for a specific module
     },
+    # HTTP client, the connections are pooled and shared by the whole process
+    'connect_timeout': 5,  # seconds
+    'read_timeout': 60,  # seconds
+    'retries': 3,  # retries with exponential backoff on connection errors and 5xx
+    'backoff_factor': 0.5,
+    'pool_size': 20,  # keep-alive connections kept in the pool
+    'max_workers': 8,  # threads used by query_many() to run queries concurrently
+    # Cache for the range queries, using the Django cache from CACHES, remove to disable
+    'cache': {
+        'alias': 'default',
+        'ttl_past': 3600 * 24 * 7,  # seconds, for windows ending in the past, like a completed job
+        'ttl_recent': 60,  # seconds, for windows ending close to now
+        'recent_window': 900,  # seconds, a window ending within this delay of now is recent
+    },
+    # compute the averages and maximums of the job pages in Prometheus with *_over_time subqueries
+    # instead of transferring the whole range, the server is probed once for the support of subqueries,
+    # set to False to never use them
+    'summary_subqueries': True,
 }
 
-PROM_NODE_HOSTNAME_LABEL = 'instance'
\ No newline at end of file
+PROM_NODE_HOSTNAME_LABEL = 'instance'
+
+# Downsampling of the graphs with many series, like the graphs per core of a job
+# Set to None to always return all the points of all the series
+GRAPH_DOWNSAMPLING = {
+    'mode': 'lttb',  # lttb (Largest-Triangle-Three-Buckets) or minmax (min/max envelope)
+    'max_points': 20000,  # maximum number of points in a graph, split between its series
+    'min_points_per_series': 100,
+    'bands_above': 64,  # with more series, show percentile bands instead, None to disable
+    'percentiles': [10, 50, 90],
+}
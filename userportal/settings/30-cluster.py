@@ -935,3 +935,8 @@ SOFTWARE_STACK_REGEX = [
 POSIX_PERSONAL_GROUP_USAGE_NOTE = 'Files should not be stored on the project filesystem with a personal group. <a href="https://docs.alliancecan.ca/wiki/Frequently_Asked_Questions#Disk_quota_exceeded_error_on_/project_filesystems">Learn More</a>'
 
 LOCALSCRATCH = '/localscratch'
+
+# Snapshots of the top pages, taken every minute by "manage.py top_snapshots --loop 60"
+TOP_SNAPSHOT_MAX_AGE = 120  # seconds, an older snapshot is not shown as the current one, a new one is taken
+TOP_SNAPSHOT_RETENTION_DAYS = 90  # the older snapshots are deleted
+TOP_SNAPSHOT_HOURLY_AFTER_DAYS = 2  # one snapshot per hour is kept after this number of days
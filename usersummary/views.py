@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect
-from userportal.common import user_or_staff, Prometheus, username_to_uid, parse_start_end
+from userportal.common import user_or_staff, get_prometheus, username_to_uid, parse_start_end, GraphResponse
 from userportal.common import storage_allocations
 from django.contrib.auth.decorators import login_required
 from django.utils.translation import gettext as _
@@ -8,7 +8,7 @@ from django.conf import settings
 from django.http import JsonResponse, HttpResponseForbidden
 from datetime import timedelta
 
-prom = Prometheus(settings.PROMETHEUS)
+prom = get_prometheus()
 
 
 @login_required
@@ -64,15 +64,10 @@ def user(request, username):
 
         context['jobs'] = (pending_jobs | job_start | job_end)[:10]
 
-        running_jobs = JobTable.objects.filter(id_user=uid, state=1).all()
-        context['total_cores'] = 0
-        context['total_mem'] = 0
-        context['total_gpus'] = 0
-        for job in running_jobs:
-            info = job.parse_tres_req()
-            context['total_cores'] += info['total_cores']
-            context['total_mem'] += (info['total_mem'] * 1024 * 1024)
-            context['total_gpus'] += job.gpu_count()
+        running = JobTable.objects.filter(id_user=uid, state=JobTable.StatesJob.RUNNING).resources_summary()
+        context['total_cores'] = running.cores
+        context['total_mem'] = running.mem
+        context['total_gpus'] = running.gpus
 
     return render(request, 'usersummary/user.html', context)
 
@@ -122,7 +117,7 @@ def graph_inodes(request, username, resource_type, resource_name):
         'width': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})
 
 
 @login_required
@@ -172,4 +167,4 @@ def graph_bytes(request, username, resource_type, resource_name):
         'width': 300,
     }
 
-    return JsonResponse({'data': data, 'layout': layout})
+    return GraphResponse({'data': data, 'layout': layout})